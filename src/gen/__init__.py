@@ -11,6 +11,7 @@ from gen._core import (
     MeasurementTracker,
     min_max_complex,
     NoiseModel,
+    NoisyCircuitTemplate,
     NoiseRule,
     occurs_in_classical_control_system,
     Patch,
@@ -7,6 +7,7 @@ from gen._core._measurement_tracker import (
 )
 from gen._core._noise import (
     NoiseModel,
+    NoisyCircuitTemplate,
     NoiseRule,
     occurs_in_classical_control_system,
 )
@@ -103,16 +103,22 @@ class Builder:
         self.circuit.append("SHIFT_COORDS", [], [dp.real, dp.imag, dt])
 
     def measure_patch(self, patch: 'Patch', *, save_layer: Any, cmp_layer: Optional[Any] = None) -> None:
-        for tile in patch.tiles:
-            self.measure_pauli_product(q2b={
-                tile.ordered_data_qubits[k]: tile.bases[k]
-                for k in range(len(tile.ordered_data_qubits))
-                if tile.ordered_data_qubits[k] is not None
-            }, key=AtLayer(tile.measurement_qubit, save_layer))
+        self.measure_pauli_products(
+            q2bs=[
+                {
+                    tile.ordered_data_qubits[k]: tile.bases[k]
+                    for k in range(len(tile.ordered_data_qubits))
+                    if tile.ordered_data_qubits[k] is not None
+                }
+                for tile in patch.tiles
+            ],
+            keys=[AtLayer(tile.measurement_qubit, save_layer) for tile in patch.tiles],
+        )
         if cmp_layer is not None:
-            for tile in patch.tiles:
-                m = tile.measurement_qubit
-                self.detector([AtLayer(m, save_layer), AtLayer(m, cmp_layer)], pos=m)
+            self.detectors(
+                [[AtLayer(tile.measurement_qubit, save_layer), AtLayer(tile.measurement_qubit, cmp_layer)] for tile in patch.tiles],
+                positions=[tile.measurement_qubit for tile in patch.tiles],
+            )
 
     def demolition_measure_with_feedback_passthrough(
             self,
@@ -244,6 +250,52 @@ class Builder:
         else:
             self.tracker.make_measurement_group([], key=key)
 
+    def measure_pauli_products(self,
+                               q2bs: Iterable[Dict[complex, str]],
+                               *,
+                               keys: Iterable[Any],
+                               noise: Optional[float] = None) -> None:
+        """Adds one MPP operation measuring many Pauli products.
+
+        Equivalent to calling `measure_pauli_product(q2b=q2b, key=key, noise=noise)`
+        for each product and key in order (stim fuses the resulting MPP operations
+        into one anyway), but the targets are produced in a single pass and all the
+        keys are recorded at once.
+
+        Args:
+            q2bs: The products to measure. Each is a mapping from qubit to basis.
+            keys: Measurement keys to track the results under, one for each product.
+            noise: Make the measurements noisy.
+        """
+        q2bs = list(q2bs)
+        keys = list(keys)
+        if len(q2bs) != len(keys):
+            raise ValueError(f'{len(q2bs)=} != {len(keys)=}')
+
+        q2i = self.q2i
+        product_texts = []
+        measured_keys = []
+        empty_keys = []
+        for q2b, key in zip(q2bs, keys):
+            terms = []
+            for q in sorted_complex(q2b.keys()):
+                b = q2b[q]
+                if b != 'X' and b != 'Y' and b != 'Z':
+                    raise NotImplementedError(f'{b=}')
+                terms.append(f'{b}{q2i[q]}')
+            if terms:
+                product_texts.append('*'.join(terms))
+                measured_keys.append(key)
+            else:
+                empty_keys.append(key)
+
+        self.tracker.record_measurements(measured_keys)
+        for key in empty_keys:
+            self.tracker.make_measurement_group([], key=key)
+        if product_texts:
+            name = 'MPP' if noise is None else f'MPP({float(noise)!r})'
+            self.circuit += stim.Circuit(f'{name} {" ".join(product_texts)}')
+
     def detector(self,
                  keys: Iterable[Any],
                  *,
@@ -268,6 +320,49 @@ class Builder:
         targets = self.tracker.current_measurement_record_targets_for(keys)
         self.circuit.append('DETECTOR', targets, coords)
 
+    def detectors(self,
+                  key_groups: Iterable[Iterable[Any]],
+                  *,
+                  positions: Iterable[Optional[complex]],
+                  t: float = 0,
+                  post_selected: Optional[Iterable[bool]] = None) -> None:
+        """Adds many detectors at once.
+
+        Equivalent to calling `detector(keys, pos=pos, t=t, mark_as_post_selected=s)`
+        for each group of keys, position, and post selection flag in order, but
+        the record targets of all the detectors are resolved together by the
+        tracker and the detectors are parsed from text instead of appended one
+        target at a time.
+
+        Args:
+            key_groups: The measurement keys of each detector.
+            positions: The position of each detector, or None for no coordinates.
+            t: The time coordinate of the detectors.
+            post_selected: Whether to mark each detector as post selected.
+                Defaults to not marking any of them.
+        """
+        key_groups = list(key_groups)
+        positions = list(positions)
+        post_selected = [False] * len(positions) if post_selected is None else list(post_selected)
+        if not (len(key_groups) == len(positions) == len(post_selected)):
+            raise ValueError(f'{len(key_groups)=}, {len(positions)=}, and {len(post_selected)=} differ.')
+
+        lines = []
+        offsets = self.tracker.current_measurement_record_offsets_for_groups(key_groups)
+        for pos, marked, group_offsets in zip(positions, post_selected, offsets):
+            if pos is not None:
+                coords = [pos.real, pos.imag, t]
+                if marked:
+                    coords.append(1)
+                line = 'DETECTOR(' + ','.join(repr(float(c)) for c in coords) + ')'
+            elif marked:
+                raise ValueError('pos is None and mark_as_post_selected')
+            else:
+                line = 'DETECTOR'
+            lines.append(' '.join([line, *[f'rec[{k}]' for k in group_offsets.tolist()]]))
+        if lines:
+            self.circuit += stim.Circuit('\n'.join(lines))
+
     def obs_include(self,
                     keys: Iterable[Any],
                     *,
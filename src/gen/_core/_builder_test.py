@@ -1,6 +1,8 @@
+import pytest
 import stim
 
 from gen._core._builder import Builder
+from gen._core._measurement_tracker import AtLayer
 
 
 def test_builder_init():
@@ -10,3 +12,70 @@ def test_builder_init():
         QUBIT_COORDS(0, 1) 1
         QUBIT_COORDS(3, 2) 2
     """)
+
+
+def test_measure_pauli_products():
+    q2bs = [
+        {1j: 'Z', 0: 'X'},
+        {},
+        {3 + 2j: 'Y'},
+    ]
+
+    expected = Builder.for_qubits([0, 1j, 3 + 2j])
+    expected.gate('H', [0])
+    for k, q2b in enumerate(q2bs):
+        expected.measure_pauli_product(q2b=q2b, key=('m', k), noise=0.125)
+
+    builder = Builder.for_qubits([0, 1j, 3 + 2j])
+    builder.gate('H', [0])
+    builder.measure_pauli_products(q2bs, keys=[('m', k) for k in range(3)], noise=0.125)
+    assert builder.circuit == expected.circuit
+    assert builder.circuit[-1] == stim.CircuitInstruction('MPP', [
+        stim.target_x(0),
+        stim.target_combiner(),
+        stim.target_z(1),
+        stim.target_y(2),
+    ], [0.125])
+    assert builder.tracker.recorded == expected.tracker.recorded
+    assert builder.tracker.next_measurement_index == 2
+
+    builder.measure_pauli_products([], keys=[])
+    assert builder.circuit == expected.circuit
+
+    with pytest.raises(ValueError, match='collision'):
+        builder.measure_pauli_products([{0: 'Z'}], keys=[('m', 2)])
+    with pytest.raises(ValueError, match='collision'):
+        builder.measure_pauli_products([{0: 'Z'}, {0: 'X'}], keys=['a', 'a'])
+    with pytest.raises(ValueError):
+        builder.measure_pauli_products([{0: 'Z'}], keys=[])
+    with pytest.raises(NotImplementedError):
+        builder.measure_pauli_products([{0: 'W'}], keys=['b'])
+    assert builder.tracker.next_measurement_index == 2
+    assert 'a' not in builder.tracker.recorded
+
+
+def test_detectors():
+    qubits = [0, 1j, 2, 3 + 2j]
+    key_groups = [[0, 1j], [1j, 2, 1j], [], [2, 3 + 2j]]
+    positions = [0, 1.5 + 1j / 3, None, 2]
+    post_selected = [False, True, False, False]
+
+    expected = Builder.for_qubits(qubits)
+    expected.measure(qubits, save_layer='m')
+    for keys, pos, marked in zip(key_groups, positions, post_selected):
+        expected.detector([AtLayer(q, 'm') for q in keys], pos=pos, t=0.5, mark_as_post_selected=marked)
+
+    builder = Builder.for_qubits(qubits)
+    builder.measure(qubits, save_layer='m')
+    builder.detectors(
+        [[AtLayer(q, 'm') for q in keys] for keys in key_groups],
+        positions=positions,
+        t=0.5,
+        post_selected=post_selected,
+    )
+    assert builder.circuit == expected.circuit
+
+    with pytest.raises(ValueError):
+        builder.detectors([['a']], positions=[0, 1])
+    with pytest.raises(ValueError, match='No such measurement'):
+        builder.detectors([[AtLayer('missing', 'm')]], positions=[0])
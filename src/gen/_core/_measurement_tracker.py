@@ -1,6 +1,8 @@
+import collections.abc
 import dataclasses
-from typing import Iterable, Dict, Any, Optional, List, TYPE_CHECKING
+from typing import Iterable, Dict, Any, Optional, List, Iterator
 
+import numpy as np
 import stim
 
 
@@ -11,48 +13,170 @@ class AtLayer:
     layer: Any
 
 
+def _index_array(values: Iterable[int]) -> np.ndarray:
+    """Converts measurement indices into a read-only array, cancelling out repeated indices in pairs."""
+    if isinstance(values, np.ndarray):
+        result = np.array(values, dtype=np.int64)
+    else:
+        result = np.fromiter(values, dtype=np.int64)
+    if len(result) > 1:
+        result, counts = np.unique(result, return_counts=True)
+        result = result[counts & 1 == 1]
+    result.flags.writeable = False
+    return result
+
+
 class MeasurementTracker:
-    """Tracks measurements and groups of measurements, for producing stim record targets."""
+    """Tracks measurements and groups of measurements, for producing stim record targets.
+
+    Keys are interned into integer ids, and each id's measurement indices are
+    stored as a sorted NumPy array (or None, for obstacles). `recorded` is a
+    dictionary-like view of the same data, using lists of indices.
+    """
     def __init__(self):
-        self.recorded: Dict[Any, Optional[List[int]]] = {}
+        self._key_ids: Dict[Any, int] = {}
+        self._indices: List[Optional[np.ndarray]] = []
         self.next_measurement_index = 0
 
+    @property
+    def recorded(self) -> '_RecordedMeasurements':
+        return _RecordedMeasurements(self)
+
     def copy(self) -> 'MeasurementTracker':
         result = MeasurementTracker()
-        result.recorded = {k: list(v) for k, v in self.recorded.items()}
+        result._key_ids = dict(self._key_ids)
+        result._indices = list(self._indices)
         result.next_measurement_index = self.next_measurement_index
         return result
 
-    def _rec(self, key: Any, value: Optional[List[int]]) -> None:
-        if key in self.recorded:
+    def _set(self, key: Any, value: Optional[np.ndarray]) -> None:
+        key_id = self._key_ids.get(key)
+        if key_id is None:
+            self._key_ids[key] = len(self._indices)
+            self._indices.append(value)
+        else:
+            self._indices[key_id] = value
+
+    def _rec(self, key: Any, value: Optional[np.ndarray]) -> None:
+        if key in self._key_ids:
             raise ValueError(f'Measurement key collision: {key=}')
-        self.recorded[key] = value
+        self._set(key, value)
 
     def record_measurement(self, key: Any) -> None:
-        self._rec(key, [self.next_measurement_index])
+        self._rec(key, _index_array([self.next_measurement_index]))
         self.next_measurement_index += 1
 
+    def record_measurements(self, keys: Iterable[Any]) -> None:
+        """Records consecutive measurements, like calling `record_measurement` for each key in order.
+
+        Nothing is recorded if any of the keys collide.
+        """
+        keys = list(keys)
+        seen = set()
+        for key in keys:
+            if key in self._key_ids or key in seen:
+                raise ValueError(f'Measurement key collision: {key=}')
+            seen.add(key)
+        indices = np.arange(self.next_measurement_index, self.next_measurement_index + len(keys), dtype=np.int64)
+        indices.flags.writeable = False
+        for k, key in enumerate(keys):
+            self._set(key, indices[k:k + 1])
+        self.next_measurement_index += len(keys)
+
     def make_measurement_group(self, sub_keys: Iterable[Any], *, key: Any) -> None:
-        self._rec(key, self.measurement_indices(sub_keys))
+        self._rec(key, self._combined_indices(sub_keys))
 
     def record_obstacle(self, key: Any) -> None:
         self._rec(key, None)
 
+    def _key_indices(self, key: Any) -> np.ndarray:
+        key_id = self._key_ids.get(key)
+        if key_id is None:
+            raise ValueError(f"No such measurement: {key=}")
+        result = self._indices[key_id]
+        if result is None:
+            raise ValueError(f"Obstacle at {key=}")
+        return result
+
+    def _combined_indices(self, keys: Iterable[Any]) -> np.ndarray:
+        arrays = [self._key_indices(key) for key in keys]
+        if len(arrays) == 1:
+            return arrays[0]
+        return _index_array(np.concatenate(arrays) if arrays else ())
+
     def measurement_indices(self, keys: Iterable[Any]) -> List[int]:
-        result = set()
-        for key in keys:
-            if key not in self.recorded:
-                raise ValueError(f"No such measurement: {key=}")
-            for v in self.recorded[key]:
-                if v is None:
-                    raise ValueError(f"Obstacle at {key=}")
-                if v in result:
-                    result.remove(v)
-                else:
-                    result.add(v)
-        return sorted(result)
+        return self._combined_indices(keys).tolist()
 
     def current_measurement_record_targets_for(self, keys: Iterable[Any]) -> List[stim.GateTarget]:
         t0 = self.next_measurement_index
         times = self.measurement_indices(keys)
-        return [stim.target_rec(t - t0) for t in sorted(times)]
+        return [stim.target_rec(t - t0) for t in times]
+
+    def current_measurement_record_offsets_for_groups(self, key_groups: Iterable[Iterable[Any]]) -> List[np.ndarray]:
+        """Resolves many groups of keys into measurement record lookbacks at once.
+
+        Each group is combined like `measurement_indices` (indices appearing
+        an even number of times cancel out), with the XOR of all the groups
+        computed together in a few vectorized NumPy calls.
+
+        Args:
+            key_groups: The groups of keys to resolve.
+
+        Returns:
+            For each group, a sorted array of negative offsets from the next
+            measurement (the values to give to `stim.target_rec`).
+
+        Raises:
+            ValueError: A key wasn't recorded, or is an obstacle.
+        """
+        arrays = []
+        array_groups = []
+        num_groups = 0
+        for keys in key_groups:
+            for key in keys:
+                arrays.append(self._key_indices(key))
+                array_groups.append(num_groups)
+            num_groups += 1
+        if not arrays:
+            return [np.zeros(0, dtype=np.int64) for _ in range(num_groups)]
+
+        lengths = np.fromiter((len(a) for a in arrays), dtype=np.int64, count=len(arrays))
+        values = np.concatenate(arrays)
+        groups = np.repeat(np.array(array_groups, dtype=np.int64), lengths)
+        span = max(int(values.max()) + 1, 1) if len(values) else 1
+        combined, counts = np.unique(groups * span + values, return_counts=True)
+        combined = combined[counts & 1 == 1]
+        kept_groups = combined // span
+        offsets = combined % span - self.next_measurement_index
+        boundaries = np.searchsorted(kept_groups, np.arange(num_groups + 1))
+        return [offsets[boundaries[k]:boundaries[k + 1]] for k in range(num_groups)]
+
+
+class _RecordedMeasurements(collections.abc.MutableMapping):
+    """A dictionary-like view of the measurement indices (or obstacles) recorded under each key.
+
+    Assigning a list of indices directly sets a key's record, without checking
+    for collisions.
+    """
+
+    def __init__(self, tracker: MeasurementTracker):
+        self._tracker = tracker
+
+    def __getitem__(self, key: Any) -> Optional[List[int]]:
+        value = self._tracker._indices[self._tracker._key_ids[key]]
+        return None if value is None else value.tolist()
+
+    def __setitem__(self, key: Any, value: Optional[Iterable[int]]) -> None:
+        self._tracker._set(key, None if value is None else _index_array(value))
+
+    def __delitem__(self, key: Any) -> None:
+        del self._tracker._key_ids[key]
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._tracker._key_ids
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._tracker._key_ids)
+
+    def __len__(self) -> int:
+        return len(self._tracker._key_ids)
@@ -0,0 +1,86 @@
+import random
+
+import pytest
+import stim
+
+from gen._core._measurement_tracker import AtLayer, MeasurementTracker
+
+
+def test_measurement_tracker_records():
+    tracker = MeasurementTracker()
+    tracker.record_measurement('a')
+    tracker.record_measurements(['b', AtLayer(1j, 'c')])
+    tracker.make_measurement_group(['a', 'b', 'a'], key='g')
+    tracker.make_measurement_group([], key='empty')
+    tracker.record_obstacle('o')
+    assert tracker.next_measurement_index == 3
+    assert dict(tracker.recorded) == {
+        'a': [0],
+        'b': [1],
+        AtLayer(1j, 'c'): [2],
+        'g': [1],
+        'empty': [],
+        'o': None,
+    }
+    assert tracker.measurement_indices(['g', AtLayer(1j, 'c'), 'a']) == [0, 1, 2]
+    assert tracker.measurement_indices(['g', 'b']) == []
+    assert tracker.current_measurement_record_targets_for(['a', AtLayer(1j, 'c')]) == [
+        stim.target_rec(-3),
+        stim.target_rec(-1),
+    ]
+
+    with pytest.raises(ValueError, match='collision'):
+        tracker.record_measurement('a')
+    with pytest.raises(ValueError, match='collision'):
+        tracker.make_measurement_group(['b'], key='o')
+    with pytest.raises(ValueError, match='collision'):
+        tracker.record_measurements(['x', 'a'])
+    with pytest.raises(ValueError, match='No such measurement'):
+        tracker.measurement_indices(['a', 'missing'])
+    with pytest.raises(ValueError, match='Obstacle'):
+        tracker.measurement_indices(['o'])
+    with pytest.raises(ValueError, match='Obstacle'):
+        tracker.current_measurement_record_offsets_for_groups([['a'], ['b', 'o']])
+    assert 'x' not in tracker.recorded
+    assert tracker.next_measurement_index == 3
+
+
+def test_measurement_tracker_recorded_view():
+    tracker = MeasurementTracker()
+    tracker.record_measurements(['a', 'b'])
+    tracker.recorded['a'] = [5, 3, 5, 2]
+    tracker.recorded['new'] = tracker.recorded['b']
+    tracker.recorded['o'] = None
+    assert tracker.recorded['a'] == [2, 3]
+    assert tracker.recorded['new'] == [1]
+    assert len(tracker.recorded) == 4
+    assert 'o' in tracker.recorded
+    del tracker.recorded['o']
+    assert 'o' not in tracker.recorded
+    assert list(tracker.recorded) == ['a', 'b', 'new']
+
+    copy = tracker.copy()
+    copy.record_measurement('c')
+    copy.recorded['a'] = [0]
+    assert tracker.recorded == {'a': [2, 3], 'b': [1], 'new': [1]}
+    assert copy.recorded == {'a': [0], 'b': [1], 'new': [1], 'c': [2]}
+    assert tracker.next_measurement_index == 2
+
+
+def test_current_measurement_record_offsets_for_groups():
+    rng = random.Random(5)
+    tracker = MeasurementTracker()
+    tracker.record_measurements(range(50))
+    for k in range(20):
+        tracker.make_measurement_group(rng.sample(range(50), rng.randrange(5)), key=('g', k))
+    tracker.next_measurement_index += 7
+    keys = list(tracker.recorded)
+
+    groups = [[rng.choice(keys) for _ in range(rng.randrange(6))] for _ in range(100)]
+    actual = tracker.current_measurement_record_offsets_for_groups(groups)
+    assert len(actual) == len(groups)
+    for group, offsets in zip(groups, actual):
+        assert offsets.tolist() == [t - 57 for t in tracker.measurement_indices(group)]
+
+    assert tracker.current_measurement_record_offsets_for_groups([]) == []
+    assert [e.tolist() for e in tracker.current_measurement_record_offsets_for_groups([[], []])] == [[], []]
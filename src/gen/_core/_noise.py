@@ -1,7 +1,8 @@
-from typing import Optional, Dict, Set, List, Iterator, Union, AbstractSet, DefaultDict, Any
+from typing import Optional, Dict, Set, List, Iterator, Union, AbstractSet, DefaultDict, Any, Callable, Tuple
 
 import collections
 
+import numpy as np
 import stim
 
 CLIFFORD_1Q = 'C1'
@@ -363,32 +364,64 @@ class NoiseModel:
         Returns:
             The noisy version of the circuit.
         """
+        return self._noisy_circuit(
+            circuit,
+            system_qubits=system_qubits,
+            immune_qubits=immune_qubits,
+            compiled=True,
+        )
+
+    def _noisy_circuit(self,
+                       circuit: stim.Circuit,
+                       *,
+                       system_qubits: Optional[Set[int]] = None,
+                       immune_qubits: Optional[AbstractSet[int]] = None,
+                       compiled: bool = True,
+                       ) -> stim.Circuit:
+        """Implements `noisy_circuit`.
+
+        Args:
+            compiled: Whether to handle moments with `_CompiledNoisePass`
+                (falling back to `_append_noisy_moment` for moments it doesn't
+                support), or only with `_append_noisy_moment`. Both produce
+                the same circuit.
+        """
         if system_qubits is None:
             system_qubits = set(range(circuit.num_qubits))
         if immune_qubits is None:
             immune_qubits = set()
 
         result = stim.Circuit()
+        noise_pass = _CompiledNoisePass(
+            self,
+            num_qubits=circuit.num_qubits,
+            system_qubits=system_qubits,
+            immune_qubits=immune_qubits,
+        ) if compiled else None
 
         first = True
-        for moment_split_ops in _iter_split_op_moments(circuit, immune_qubits=immune_qubits):
+        for moment_ops in _iter_moments(circuit):
             if first:
                 first = False
             elif result and isinstance(result[-1], stim.CircuitRepeatBlock):
                 pass
             else:
                 result.append('TICK')
-            if isinstance(moment_split_ops, stim.CircuitRepeatBlock):
-                noisy_body = self.noisy_circuit(
-                    moment_split_ops.body_copy(),
+            if isinstance(moment_ops, stim.CircuitRepeatBlock):
+                noisy_body = self._noisy_repeat_body(
+                    moment_ops.body_copy(),
                     system_qubits=system_qubits,
                     immune_qubits=immune_qubits,
+                    compiled=compiled,
                 )
-                noisy_body.append('TICK')
-                result.append(stim.CircuitRepeatBlock(repeat_count=moment_split_ops.repeat_count, body=noisy_body))
-            else:
+                result.append(stim.CircuitRepeatBlock(repeat_count=moment_ops.repeat_count, body=noisy_body))
+            elif noise_pass is None or not noise_pass.append_noisy_moment(moment_ops, out=result):
                 self._append_noisy_moment(
-                    moment_split_ops=moment_split_ops,
+                    moment_split_ops=[
+                        split_op
+                        for op in moment_ops
+                        for split_op in _split_targets_if_needed(op, immune_qubits=immune_qubits)
+                    ],
                     out=result,
                     system_qubits=system_qubits,
                     immune_qubits=immune_qubits,
@@ -396,6 +429,467 @@ class NoiseModel:
 
         return result
 
+    def _noisy_repeat_body(self,
+                           body: stim.Circuit,
+                           *,
+                           system_qubits: AbstractSet[int],
+                           immune_qubits: AbstractSet[int],
+                           compiled: bool,
+                           ) -> stim.Circuit:
+        """Returns the noisy body (ending with a TICK) of a REPEAT block.
+
+        When compiling, results are memoized in `_NOISY_REPEAT_BODY_CACHE`, so
+        that circuits differing only in repeat counts (e.g. a sweep over the
+        number of rounds) make each distinct loop body noisy once. The
+        returned circuit may be shared with the cache and must not be mutated.
+        """
+        cache = _NOISY_REPEAT_BODY_CACHE
+        fingerprint = self._fingerprint() if compiled else None
+        key = None
+        if fingerprint is not None:
+            # `str` rounds gate arguments (like coordinates) to 6 significant digits, so they're added exactly.
+            key = (str(body), _gate_args(body), frozenset(system_qubits), frozenset(immune_qubits), fingerprint)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+
+        noisy_body = self._noisy_circuit(
+            body,
+            system_qubits=system_qubits,
+            immune_qubits=immune_qubits,
+            compiled=compiled,
+        )
+        noisy_body.append('TICK')
+        if key is not None:
+            cache.put(key, noisy_body)
+        return noisy_body
+
+    def _fingerprint(self) -> Optional[Tuple[Any, ...]]:
+        """A hashable value that's equal for noise models that add the same noise.
+
+        Returns None for models whose behavior may not be captured by their
+        fields (subclasses, or rules that aren't plain `NoiseRule`s).
+        """
+        rules = [
+            self.tick_noise,
+            self.any_measurement_rule,
+            self.any_clifford_1q_rule,
+            self.any_clifford_2q_rule,
+            *self.gate_rules.values(),
+            *(self.measure_rules or {}).values(),
+        ]
+        if type(self) is not NoiseModel or any(rule is not None and type(rule) is not NoiseRule for rule in rules):
+            return None
+
+        def rule_key(rule: Optional[NoiseRule]) -> Any:
+            if rule is None:
+                return None
+            return tuple(sorted(rule.after.items())), rule.flip_result
+
+        def rules_key(rules: Optional[Dict[str, NoiseRule]]) -> Any:
+            if rules is None:
+                return None
+            return tuple(sorted((k, rule_key(v)) for k, v in rules.items()))
+
+        return (
+            self.idle_depolarization,
+            rule_key(self.tick_noise),
+            self.additional_depolarization_waiting_for_m_or_r,
+            rules_key(self.gate_rules),
+            rules_key(self.measure_rules),
+            rule_key(self.any_measurement_rule),
+            rule_key(self.any_clifford_1q_rule),
+            rule_key(self.any_clifford_2q_rule),
+            self.allow_multiple_uses_of_a_qubit_in_one_tick,
+        )
+
+    @staticmethod
+    def repeat_body_cache_info() -> Dict[str, int]:
+        """Returns the hits, misses, entries, and approximate bytes of the noisy REPEAT body cache."""
+        return _NOISY_REPEAT_BODY_CACHE.info()
+
+    @staticmethod
+    def clear_repeat_body_cache() -> None:
+        """Empties the noisy REPEAT body cache and resets its counters."""
+        _NOISY_REPEAT_BODY_CACHE.clear()
+
+
+class _NoisyRepeatBodyCache:
+    """A least-recently-used cache of noisy REPEAT block bodies.
+
+    Memory is bounded by the total text length of the cached keys and noisy
+    bodies, which is roughly proportional to the space they take up.
+    Bodies too big to fit are never cached.
+    """
+
+    def __init__(self, *, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: collections.OrderedDict[Any, Tuple[stim.Circuit, int]] = collections.OrderedDict()
+
+    def get(self, key: Any) -> Optional[stim.Circuit]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: Any, noisy_body: stim.Circuit) -> None:
+        size = len(key[0]) + len(str(noisy_body))
+        if size > self.max_bytes or key in self._entries:
+            return
+        self._entries[key] = (noisy_body, size)
+        self.num_bytes += size
+        while self.num_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.num_bytes -= evicted_size
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def info(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'bytes': self.num_bytes,
+        }
+
+
+_NOISY_REPEAT_BODY_CACHE = _NoisyRepeatBodyCache(max_bytes=2**28)
+
+
+def _probability_substitutions(old: Any, new: Any, *, out: Dict[float, float]) -> bool:
+    """Matches up the probabilities of two noise model fingerprints.
+
+    Returns:
+        Whether the fingerprints have the same shape. Each probability in
+        `old` is mapped to the corresponding probability in `new` in `out`.
+    """
+    if isinstance(old, tuple):
+        return (
+            isinstance(new, tuple)
+            and len(old) == len(new)
+            and all(_probability_substitutions(a, b, out=out) for a, b in zip(old, new))
+        )
+    if isinstance(old, (int, float)) and not isinstance(old, bool):
+        if isinstance(new, bool) or not isinstance(new, (int, float)):
+            return False
+        old = float(old)
+        if out.setdefault(old, float(new)) != new:
+            return False
+        return True
+    return old == new
+
+
+class NoisyCircuitTemplate:
+    """A noisy circuit that can be cheaply redone with a different noise strength.
+
+    Models made by the same factory (e.g. `NoiseModel.si1000` at different
+    strengths) add the same channels in the same places, differing only in
+    their probabilities, as long as the probabilities compare the same way
+    (the noise pass only checks whether probabilities are zero, equal, or
+    ordered). The template keeps the circuit as text, with the arguments of
+    its operations held aside, so that it can be rebuilt with substituted
+    probabilities by stim's parser instead of by redoing the noise pass.
+
+    All probabilities in the circuit are assumed to come from the noise model.
+    """
+
+    def __init__(self, circuit: stim.Circuit, *, noise: NoiseModel):
+        """
+        Args:
+            circuit: The result of applying `noise` to a noiseless circuit.
+            noise: The noise model that was applied.
+        """
+        fingerprint = noise._fingerprint()
+        if fingerprint is None:
+            raise ValueError(f'Templates need a noise model with comparable rules, but got {noise=}.')
+        self.noise = noise
+        self._fingerprint = fingerprint
+        # Alternates between literal text and (name, args, targets_text) operations whose arguments are substituted.
+        self._pieces: List[Union[str, Tuple[str, Tuple[float, ...], str]]] = []
+        self._literal: List[str] = []
+        self._add_pieces(circuit, indent='')
+        self._flush_literal()
+
+    def _flush_literal(self):
+        if self._literal:
+            self._pieces.append(''.join(self._literal))
+            self._literal.clear()
+
+    def _add_pieces(self, circuit: stim.Circuit, *, indent: str):
+        for op in circuit:
+            if isinstance(op, stim.CircuitRepeatBlock):
+                self._literal.append(f'{indent}REPEAT {op.repeat_count} {{\n')
+                self._add_pieces(op.body_copy(), indent=indent + '    ')
+                self._literal.append(f'{indent}}}\n')
+                continue
+            text = str(op)
+            args = op.gate_args_copy()
+            if not args:
+                self._literal.append(f'{indent}{text}\n')
+                continue
+            targets_text = text[text.index(')') + 1:].strip()
+            if OP_TYPES.get(op.name) == ANNOTATION:
+                self._literal.append(f'{indent}{_instruction_text(op.name, [targets_text], args)}\n')
+                continue
+            self._literal.append(indent)
+            self._flush_literal()
+            self._pieces.append((op.name, tuple(args), targets_text))
+            self._literal.append('\n')
+
+    def with_noise(self, noise: NoiseModel) -> Optional[stim.Circuit]:
+        """Returns the circuit that `noise` would have produced.
+
+        Returns:
+            The noisy circuit, or None if `noise` isn't similar enough to the
+            template's noise model (e.g. it's from a different factory, or
+            has a zero or coincident probability where the template's model
+            doesn't).
+        """
+        fingerprint = noise._fingerprint()
+        if fingerprint is None:
+            return None
+        substitutions = {}
+        if not _probability_substitutions(self._fingerprint, fingerprint, out=substitutions):
+            return None
+        prev = None
+        for old, new in sorted(substitutions.items()):
+            if (old == 0) != (new == 0) or (prev is not None and new <= prev):
+                return None
+            prev = new
+
+        text = []
+        for piece in self._pieces:
+            if isinstance(piece, str):
+                text.append(piece)
+            else:
+                name, args, targets_text = piece
+                text.append(_instruction_text(name, [targets_text], [substitutions.get(a, a) for a in args]))
+        return stim.Circuit(''.join(text))
+
+
+class _CompiledNoisePass:
+    """Applies a noise model to whole moments at once.
+
+    Produces exactly what `NoiseModel._append_noisy_moment` produces, but
+    looks up each noise rule once per gate name (or per MPP basis) instead of
+    once per split operation, tracks which qubits a moment uses with NumPy
+    masks, and emits each run of pieces that stim would fuse into one
+    instruction anyway (and each noise channel) all at once. Runs are emitted
+    by parsing their text, which is much faster than `stim.Circuit.append`
+    for long target lists, and exact because `repr` round trips floats.
+
+    Moments using anything it doesn't handle (classical control, noise
+    channels already in the circuit, qubits used more than once, custom
+    noise rules, ...) are refused, so that the original code handles them
+    (including raising the same errors).
+    """
+
+    def __init__(self,
+                 model: NoiseModel,
+                 *,
+                 num_qubits: int,
+                 system_qubits: AbstractSet[int],
+                 immune_qubits: AbstractSet[int]):
+        self.model = model
+        self.system_qubits = system_qubits
+        self.immune_qubits = immune_qubits
+        n = max(num_qubits, max(system_qubits, default=-1) + 1, max(immune_qubits, default=-1) + 1)
+        self.num_qubits = n
+        self.system_mask = np.zeros(n, dtype=np.bool_)
+        self.system_mask[list(system_qubits)] = True
+        self.immune_mask = np.zeros(n, dtype=np.bool_)
+        self.immune_mask[list(immune_qubits)] = True
+        self.rules: Dict[Any, Optional[NoiseRule]] = {}
+
+    def _rule(self, key: Any, make_split_op: Callable[[], stim.CircuitInstruction]) -> Optional[NoiseRule]:
+        """Returns the noise rule for split operations with the given key, or None if unsupported."""
+        if key not in self.rules:
+            try:
+                rule = self.model._noise_rule_for_split_operation(split_op=make_split_op())
+            except ValueError:
+                rule = None
+            if type(rule) is not NoiseRule:
+                # Subclasses may customize `append_noisy_version_of`.
+                rule = None
+            self.rules[key] = rule
+        return self.rules[key]
+
+    def append_noisy_moment(self, moment_ops: List[stim.CircuitInstruction], *, out: stim.Circuit) -> bool:
+        """Appends the noisy version of a moment to `out`, like `NoiseModel._append_noisy_moment`.
+
+        Args:
+            moment_ops: The moment's operations, before being split by
+                `_split_targets_if_needed`.
+            out: The circuit to append to.
+
+        Returns:
+            False, without appending anything, if the moment needs to be
+            handled by `NoiseModel._append_noisy_moment` instead.
+        """
+        # Either annotations to append as is, or [name, target_texts, args] runs of fusable pieces.
+        pieces: List[Union[stim.CircuitInstruction, list]] = []
+        after: DefaultDict[Tuple[str, float], List[int]] = collections.defaultdict(list)
+        collapse_qubits: List[int] = []
+        clifford_qubits: List[int] = []
+
+        def emit(name: str, target_texts: List[str], args: List[float]):
+            last = pieces[-1] if pieces else None
+            if isinstance(last, list) and last[0] == name and last[2] == args:
+                last[1].extend(target_texts)
+            else:
+                pieces.append([name, list(target_texts), args])
+
+        def emit_noisy(name: str, target_texts: List[str], values: List[int], args: List[float], rule: NoiseRule):
+            emit(name, target_texts, args)
+            for op_name, arg in rule.after.items():
+                after[(op_name, arg)].extend(values)
+
+        for op in moment_ops:
+            name = op.name
+            t = OP_TYPES.get(name)
+            if t is None or t == NOISE:
+                return False
+            if t == ANNOTATION:
+                pieces.append(op)
+                continue
+
+            targets = op.targets_copy()
+            args = op.gate_args_copy()
+
+            if t == MPP:
+                start = 0
+                while start < len(targets):
+                    end = start + 1
+                    while end < len(targets) and targets[end].is_combiner:
+                        end += 2
+                    product = targets[start:end]
+                    start = end
+                    basis = ''
+                    for target in product[::2]:
+                        if target.is_x_target:
+                            basis += 'X'
+                        elif target.is_y_target:
+                            basis += 'Y'
+                        elif target.is_z_target:
+                            basis += 'Z'
+                        else:
+                            return False
+                    rule = self._rule((name, basis), lambda: stim.CircuitInstruction(name, product, args))
+                    if rule is None or (rule.flip_result and args):
+                        return False
+                    values = [target.value for target in product[::2]]
+                    collapse_qubits.extend(values)
+                    text = '*'.join(
+                        f'{"!" if target.is_inverted_result_target else ""}{b}{v}'
+                        for target, b, v in zip(product[::2], basis, values)
+                    )
+                    if self.immune_qubits and any(v in self.immune_qubits for v in values):
+                        emit(name, [text], args)
+                    else:
+                        emit_noisy(name, [text], values, [rule.flip_result] if rule.flip_result else args, rule)
+                continue
+
+            if t == CLIFFORD_2Q and any(target.is_measurement_record_target or target.is_sweep_bit_target for target in targets):
+                return False
+            rule = self._rule(name, lambda: op)
+            if rule is None:
+                return False
+            if rule.flip_result:
+                if args or t not in (JUST_MEASURE_1Q, MEASURE_RESET_1Q):
+                    return False
+                noisy_args = [rule.flip_result]
+            else:
+                noisy_args = args
+            values = [target.value for target in targets]
+            if t == JUST_MEASURE_1Q or t == MEASURE_RESET_1Q:
+                texts = [f'!{v}' if target.is_inverted_result_target else str(v) for target, v in zip(targets, values)]
+            else:
+                texts = [str(v) for v in values]
+            (collapse_qubits if name in COLLAPSING_OPS else clifford_qubits).extend(values)
+
+            if self.immune_qubits:
+                immune = self.immune_mask[values]
+                if immune.any():
+                    # Pieces touching an immune qubit don't get noise.
+                    step = 2 if t == CLIFFORD_2Q else 1
+                    immune = immune.reshape(-1, step).any(axis=1).tolist()
+                    for k, is_immune in enumerate(immune):
+                        piece = slice(k * step, k * step + step)
+                        if is_immune:
+                            emit(name, texts[piece], args)
+                        else:
+                            emit_noisy(name, texts[piece], values[piece], noisy_args, rule)
+                    continue
+            emit_noisy(name, texts, values, noisy_args, rule)
+
+        n = self.num_qubits
+        collapse_mask = np.zeros(n, dtype=np.bool_)
+        collapse_mask[collapse_qubits] = True
+        clifford_mask = np.zeros(n, dtype=np.bool_)
+        clifford_mask[clifford_qubits] = True
+        if not self.model.allow_multiple_uses_of_a_qubit_in_one_tick:
+            num_distinct = np.count_nonzero(collapse_mask) + np.count_nonzero(clifford_mask)
+            if len(collapse_qubits) + len(clifford_qubits) != num_distinct or np.any(collapse_mask & clifford_mask):
+                # Let the original code raise its error.
+                return False
+
+        lines = []
+        for piece in pieces:
+            if isinstance(piece, list):
+                lines.append(_instruction_text(*piece))
+            else:
+                if lines:
+                    out += stim.Circuit('\n'.join(lines))
+                    lines = []
+                out.append(piece)
+        for op_name, arg in sorted(after.keys()):
+            lines.append(_instruction_text(op_name, [str(q) for q in after[(op_name, arg)]], [arg]))
+        if lines:
+            out += stim.Circuit('\n'.join(lines))
+
+        not_immune_system = self.system_mask & ~self.immune_mask
+        idle = np.flatnonzero(not_immune_system & ~collapse_mask & ~clifford_mask).tolist()
+        idle_texts = [str(q) for q in idle]
+        if idle and self.model.idle_depolarization:
+            out += stim.Circuit(_instruction_text('DEPOLARIZE1', idle_texts, [self.model.idle_depolarization]))
+        if collapse_qubits and np.any(not_immune_system & ~collapse_mask) and self.model.additional_depolarization_waiting_for_m_or_r:
+            if idle:
+                out += stim.Circuit(_instruction_text('DEPOLARIZE1', idle_texts, [self.model.additional_depolarization_waiting_for_m_or_r]))
+            else:
+                out.append('DEPOLARIZE1', idle, self.model.additional_depolarization_waiting_for_m_or_r)
+        if self.model.tick_noise is not None:
+            for k, p in self.model.tick_noise.after.items():
+                out.append(k, self.system_qubits - self.immune_qubits, p)
+        return True
+
+
+def _gate_args(circuit: stim.Circuit) -> Tuple[float, ...]:
+    """Returns the arguments of every instruction in a circuit (including inside REPEAT blocks), in order."""
+    result = []
+    for op in circuit:
+        if isinstance(op, stim.CircuitRepeatBlock):
+            result.extend(_gate_args(op.body_copy()))
+        else:
+            result.extend(op.gate_args_copy())
+    return tuple(result)
+
+
+def _instruction_text(name: str, target_texts: List[str], args: List[float]) -> str:
+    """Formats an instruction so that parsing it gives back exactly the same arguments."""
+    if args:
+        name += '(' + ','.join(repr(float(a)) for a in args) + ')'
+    return name + ' ' + ' '.join(target_texts)
+
 
 def occurs_in_classical_control_system(op: stim.CircuitInstruction) -> bool:
     """Determines if an operation is an annotation or a classical control system update."""
@@ -478,6 +972,19 @@ def _iter_split_op_moments(circuit: stim.Circuit, *, immune_qubits: AbstractSet[
 
         (A moment is the time between two TICKs.)
     """
+    for moment in _iter_moments(circuit):
+        if isinstance(moment, stim.CircuitRepeatBlock):
+            yield moment
+        else:
+            yield [
+                split_op
+                for op in moment
+                for split_op in _split_targets_if_needed(op, immune_qubits=immune_qubits)
+            ]
+
+
+def _iter_moments(circuit: stim.Circuit) -> Iterator[Union[stim.CircuitRepeatBlock, List[stim.CircuitInstruction]]]:
+    """Splits a circuit into moments (without splitting operations like `_iter_split_op_moments` does)."""
     cur_moment = []
 
     for op in circuit:
@@ -491,7 +998,7 @@ def _iter_split_op_moments(circuit: stim.Circuit, *, immune_qubits: AbstractSet[
                 yield cur_moment
                 cur_moment = []
             else:
-                cur_moment.extend(_split_targets_if_needed(op, immune_qubits=immune_qubits))
+                cur_moment.append(op)
     if cur_moment:
         yield cur_moment
 
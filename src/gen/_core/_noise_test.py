@@ -1,6 +1,12 @@
+import random
+import re
+from unittest import mock
+
+import pytest
 import stim
 
 import gen
+from gen._core import _noise
 from gen._core._noise import _measure_basis, _iter_split_op_moments, occurs_in_classical_control_system, NoiseModel
 
 
@@ -183,3 +189,269 @@ def test_tick_depolarization():
         MPP Z0*Z1 X2*X3 X4*X5*X6
         DEPOLARIZE1(0.375) 0 1 2 3 4 5 6
     """)
+
+
+def _assert_compiled_noise_matches(model: NoiseModel, circuit: stim.Circuit, **kwargs):
+    try:
+        expected = model._noisy_circuit(circuit, compiled=False, **kwargs)
+    except (ValueError, AssertionError) as ex:
+        with pytest.raises(type(ex), match=re.escape(str(ex)) if str(ex) else None):
+            model.noisy_circuit(circuit, **kwargs)
+        return
+    actual = model.noisy_circuit(circuit, **kwargs)
+    assert str(actual) == str(expected)
+    assert actual == expected
+
+
+def test_compiled_noise_matches_edge_cases():
+    models = [
+        NoiseModel.si1000(1e-3),
+        NoiseModel.uniform_depolarizing(2e-3),
+        NoiseModel(
+            any_clifford_1q_rule=gen.NoiseRule(after={}),
+            any_clifford_2q_rule=gen.NoiseRule(after={'DEPOLARIZE2': 0.25, 'X_ERROR': 0.125}),
+            any_measurement_rule=gen.NoiseRule(after={'DEPOLARIZE1': 0.125}, flip_result=0.25),
+            measure_rules={'XX': gen.NoiseRule(flip_result=0.375, after={})},
+            gate_rules={'R': gen.NoiseRule(after={'X_ERROR': 0.5}), 'X_ERROR': gen.NoiseRule(after={})},
+            tick_noise=gen.NoiseRule(after={'Z_ERROR': 0.0625}),
+            idle_depolarization=0.001,
+            additional_depolarization_waiting_for_m_or_r=0.001,
+        ),
+    ]
+    circuits = [
+        stim.Circuit(),
+        stim.Circuit('TICK\nTICK'),
+        stim.Circuit('''
+            QUBIT_COORDS(0.1, 0.30000000000000004) 0
+            R 0 1 2 3 4
+            TICK
+            H 0 1
+            CX 2 3
+            DETECTOR(1, 2) rec[-1]
+            H 4
+            TICK
+            M 0 !1 2
+            MPP !X3*Y4
+            DETECTOR rec[-1] rec[-2]
+            OBSERVABLE_INCLUDE(0) rec[-1]
+            TICK
+            MR 0 1
+            CX rec[-1] 2
+            CZ 3 4 sweep[0] 1
+        '''),
+        stim.Circuit('''
+            R 0 1 2 3
+            TICK
+            REPEAT 3 {
+                CZ 0 1 2 3
+                TICK
+                MPP X0*X1 Z2*Z3 Y0
+                TICK
+                SHIFT_COORDS(0, 0, 1)
+            }
+            M 0 1 2 3
+        '''),
+        stim.Circuit('''
+            H 0
+            X_ERROR(0.125) 1
+            TICK
+            M(0.25) 0
+        '''),
+        stim.Circuit('''
+            H 0 1
+            M 1
+        '''),
+        stim.Circuit('''
+            MRX 0 1 2
+            RX 3
+            RY 4
+            SQRT_XX 0 1 2 3
+        '''),
+    ]
+    for model in models:
+        for circuit in circuits:
+            for immune_qubits in [None, {1}, {0, 3}]:
+                for system_qubits in [None, set(range(8))]:
+                    _assert_compiled_noise_matches(
+                        model,
+                        circuit,
+                        immune_qubits=immune_qubits,
+                        system_qubits=system_qubits,
+                    )
+
+
+def test_compiled_noise_matches_random_circuits():
+    rng = random.Random(5)
+    for _ in range(50):
+        model, gates, bases = rng.choice([
+            (NoiseModel.si1000(1e-3), ['H', 'S', 'CX', 'CZ', 'M', 'R', 'MPP', 'DETECTOR'], 'z'),
+            (NoiseModel.uniform_depolarizing(2e-3), ['H', 'S', 'CX', 'CZ', 'M', 'MX', 'R', 'RX', 'MPP', 'DETECTOR'], 'xyz'),
+        ])
+        circuit = stim.Circuit()
+        for _ in range(rng.randint(1, 5)):
+            qubits = list(range(10))
+            rng.shuffle(qubits)
+            while qubits:
+                kind = rng.choice(gates)
+                if kind in ['CX', 'CZ']:
+                    if len(qubits) < 2:
+                        break
+                    circuit.append(kind, [qubits.pop(), qubits.pop()])
+                elif kind == 'MPP':
+                    product = [getattr(stim, f'target_{rng.choice(bases)}')(qubits.pop(), invert=rng.random() < 0.5)]
+                    if qubits and rng.random() < 0.5:
+                        product += [stim.target_combiner(), getattr(stim, f'target_{rng.choice(bases)}')(qubits.pop())]
+                    circuit.append(kind, product)
+                elif kind == 'DETECTOR':
+                    if circuit.num_measurements:
+                        circuit.append(kind, [stim.target_rec(-1)], [rng.random()])
+                else:
+                    q = qubits.pop()
+                    invert = kind[0] == 'M' and rng.random() < 0.5
+                    circuit.append(kind, [stim.target_inv(q) if invert else q])
+            if rng.random() < 0.1:
+                # A collision.
+                circuit.append('H', [rng.randrange(10)])
+            circuit.append('TICK')
+        if rng.random() < 0.3:
+            circuit = circuit * rng.randint(2, 3)
+            circuit = stim.Circuit('H 0\nTICK') + stim.Circuit(f'REPEAT 2 {{\n{circuit}\n}}')
+        immune = {q for q in range(10) if rng.random() < 0.2}
+        _assert_compiled_noise_matches(model, circuit, immune_qubits=immune)
+        _assert_compiled_noise_matches(model, circuit, system_qubits=set(range(12)))
+
+
+
+def test_noisy_repeat_bodies_are_cached():
+    def loop(rounds: int) -> stim.Circuit:
+        return stim.Circuit(f"""
+            R 0 1 2
+            TICK
+            REPEAT {rounds} {{
+                CX 0 1
+                TICK
+                M 1
+                DETECTOR rec[-1]
+                TICK
+            }}
+            M 0 1 2
+        """)
+
+    cache = _noise._NoisyRepeatBodyCache(max_bytes=10**6)
+    with mock.patch.object(_noise, '_NOISY_REPEAT_BODY_CACHE', cache):
+        for rounds in [2, 5, 9]:
+            actual = NoiseModel.si1000(1e-3).noisy_circuit(loop(rounds))
+            assert actual == NoiseModel.si1000(1e-3)._noisy_circuit(loop(rounds), compiled=False)
+        assert NoiseModel.repeat_body_cache_info() == {
+            'hits': 2,
+            'misses': 1,
+            'entries': 1,
+            'bytes': cache.num_bytes,
+        }
+
+        # Different models, system qubits, and immune qubits use different entries.
+        NoiseModel.si1000(2e-3).noisy_circuit(loop(3))
+        NoiseModel.uniform_depolarizing(1e-3).noisy_circuit(loop(3))
+        NoiseModel.si1000(1e-3).noisy_circuit(loop(3), immune_qubits={2})
+        NoiseModel.si1000(1e-3).noisy_circuit(loop(3), system_qubits={0, 1})
+        assert cache.info()['misses'] == 5
+        assert cache.info()['entries'] == 5
+
+        # Subclasses may change behavior without changing fields, so they aren't cached.
+        class Custom(NoiseModel):
+            pass
+        Custom(**vars(NoiseModel.si1000(1e-3))).noisy_circuit(loop(3))
+        Custom(**vars(NoiseModel.si1000(1e-3))).noisy_circuit(loop(3))
+        assert cache.info()['hits'] == 2
+        assert cache.info()['entries'] == 5
+
+        NoiseModel.clear_repeat_body_cache()
+        assert cache.info() == {'hits': 0, 'misses': 0, 'entries': 0, 'bytes': 0}
+
+
+def test_noisy_repeat_body_cache_distinguishes_close_arguments():
+    def loop(x: float) -> stim.Circuit:
+        return stim.Circuit(f"""
+            R 0 1
+            TICK
+            REPEAT 3 {{
+                CX 0 1
+                TICK
+                M 1
+                DETECTOR({x!r}, 0) rec[-1]
+                TICK
+            }}
+        """)
+
+    # These print the same, since stim rounds arguments to 6 significant digits.
+    assert str(loop(0.1234567)) == str(loop(0.1234568))
+    cache = _noise._NoisyRepeatBodyCache(max_bytes=10**6)
+    with mock.patch.object(_noise, '_NOISY_REPEAT_BODY_CACHE', cache):
+        for x in [0.1234567, 0.1234568]:
+            actual = NoiseModel.si1000(1e-3).noisy_circuit(loop(x))
+            assert actual == NoiseModel.si1000(1e-3)._noisy_circuit(loop(x), compiled=False)
+        assert cache.info()['misses'] == 2
+        assert cache.info()['entries'] == 2
+
+
+def test_noisy_repeat_body_cache_evicts_least_recently_used():
+    cache = _noise._NoisyRepeatBodyCache(max_bytes=26)
+    a = stim.Circuit('H 0')
+    cache.put(('X' * 10, 'a'), a)
+    cache.put(('Y' * 10, 'b'), a)
+    assert cache.get(('X' * 10, 'a')) is a
+    cache.put(('Z' * 10, 'c'), a)
+    assert cache.info() == {'hits': 1, 'misses': 0, 'entries': 2, 'bytes': 26}
+    assert cache.get(('Y' * 10, 'b')) is None
+    assert cache.get(('X' * 10, 'a')) is a
+    assert cache.get(('Z' * 10, 'c')) is a
+
+    # Too big to ever fit.
+    cache.put(('W' * 40, 'd'), a)
+    assert cache.get(('W' * 40, 'd')) is None
+    assert cache.info()['bytes'] == 26
+
+
+def test_noisy_circuit_template():
+    circuit = stim.Circuit("""
+        QUBIT_COORDS(0.125, 0.3333333333333333) 0
+        R 0 1 2
+        TICK
+        REPEAT 3 {
+            CX 0 1
+            TICK
+            MPP Z0*Z1 Z2
+            DETECTOR(0.1, 2) rec[-1]
+            TICK
+        }
+        M 0 1 2
+        OBSERVABLE_INCLUDE(1) rec[-1]
+    """)
+
+    def noisy(model: NoiseModel) -> stim.Circuit:
+        return model._noisy_circuit(circuit, compiled=False)
+
+    template = gen.NoisyCircuitTemplate(noisy(NoiseModel.si1000(1e-3)), noise=NoiseModel.si1000(1e-3))
+    for p in [1e-3, 2e-3, 1e-3 / 7, 0.1]:
+        assert template.with_noise(NoiseModel.si1000(p)) == noisy(NoiseModel.si1000(p))
+    # Zero probabilities remove channels.
+    assert template.with_noise(NoiseModel.si1000(0)) is None
+    # Different models have different rules.
+    assert template.with_noise(NoiseModel.uniform_depolarizing(1e-3)) is None
+
+    # Channels are sorted and fused based on how probabilities compare.
+    def model(a: float, b: float) -> NoiseModel:
+        return NoiseModel(
+            any_clifford_2q_rule=gen.NoiseRule(after={'X_ERROR': a, 'Z_ERROR': b}),
+            any_measurement_rule=gen.NoiseRule(after={'X_ERROR': b}, flip_result=a),
+            gate_rules={'R': gen.NoiseRule(after={'X_ERROR': a})},
+        )
+    template = gen.NoisyCircuitTemplate(noisy(model(0.25, 0.125)), noise=model(0.25, 0.125))
+    assert template.with_noise(model(0.5, 0.375)) == noisy(model(0.5, 0.375))
+    assert template.with_noise(model(0.25, 0.25)) is None
+    assert template.with_noise(model(0.125, 0.25)) is None
+
+    class CustomRule(gen.NoiseRule):
+        pass
+    with pytest.raises(ValueError, match='comparable'):
+        gen.NoisyCircuitTemplate(circuit, noise=NoiseModel(any_clifford_1q_rule=CustomRule(after={})))
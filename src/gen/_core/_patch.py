@@ -230,11 +230,10 @@ class Patch:
             for b in 'XYZ':
                 builder.gate(f'R{b}', {q for q, db in data_resets.items() if b == db})
 
-        for v in self.tiles:
-            builder.measure_pauli_product(
-                q2b={q: b for q, b in zip(v.ordered_data_qubits, v.bases) if q is not None},
-                key=AtLayer(tracker_key(v.measurement_qubit), tracker_layer)
-            )
+        builder.measure_pauli_products(
+            q2bs=[{q: b for q, b in zip(v.ordered_data_qubits, v.bases) if q is not None} for v in self.tiles],
+            keys=[AtLayer(tracker_key(v.measurement_qubit), tracker_layer) for v in self.tiles],
+        )
 
         if data_measures:
             for b in 'XYZ':
@@ -328,6 +327,9 @@ class Patch:
         assert self.measure_set.isdisjoint(data_resets)
         skipped_comparisons_set = frozenset(skipped_comparisons)
         singleton_detectors_set = frozenset(singleton_detectors)
+        detector_key_groups = []
+        detector_positions = []
+        detector_post_selected = []
         for e in sorted_complex(self.tiles, key=lambda e2: e2.measurement_qubit):
             if all(e is None for e in e.ordered_data_qubits):
                 continue
@@ -350,7 +352,10 @@ class Patch:
                 continue
             assert isinstance(comparisons,
                               list), f"Vs exception must be a list but got {comparisons!r} for {m!r}"
-            child.detector([AtLayer(m, save_layer), *comparisons], pos=m, mark_as_post_selected=m in post_selected_positions)
+            detector_key_groups.append([AtLayer(m, save_layer), *comparisons])
+            detector_positions.append(m)
+            detector_post_selected.append(m in post_selected_positions)
+        child.detectors(detector_key_groups, positions=detector_positions, post_selected=detector_post_selected)
         child.circuit.append("SHIFT_COORDS", [], [0, 0, 1])
         specified_reps = repetitions is not None
         if repetitions is None:
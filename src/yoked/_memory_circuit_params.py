@@ -0,0 +1,107 @@
+import collections
+import dataclasses
+import math
+from typing import Any, Dict, Literal
+
+import stim
+
+import gen
+from yoked._squareberg_circuits import squareberg_magic_memory_circuit
+from yoked._yoked_memory_circuits import yoked_magic_memory_circuit
+
+
+# Templates of recently generated circuits, keyed by their parameters with a noise strength of 0.
+_TEMPLATES: collections.OrderedDict['MemoryCircuitParams', gen.NoisyCircuitTemplate] = collections.OrderedDict()
+_MAX_TEMPLATES = 4
+
+
+@dataclasses.dataclass(frozen=True)
+class MemoryCircuitParams:
+    """The parameters of a magic memory circuit, as used by `tools/gen_memory_circuit`.
+
+    Attributes:
+        patch_diameter: The width and height of each surface code patch.
+        rounds: The number of rounds of stabilizer measurements.
+        noise_strength: The physical error rate. The 'cz' gateset uses SI1000
+            noise, and the 'css' gateset uses uniform depolarizing noise.
+        patches: The number of surface code patches.
+        yokes: The number of yokes. Values above 2 make a squareberg circuit,
+            which requires `patches` to be a square with side `yokes / 4`.
+        gateset: 'cz' or 'css'.
+        remove_x_yoke: Passed to `yoked_magic_memory_circuit`.
+    """
+    patch_diameter: int
+    rounds: int
+    noise_strength: float
+    patches: int
+    yokes: int
+    gateset: Literal['cz', 'css'] = 'cz'
+    remove_x_yoke: bool = False
+
+    @property
+    def noise_name(self) -> str:
+        return 'si1000' if self.gateset == 'cz' else 'uniform'
+
+    def noise_model(self) -> gen.NoiseModel:
+        if self.gateset == 'cz':
+            return gen.NoiseModel.si1000(self.noise_strength)
+        return gen.NoiseModel.uniform_depolarizing(self.noise_strength)
+
+    def make_circuit(self) -> stim.Circuit:
+        """Generates the circuit.
+
+        Circuits that differ only in their noise strength share a template
+        (see `gen.NoisyCircuitTemplate`), so that sweeping over noise
+        strengths only generates the circuit once.
+        """
+        key = dataclasses.replace(self, noise_strength=0)
+        template = _TEMPLATES.get(key)
+        if template is not None:
+            _TEMPLATES.move_to_end(key)
+            circuit = template.with_noise(self.noise_model())
+            if circuit is not None:
+                return circuit
+
+        circuit = self._generate_circuit()
+        if self.noise_strength > 0:
+            _TEMPLATES[key] = gen.NoisyCircuitTemplate(circuit, noise=self.noise_model())
+            _TEMPLATES.move_to_end(key)
+            while len(_TEMPLATES) > _MAX_TEMPLATES:
+                _TEMPLATES.popitem(last=False)
+        return circuit
+
+    def _generate_circuit(self) -> stim.Circuit:
+        if self.yokes > 2:
+            w = round(math.sqrt(self.patches) / 4) * 4
+            if w * w != self.patches or self.yokes != w * 4:
+                raise ValueError(f'{w * w=} != {self.patches=} or {self.yokes=} != {w*4=}')
+            return squareberg_magic_memory_circuit(
+                patch_diameter=self.patch_diameter,
+                rounds=self.rounds,
+                noise=self.noise_model(),
+                style=self.gateset,
+                num_patches=self.patches,
+            )
+        return yoked_magic_memory_circuit(
+            patch_diameter=self.patch_diameter,
+            rounds=self.rounds,
+            noise=self.noise_model(),
+            style=self.gateset,
+            yokes=self.yokes,
+            num_patches=self.patches,
+            remove_x_yoke=self.remove_x_yoke,
+        )
+
+    def metadata(self) -> Dict[str, Any]:
+        """The metadata describing the circuit (excluding its qubit count, 'q')."""
+        return {
+            'd': self.patch_diameter,
+            'r': self.rounds,
+            'p': self.noise_strength,
+            'patches': self.patches,
+            'yokes': int(self.yokes),
+            'noise': self.noise_name,
+            'b': 'magic',
+            'c': 'memory',
+            'gateset': self.gateset,
+        }
@@ -0,0 +1,82 @@
+import pytest
+
+import gen
+from yoked import _memory_circuit_params
+from yoked._memory_circuit_params import MemoryCircuitParams
+from yoked._squareberg_circuits import squareberg_magic_memory_circuit
+from yoked._yoked_memory_circuits import yoked_magic_memory_circuit
+
+
+def test_memory_circuit_params():
+    params = MemoryCircuitParams(
+        patch_diameter=3,
+        rounds=6,
+        noise_strength=1e-3,
+        patches=1,
+        yokes=1,
+        gateset='css',
+    )
+    assert params.make_circuit() == yoked_magic_memory_circuit(
+        patch_diameter=3,
+        rounds=6,
+        noise=gen.NoiseModel.uniform_depolarizing(1e-3),
+        style='css',
+        yokes=1,
+        num_patches=1,
+    )
+    assert params.metadata() == {
+        'd': 3,
+        'r': 6,
+        'p': 1e-3,
+        'patches': 1,
+        'yokes': 1,
+        'noise': 'uniform',
+        'b': 'magic',
+        'c': 'memory',
+        'gateset': 'css',
+    }
+
+
+def test_memory_circuit_params_squareberg():
+    params = MemoryCircuitParams(
+        patch_diameter=3,
+        rounds=3,
+        noise_strength=1e-3,
+        patches=16,
+        yokes=16,
+    )
+    assert params.make_circuit() == squareberg_magic_memory_circuit(
+        patch_diameter=3,
+        rounds=3,
+        noise=gen.NoiseModel.si1000(1e-3),
+        style='cz',
+        num_patches=16,
+    )
+
+    with pytest.raises(ValueError):
+        MemoryCircuitParams(
+            patch_diameter=3,
+            rounds=3,
+            noise_strength=1e-3,
+            patches=16,
+            yokes=8,
+        ).make_circuit()
+
+
+@pytest.mark.parametrize('gateset,yokes,patches', [('cz', 2, 3), ('css', 1, 2), ('cz', 16, 16)])
+def test_memory_circuit_params_noise_strength_sweep_uses_template(gateset: str, yokes: int, patches: int):
+    def params(p: float) -> MemoryCircuitParams:
+        return MemoryCircuitParams(
+            patch_diameter=3,
+            rounds=4,
+            noise_strength=p,
+            patches=patches,
+            yokes=yokes,
+            gateset=gateset,
+        )
+
+    key = params(0)
+    _memory_circuit_params._TEMPLATES.pop(key, None)
+    for p in [1e-3, 2e-3, 1e-3 / 3, 0]:
+        assert params(p).make_circuit() == params(p)._generate_circuit()
+        assert key in _memory_circuit_params._TEMPLATES
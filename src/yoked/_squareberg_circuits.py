@@ -193,8 +193,10 @@ def squareberg_magic_memory_circuit(
     full_patch = gen.Patch([tile for patch in patches for tile in patch.tiles])
 
     builder = gen.Builder.for_qubits(full_patch.used_set | set(epr_ancilla_qubits))
-    for key, obs in observables.items():
-        builder.measure_pauli_product(q2b=obs.qubits, key=f'obs_{key}_init')
+    builder.measure_pauli_products(
+        q2bs=[obs.qubits for obs in observables.values()],
+        keys=[f'obs_{key}_init' for key in observables.keys()],
+    )
     builder.measure_patch(full_patch, save_layer='magic_init')
     builder.tick()
 
@@ -214,8 +216,10 @@ def squareberg_magic_memory_circuit(
     ) if noise is not None else noisy_body.circuit
 
     builder.measure_patch(full_patch, save_layer='magic_end', cmp_layer='loop')
-    for key, obs in observables.items():
-        builder.measure_pauli_product(q2b=obs.qubits, key=f'obs_{key}_end')
+    builder.measure_pauli_products(
+        q2bs=[obs.qubits for obs in observables.values()],
+        keys=[f'obs_{key}_end' for key in observables.keys()],
+    )
     obs_index = 0
     for key, obs in observables.items():
         if key.endswith('a'):
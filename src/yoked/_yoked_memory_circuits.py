@@ -1,10 +1,29 @@
-from typing import Literal
+import functools
+from typing import Literal, Tuple
 
 import stim
 
 import gen
 
 
+@functools.lru_cache(maxsize=None)
+def _base_patch_and_observables(patch_diameter: int) -> Tuple[gen.Patch, gen.PauliString, gen.PauliString]:
+    """Returns the patch at the origin and its X and Z observables.
+
+    Cached because circuits for different numbers of patches (and rounds,
+    noise strengths, ...) all start from the same base patch.
+    """
+    g = patch_diameter - 1
+    rel_order_func = lambda q: gen.Order_Z if gen.checkerboard_basis(q) == 'X' else gen.Order_ᴎ
+    base_patch = gen.ClosedCurve.from_cycle(
+        [0, 'X', g, 'Z', (1 + 1j) * g, 'X', 1j * g, 'Z', 0],
+    ).to_patch(rel_order_func=rel_order_func)
+    base_obs_x = gen.PauliString({q: 'X' for q in base_patch.data_set if q.real == 0})
+    base_obs_z = gen.PauliString({q: 'Z' for q in base_patch.data_set if q.imag == 0})
+    assert base_obs_x.anticommutes(base_obs_z)
+    return base_patch, base_obs_x, base_obs_z
+
+
 def yoked_magic_memory_circuit(
         *,
         patch_diameter: int,
@@ -45,14 +64,7 @@ def yoked_magic_memory_circuit(
     """
     assert yokes in [0, 1, 2]
     assert rounds >= 2
-    g = patch_diameter - 1
-    rel_order_func = lambda q: gen.Order_Z if gen.checkerboard_basis(q) == 'X' else gen.Order_ᴎ
-    base_patch = gen.ClosedCurve.from_cycle(
-        [0, 'X', g, 'Z', (1 + 1j) * g, 'X', 1j * g, 'Z', 0],
-    ).to_patch(rel_order_func=rel_order_func)
-    base_obs_x = gen.PauliString({q: 'X' for q in base_patch.data_set if q.real == 0})
-    base_obs_z = gen.PauliString({q: 'Z' for q in base_patch.data_set if q.imag == 0})
-    assert base_obs_x.anticommutes(base_obs_z)
+    base_patch, base_obs_x, base_obs_z = _base_patch_and_observables(patch_diameter)
     pitch = patch_diameter + 1
 
     epr_ancilla_qubits = []
@@ -1,4 +1,5 @@
 import itertools
+from unittest import mock
 
 import pytest
 import stim
@@ -305,3 +306,31 @@ def test_yoked_magic_memory_circuit_exact():
         OBSERVABLE_INCLUDE(5) rec[-1]
         DETECTOR(0, -2, 0) rec[-4602] rec[-4601] rec[-4600] rec[-4599] rec[-4598] rec[-4597] rec[-6] rec[-5] rec[-4] rec[-3] rec[-2] rec[-1]
     """)
+
+
+@pytest.mark.parametrize('style,noise', [
+    ('cz', gen.NoiseModel.si1000(1e-3)),
+    ('css', gen.NoiseModel.uniform_depolarizing(1e-3)),
+])
+def test_yoked_magic_memory_circuit_compiled_noise_matches(style: str, noise: gen.NoiseModel):
+    calls = []
+    original = gen.NoiseModel.noisy_circuit
+
+    def capture(self, circuit, **kwargs):
+        calls.append((circuit, kwargs))
+        return original(self, circuit, **kwargs)
+
+    with mock.patch.object(gen.NoiseModel, 'noisy_circuit', capture):
+        yoked_magic_memory_circuit(
+            patch_diameter=5,
+            rounds=5,
+            noise=noise,
+            yokes=2,
+            style=style,
+            num_patches=4,
+        )
+    assert calls
+    for circuit, kwargs in calls:
+        actual = noise.noisy_circuit(circuit, **kwargs)
+        expected = noise._noisy_circuit(circuit, compiled=False, **kwargs)
+        assert str(actual) == str(expected)
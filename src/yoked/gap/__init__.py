@@ -1,3 +1,13 @@
 from yoked.gap._gap_collect import (
     collect_gap_stats,
 )
+from yoked.gap._gap_stopping_rule import (
+    GapStoppingRule,
+)
+from yoked.gap._gap_stats_store import (
+    GapStatsStore,
+    read_gap_stats,
+)
+from yoked.gap._gap_block_composition import (
+    compose_gap_blocks,
+)
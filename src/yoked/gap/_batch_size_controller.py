@@ -0,0 +1,82 @@
+import math
+from typing import Optional
+
+
+class BatchSizeController:
+    """Picks how many shots a worker should sample and decode per call.
+
+    Batches are sized so that each call takes about `target_seconds`, based on
+    the measured time per shot of previous calls, while keeping the estimated
+    peak memory of a call under `max_bytes`. Batch sizes grow by at most a
+    factor of `max_growth` per call, so a bad first measurement can't produce
+    an enormous batch.
+    """
+
+    def __init__(
+            self,
+            *,
+            target_seconds: float = 1,
+            max_bytes: int = 2**28,
+            initial_shots: int = 16,
+            max_growth: float = 8,
+            smoothing: float = 0.5,
+    ):
+        """
+        Args:
+            target_seconds: The desired wall time of each call.
+            max_bytes: The memory budget of each call.
+            initial_shots: The batch size to use before anything is measured.
+            max_growth: The largest factor the batch size can grow by between
+                calls.
+            smoothing: How much weight to give the previous seconds-per-shot
+                estimate when folding in a new measurement (0 means only use
+                the newest measurement).
+        """
+        if target_seconds <= 0:
+            raise ValueError(f'{target_seconds=} <= 0')
+        if max_bytes <= 0:
+            raise ValueError(f'{max_bytes=} <= 0')
+        if max_growth <= 1:
+            raise ValueError(f'{max_growth=} <= 1')
+        if not (0 <= smoothing < 1):
+            raise ValueError(f'not (0 <= {smoothing=} < 1)')
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.initial_shots = initial_shots
+        self.max_growth = max_growth
+        self.smoothing = smoothing
+
+        self.seconds_per_shot: Optional[float] = None
+        self.last_batch_size: int = 0
+
+    def reset(self) -> None:
+        """Forgets measurements (e.g. because the task being sampled changed)."""
+        self.seconds_per_shot = None
+        self.last_batch_size = 0
+
+    def next_batch_size(self, *, max_shots: int, bytes_per_shot: int) -> int:
+        """Returns the number of shots to take in the next call.
+
+        Args:
+            max_shots: The most shots the caller is allowed to take.
+            bytes_per_shot: Estimated peak memory used per shot in the batch.
+        """
+        if self.seconds_per_shot is None or self.last_batch_size == 0:
+            n = self.initial_shots
+        else:
+            n = self.target_seconds / max(self.seconds_per_shot, 1e-12)
+            n = min(n, self.last_batch_size * self.max_growth)
+        n = min(n, self.max_bytes // max(bytes_per_shot, 1))
+        n = max(1, min(int(math.floor(n)), max_shots))
+        self.last_batch_size = n
+        return n
+
+    def record(self, *, shots: int, seconds: float) -> None:
+        """Folds the measured duration of a call into the time-per-shot estimate."""
+        if shots <= 0:
+            return
+        measured = seconds / shots
+        if self.seconds_per_shot is None:
+            self.seconds_per_shot = measured
+        else:
+            self.seconds_per_shot = self.smoothing * self.seconds_per_shot + (1 - self.smoothing) * measured
@@ -0,0 +1,40 @@
+import pytest
+
+from yoked.gap._batch_size_controller import BatchSizeController
+
+
+def test_batch_size_controller_grows_towards_target():
+    c = BatchSizeController(target_seconds=1, max_bytes=10**12, initial_shots=16, max_growth=8, smoothing=0)
+    assert c.next_batch_size(max_shots=10**9, bytes_per_shot=100) == 16
+    c.record(shots=16, seconds=16e-6)
+    assert c.next_batch_size(max_shots=10**9, bytes_per_shot=100) == 128
+    c.record(shots=128, seconds=128e-6)
+    assert c.next_batch_size(max_shots=10**9, bytes_per_shot=100) == 1024
+    c.record(shots=1024, seconds=1024e-6)
+    assert c.next_batch_size(max_shots=10**9, bytes_per_shot=100) == 8192
+    for _ in range(10):
+        n = c.next_batch_size(max_shots=10**9, bytes_per_shot=100)
+        c.record(shots=n, seconds=n * 1e-6)
+    assert c.next_batch_size(max_shots=10**9, bytes_per_shot=100) == 10**6
+
+
+def test_batch_size_controller_shrinks_when_slow():
+    c = BatchSizeController(target_seconds=1, max_bytes=10**12, initial_shots=1000, smoothing=0)
+    assert c.next_batch_size(max_shots=10**9, bytes_per_shot=100) == 1000
+    c.record(shots=1000, seconds=10)
+    assert c.next_batch_size(max_shots=10**9, bytes_per_shot=100) == 100
+
+
+def test_batch_size_controller_limits():
+    c = BatchSizeController(target_seconds=1, max_bytes=10**6, initial_shots=10**9, smoothing=0)
+    assert c.next_batch_size(max_shots=10**9, bytes_per_shot=1000) == 1000
+    assert c.next_batch_size(max_shots=10, bytes_per_shot=1000) == 10
+    assert c.next_batch_size(max_shots=10, bytes_per_shot=10**9) == 1
+
+    c.record(shots=10, seconds=100)
+    c.reset()
+    assert c.seconds_per_shot is None
+    assert c.next_batch_size(max_shots=10**9, bytes_per_shot=1000) == 1000
+
+    with pytest.raises(ValueError):
+        BatchSizeController(target_seconds=0)
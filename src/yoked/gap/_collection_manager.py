@@ -1,23 +1,159 @@
+import asyncio
 import collections
+import contextlib
 import multiprocessing
+import multiprocessing.connection
 import os
 import queue
+import shutil
+import statistics
+import sys
+import tempfile
+import time
 from typing import Any, Optional, List, Dict, Iterable, Callable, Tuple
 
 import sinter
 
 from yoked.gap._collection_work_handler import CollectionWorkHandler
 from yoked.gap._collection_worker_loop import collection_worker_loop
+from yoked.gap._collection_worker_state import _fill_in_task, compute_strong_id
+from yoked.gap._dem_cache import DemCache
+from yoked.gap._memory_circuit_task import MemoryCircuitTask
+from yoked.gap._remote_collection_workers import Address, ConnectionOutputQueue, RemoteWorkerListener
+from yoked.gap._shared_gap_histograms import SharedGapHistograms
+
+
+def _with_known_strong_id(task: sinter.Task, strong_id: str) -> sinter.Task:
+    """Returns an equivalent task that doesn't need its strong id recomputed."""
+    if isinstance(task, MemoryCircuitTask):
+        return task.with_strong_id(strong_id)
+    return sinter.Task(
+        circuit=task.circuit,
+        circuit_path=task.circuit_path,
+        decoder=task.decoder,
+        postselection_mask=task.postselection_mask,
+        postselected_observables_mask=task.postselected_observables_mask,
+        json_metadata=task.json_metadata,
+        collection_options=task.collection_options,
+        skip_validation=True,
+        _unvalidated_strong_id=strong_id,
+    )
+
+
+def _task_size_bytes(task: sinter.Task) -> int:
+    """A rough proxy for how expensive a task's shots are."""
+    if task.circuit is not None:
+        return len(str(task.circuit))
+    if task.circuit_path is not None:
+        return os.path.getsize(task.circuit_path)
+    if isinstance(task, MemoryCircuitTask):
+        # Roughly the number of noisy operations in the generated circuit.
+        p = task.params
+        return p.patches * p.patch_diameter**2 * p.rounds * 8
+    return 0
+
+
+def _forward_progress(
+        items: List[Optional[sinter.TaskStats]],
+        callback: Callable[[Optional[sinter.TaskStats]], None],
+):
+    """Passes progress events to the callback, coalescing them.
+
+    Results for the same task are merged into one stat (so they become one
+    CSV row), and updates without results are dropped when there are results.
+    """
+    merged: Dict[str, sinter.TaskStats] = {}
+    for stat in items:
+        if stat is not None:
+            if stat.strong_id in merged:
+                merged[stat.strong_id] += stat
+            else:
+                merged[stat.strong_id] = stat
+    stats = list(merged.values())
+    for stat in stats:
+        callback(stat)
+    if items and not stats:
+        callback(None)
+
+
+_STOP_WRITING = object()
+
+
+def _take_all(pending: 'asyncio.Queue[Optional[sinter.TaskStats]]') -> List[Optional[sinter.TaskStats]]:
+    items = []
+    while not pending.empty():
+        items.append(pending.get_nowait())
+    return items
+
+
+async def _write_progress(
+        pending: 'asyncio.Queue[Optional[sinter.TaskStats]]',
+        callback: Callable[[Optional[sinter.TaskStats]], None],
+        write_period: float,
+):
+    """Forwards queued progress events until it finds `_STOP_WRITING` in the queue."""
+    next_write = time.monotonic()
+    while True:
+        items = [await pending.get()]
+        delay = next_write - time.monotonic()
+        if delay > 0 and items[0] is not _STOP_WRITING:
+            await asyncio.sleep(delay)
+        next_write = time.monotonic() + write_period
+        items.extend(_take_all(pending))
+        stop = any(e is _STOP_WRITING for e in items)
+        _forward_progress([e for e in items if e is not _STOP_WRITING], callback)
+        if stop:
+            return
+
+
+class _PeriodicCalls:
+    """Runs callbacks at most once per their period, whenever a loop polls it."""
+
+    def __init__(self, calls: Iterable[Tuple[float, Callable[[], None]]]):
+        now = time.monotonic()
+        self.calls = [[now + period, period, callback] for period, callback in calls]
+
+    def seconds_until_next(self) -> Optional[float]:
+        """How long a loop can wait before polling again, or None if there's nothing to run."""
+        if not self.calls:
+            return None
+        return max(0.0, min(due for due, _, _ in self.calls) - time.monotonic())
+
+    def run_due(self) -> None:
+        now = time.monotonic()
+        for call in self.calls:
+            due, period, callback = call
+            if now >= due:
+                call[0] = now + period
+                callback()
+
+
+@contextlib.contextmanager
+def _spawn_start_method():
+    current_method = multiprocessing.get_start_method()
+    try:
+        # To ensure the child processes do not accidentally share ANY state
+        # related to, we use 'spawn' instead of 'fork'.
+        multiprocessing.set_start_method('spawn', force=True)
+        yield
+    finally:
+        multiprocessing.set_start_method(current_method, force=True)
 
 
 class _ManagedWorkerState:
     def __init__(self, worker_id: int):
         self.worker_id: int = worker_id
         self.process: Optional[multiprocessing.Process] = None
+        # Whether the process exiting has been noticed (and dealt with).
+        self.exit_handled: bool = False
         self.input_queue: Optional[multiprocessing.Queue[Tuple[str, Any]]] = None
         self.assigned_work_key: Any = None
         self.assigned_shots: int = 0
         self.asked_to_drop_shots: int = 0
+        self.status: Dict[str, Any] = {}
+        self.remote_info: Any = None
+        self.disconnected: bool = False
+        self.lease_start: float = 0
 
 
 class _ManagedTaskState:
@@ -28,6 +164,15 @@ class _ManagedTaskState:
         self.shots_unassigned = shots_left
         self.shot_return_requests = 0
         self.workers_assigned = []
+        self.measured_shots = 0
+        self.measured_seconds = 0.0
+        self.size_bytes = 0
+        self.total_stats = sinter.AnonTaskStats()
+        self.stopping = False
+        self.stop_asked_workers = set()
+        # Workers being moved to another task, once they're done with their shots.
+        self.leaving_workers = set()
+        self.failures = 0
 
 
 class CollectionManager:
@@ -41,7 +186,77 @@ class CollectionManager:
             worker_flush_period: float,
             tasks: Iterable[sinter.Task],
             progress_callback: Callable[[Optional[sinter.TaskStats]], None],
+            shared_memory_results: bool = False,
+            max_shared_abs_gap: int = 255,
+            dem_cache: Optional[DemCache] = None,
+            cost_aware_scheduling: bool = False,
+            cost_rebalance_period: float = 10,
+            stop_condition: Optional[Callable[[sinter.AnonTaskStats], bool]] = None,
+            max_task_failures: int = 3,
+            max_worker_restarts: int = 100,
+            shutdown_timeout: float = 30,
+            listen_address: Optional[Address] = None,
+            authkey: Optional[bytes] = None,
+            remote_lease_seconds: float = 600,
+            metrics_callback: Optional[Callable[[int, str, Dict[str, float]], None]] = None,
     ):
+        """
+        Args:
+            shared_memory_results: When set, workers accumulate their results
+                into a `SharedGapHistograms` instead of pickling them into the
+                output queue, and only send a small notification message when
+                they flush.
+            max_shared_abs_gap: The range of gaps covered by the shared
+                histograms. Custom counts outside the range are still sent
+                through the queue.
+            dem_cache: Where to save the detector error models and strong ids
+                of tasks given by circuit path, so that later runs can skip
+                computing them. Tasks with a known strong id (e.g. from
+                `DemCache.with_cached_strong_id`) aren't sent to workers to
+                compute their strong id. Defaults to a temporary directory
+                that is deleted when the manager stops.
+            cost_aware_scheduling: When set, idle workers are assigned to tasks
+                in proportion to each task's estimated remaining cost (shots
+                left times seconds per shot), instead of evenly. Seconds per
+                shot are measured from flushed results, seeded from existing
+                data, and otherwise guessed from the circuit's size. The goal
+                is for all tasks to finish at around the same time, so busy
+                workers are also moved off tasks that are on track to finish
+                early (see `cost_rebalance_period`).
+            cost_rebalance_period: With `cost_aware_scheduling`, the seconds
+                between passes that re-estimate each task's remaining cost
+                and move busy workers from tasks that would finish early to
+                tasks that would finish late.
+            stop_condition: Optional. Given the total stats collected for a
+                task (including existing data), returns whether the task is
+                done even though it hasn't reached its max shots (e.g.
+                `GapStoppingRule.is_satisfied`). Workers are asked to give
+                back the shots of a task as soon as it's done.
+            max_task_failures: When a worker raises an exception or dies, its
+                unflushed results are kept (when available), its shots are
+                handed to other workers, and it is restarted. A task whose
+                workers fail this many times is quarantined: it's stopped as
+                if it had finished, and listed in `quarantined_tasks`.
+            max_worker_restarts: Total worker restarts allowed before giving up
+                and raising an exception.
+            shutdown_timeout: When stopping (because the work is done or
+                because of a KeyboardInterrupt), how long to wait for workers
+                to flush their results before killing them.
+            listen_address: Optional. Where to accept connections from remote
+                workers (see `run_remote_collection_worker`), in addition to
+                the `num_workers` local worker processes. Remote workers can
+                join at any time and are scheduled exactly like local ones,
+                but are not restarted when they fail.
+            authkey: The shared secret remote workers must present.
+            remote_lease_seconds: Shots given to a remote worker are taken back
+                and given to others if the worker doesn't report any results
+                for this long (e.g. because its machine went away without
+                closing the connection).
+            metrics_callback: Optional. Called with (worker_id, strong_id,
+                metrics) whenever a worker reports the profiling metrics (see
+                `CollectionWorkHandler.take_metrics`) it accumulated since its
+                last report. Metrics are also summed into `task_metrics`.
+        """
         self.existing_data = existing_data
         self.num_workers: int = num_workers
         self.work_handler: CollectionWorkHandler = work_handler
@@ -55,41 +270,149 @@ class CollectionManager:
         self.shared_worker_output_queue: Optional[multiprocessing.SimpleQueue[Tuple[str, int, Any]]] = None
         self.worker_states: List[_ManagedWorkerState] = [_ManagedWorkerState(k) for k in range(self.num_workers)]
         self.task_states: Dict[Any, _ManagedTaskState] = {}
+        self.shared_memory_results = shared_memory_results
+        self.max_shared_abs_gap = max_shared_abs_gap
+        self.shared_results: Optional[SharedGapHistograms] = None
+        self.task_slots: Dict[str, int] = {}
+        self.dem_cache = dem_cache
+        self.cost_aware_scheduling = cost_aware_scheduling
+        self.cost_rebalance_period = cost_rebalance_period
+        self.stop_condition = stop_condition
+        self.max_task_failures = max_task_failures
+        self.max_worker_restarts = max_worker_restarts
+        self.shutdown_timeout = shutdown_timeout
+        self.worker_restarts = 0
+        self.quarantined_tasks: Dict[str, str] = {}
+        self.shutting_down = False
+        self.actually_start_worker_processes = True
+        self.listen_address = listen_address
+        self.authkey = authkey
+        self.remote_lease_seconds = remote_lease_seconds
+        self.remote_listener: Optional[RemoteWorkerListener] = None
+        self._self_contained_tasks: Dict[str, sinter.Task] = {}
+        self.metrics_callback = metrics_callback
+        self.task_metrics: Dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+        self.dem_dir: Optional[str] = None
+        self.start_time: Optional[float] = None
+        self.startup_seconds: Optional[float] = None
+        self.defer_rebalancing = False
+        self.rebalance_pending = False
 
     def start_workers(self, *, actually_start_worker_processes: bool = True):
         assert not self.started
         self.started = True
-        current_method = multiprocessing.get_start_method()
-        try:
-            # To ensure the child processes do not accidentally share ANY state
-            # related to, we use 'spawn' instead of 'fork'.
-            multiprocessing.set_start_method('spawn', force=True)
+        self.actually_start_worker_processes = actually_start_worker_processes
+        self.start_time = time.monotonic()
+        if self.dem_cache is not None:
+            self.dem_dir = str(self.dem_cache.dem_dir)
+        elif any(task.detector_error_model is None for task in self.partial_tasks):
+            # Workers computing strong ids save the detector error models they
+            # derive here, so workers sampling the task can load them instead
+            # of each recomputing them.
+            self.dem_dir = tempfile.mkdtemp(prefix='collect_gap_dems_')
+        with _spawn_start_method():
             # Create queues after setting start method to work around a deadlock
             # bug that occurs otherwise.
             self.shared_worker_output_queue = multiprocessing.SimpleQueue()
+            if self.shared_memory_results:
+                self.shared_results = SharedGapHistograms.create(
+                    num_workers=self.num_workers,
+                    num_task_slots=len(self.partial_tasks),
+                    max_abs_gap=self.max_shared_abs_gap,
+                )
 
-            num_cpus = os.cpu_count()
             for worker_id in range(self.num_workers):
-                worker_state = self.worker_states[worker_id]
-                worker_state.input_queue = multiprocessing.Queue()
-                worker_state.input_queue.cancel_join_thread()
-                worker_state.assigned_work_key = None
-                worker_state.process = multiprocessing.Process(
-                    target=collection_worker_loop,
-                    args=(
-                        self.worker_flush_period,
-                        worker_id,
-                        self.work_handler,
-                        worker_state.input_queue,
-                        self.shared_worker_output_queue,
-                        worker_id % num_cpus,
-                    ),
-                )
+                self._create_worker_process(worker_id, actually_start_worker_process=actually_start_worker_processes)
 
-                if actually_start_worker_processes:
-                    worker_state.process.start()
-        finally:
-            multiprocessing.set_start_method(current_method, force=True)
+        if self.listen_address is not None:
+            if self.authkey is None:
+                raise ValueError('Listening for remote workers requires an authkey.')
+            self.remote_listener = RemoteWorkerListener(address=self.listen_address, authkey=self.authkey)
+            self.remote_listener.start(
+                output_queue=self.shared_worker_output_queue,
+                flush_period=self.worker_flush_period,
+                work_handler=self.work_handler,
+            )
+
+    def _create_worker_process(self, worker_id: int, *, actually_start_worker_process: bool = True):
+        worker_state = self.worker_states[worker_id]
+        worker_state.input_queue = multiprocessing.Queue()
+        worker_state.input_queue.cancel_join_thread()
+        worker_state.assigned_work_key = None
+        worker_state.exit_handled = False
+        worker_state.process = multiprocessing.Process(
+            target=collection_worker_loop,
+            args=(
+                self.worker_flush_period,
+                worker_id,
+                self.work_handler,
+                worker_state.input_queue,
+                self.shared_worker_output_queue,
+                worker_id % os.cpu_count(),
+                self.shared_results,
+                self.dem_dir,
+            ),
+        )
+
+        if actually_start_worker_process:
+            worker_state.process.start()
+
+    def _restart_worker(self, worker_id: int):
+        self.worker_restarts += 1
+        if self.worker_restarts > self.max_worker_restarts:
+            raise RuntimeError(f'Workers were restarted more than {self.max_worker_restarts=} times.')
+
+        old_process = self.worker_states[worker_id].process
+        if old_process is not None and old_process.pid is not None:
+            old_process.join(timeout=1)
+            if old_process.exitcode is None:
+                old_process.kill()
+                old_process.join()
+        if self.shared_results is not None:
+            self.shared_results.reset_worker(worker_id=worker_id)
+        with _spawn_start_method():
+            self._create_worker_process(worker_id, actually_start_worker_process=self.actually_start_worker_processes)
+        if self.shared_results is not None:
+            self.worker_states[worker_id].input_queue.put(('set_task_slots', self.task_slots))
+
+    def _add_remote_worker(self, connection_key: int):
+        connection, info = self.remote_listener.take_connection(connection_key)
+        worker_id = len(self.worker_states)
+        worker_state = _ManagedWorkerState(worker_id)
+        worker_state.remote_info = info
+        worker_state.input_queue = ConnectionOutputQueue(connection)
+        self.worker_states.append(worker_state)
+        self.remote_listener.start_forwarding(
+            connection=connection,
+            worker_id=worker_id,
+            output_queue=self.shared_worker_output_queue,
+        )
+
+    def _disconnect_remote_worker(self, worker_id: int):
+        worker_state = self.worker_states[worker_id]
+        worker_state.disconnected = True
+        # In case it's still out there, tell it to stop working on its shots.
+        worker_state.input_queue.put(('stop', None))
+
+    def _self_contained_task(self, task_state: _ManagedTaskState) -> sinter.Task:
+        """Returns the task with its circuit and model included, for workers without our files."""
+        result = self._self_contained_tasks.get(task_state.strong_id)
+        if result is None:
+            result = _fill_in_task(task_state.partial_task, dem_dir=self.dem_dir)
+            self._self_contained_tasks[task_state.strong_id] = result
+        return result
+
+    def _expire_remote_leases(self):
+        now = time.monotonic()
+        for worker_state in self.worker_states:
+            if worker_state.remote_info is None or worker_state.disconnected:
+                continue
+            if worker_state.assigned_shots > 0 and now - worker_state.lease_start > self.remote_lease_seconds:
+                self._handle_worker_failure(
+                    worker_state.worker_id,
+                    unflushed_results=None,
+                    failure=f'Remote worker {worker_state.remote_info} reported nothing for {self.remote_lease_seconds} seconds.',
+                )
 
     def start_distributing_work(self):
         self._compute_task_ids()
@@ -97,8 +420,20 @@ class CollectionManager:
 
     def _compute_task_ids(self):
         idle_worker_ids = list(range(self.num_workers))
-        unknown_task_ids = list(range(len(self.partial_tasks)))
+        unknown_task_ids = []
+        for k, task in enumerate(self.partial_tasks):
+            if task._unvalidated_strong_id is not None:
+                self.task_strong_ids[k] = task._unvalidated_strong_id
+            else:
+                unknown_task_ids.append(k)
+        computed_task_ids = list(unknown_task_ids)
         worker_to_task_map = {}
+        if self.num_workers == 0:
+            # Nobody else to do it.
+            while unknown_task_ids:
+                k = unknown_task_ids.pop()
+                self.task_strong_ids[k] = compute_strong_id(self.partial_tasks[k], dem_dir=self.dem_dir)
+                self.progress_callback(None)
         while worker_to_task_map or unknown_task_ids:
             while idle_worker_ids and unknown_task_ids:
                 worker_id = idle_worker_ids.pop()
@@ -117,6 +452,10 @@ class CollectionManager:
                 elif message_type == 'stopped_due_to_exception':
                     cur_task, cur_shots_left, unflushed_work_done, traceback, ex = message_body
                     raise ValueError(f'Worker failed: traceback={traceback}') from ex
+                elif message_type == 'remote_worker_connected':
+                    self._add_remote_worker(message_body)
+                elif message_type == 'remote_worker_disconnected':
+                    self._disconnect_remote_worker(worker_id)
                 else:
                     raise NotImplementedError(f'{message_type=}')
                 self.progress_callback(None)
@@ -124,6 +463,11 @@ class CollectionManager:
                 pass
 
         assert len(idle_worker_ids) == self.num_workers
+        if self.dem_cache is not None:
+            for k in computed_task_ids:
+                self.dem_cache.record_strong_id(self.partial_tasks[k], self.task_strong_ids[k])
+            # The tasks' own models are needed by the workers for the rest of the run.
+            self.dem_cache.evict(keep=self.task_strong_ids)
         seen = set()
         for k in range(len(self.partial_tasks)):
             options = self.partial_tasks[k].collection_options.combine(self.collection_options)
@@ -137,14 +481,39 @@ class CollectionManager:
                 shots_left -= self.existing_data[key].shots
             if shots_left <= 0:
                 continue
-            self.task_states[key] = _ManagedTaskState(partial_task=self.partial_tasks[k], strong_id=key, shots_left=shots_left)
+            if key in self.existing_data and self.stop_condition is not None and self.stop_condition(self.existing_data[key].to_anon_stats()):
+                continue
+            if self.dem_dir is not None and self.partial_tasks[k].detector_error_model is None:
+                self.partial_tasks[k] = _with_known_strong_id(self.partial_tasks[k], key)
+            task_state = _ManagedTaskState(partial_task=self.partial_tasks[k], strong_id=key, shots_left=shots_left)
+            if key in self.existing_data:
+                task_state.measured_shots = self.existing_data[key].shots
+                task_state.measured_seconds = self.existing_data[key].seconds
+                task_state.total_stats = self.existing_data[key].to_anon_stats()
+            if self.cost_aware_scheduling:
+                task_state.size_bytes = _task_size_bytes(self.partial_tasks[k])
+            self.task_states[key] = task_state
+
+        if self.shared_results is not None:
+            self.task_slots = {key: k for k, key in enumerate(self.task_strong_ids)}
+            for worker_state in self.worker_states[:self.num_workers]:
+                worker_state.input_queue.put(('set_task_slots', self.task_slots))
+
+        if self.start_time is not None:
+            self.startup_seconds = time.monotonic() - self.start_time
 
     def hard_stop(self):
         if not self.started:
             return
 
+        if self.remote_listener is not None:
+            self.remote_listener.close()
+            self.remote_listener = None
         removed_workers = [state.process for state in self.worker_states]
         for state in self.worker_states:
+            if state.remote_info is not None:
+                state.input_queue.connection.close()
+                state.disconnected = True
             state.process = None
             state.assigned_work_key = None
             state.input_queue = None
@@ -153,15 +522,27 @@ class CollectionManager:
         self.task_states.clear()
 
         # SIGKILL everything.
+        removed_workers = [w for w in removed_workers if w is not None and w.pid is not None]
         for w in removed_workers:
             w.kill()
         # Wait for them to be done.
         for w in removed_workers:
             w.join()
 
+        if self.shared_results is not None:
+            self.shared_results.unlink()
+            self.shared_results = None
+        if self.dem_dir is not None and self.dem_cache is None:
+            shutil.rmtree(self.dem_dir, ignore_errors=True)
+        self.dem_dir = None
+
     def _try_del_task(self, task_id: Any):
         task_state = self.task_states[task_id]
-        if task_state.shots_left > 0 or task_state.shot_return_requests > 0:
+        if task_state.stopping:
+            if task_state.shot_return_requests > 0 or any(self.worker_states[w].assigned_shots for w in task_state.workers_assigned):
+                self._request_remaining_shots(task_state)
+                return
+        elif task_state.shots_left > 0 or task_state.shot_return_requests > 0:
             self._distribute_work_within_a_job(task_state)
             return
         for worker_id in task_state.workers_assigned:
@@ -171,8 +552,29 @@ class CollectionManager:
             assert not worker_state.asked_to_drop_shots
             worker_state.assigned_work_key = None
         del self.task_states[task_id]
+        self._self_contained_tasks.pop(task_id, None)
         self._distribute_work()
 
+    def _request_remaining_shots(self, task_state: _ManagedTaskState):
+        """Asks each worker on a stopping task to give back all of its shots.
+
+        Each worker is only asked once, because whatever it doesn't give back
+        has already been sampled and will arrive in its next flush.
+        """
+        if self.shutting_down:
+            return
+        for worker_id in task_state.workers_assigned:
+            worker_state = self.worker_states[worker_id]
+            if worker_state.asked_to_drop_shots or worker_state.assigned_shots == 0 or worker_id in task_state.stop_asked_workers:
+                continue
+            task_state.stop_asked_workers.add(worker_id)
+            worker_state.asked_to_drop_shots = worker_state.assigned_shots
+            task_state.shot_return_requests += 1
+            worker_state.input_queue.put((
+                'return_shots',
+                (task_state.strong_id, worker_state.assigned_shots),
+            ))
+
     def state_summary(self) -> str:
         lines = []
         for worker_id, worker in enumerate(self.worker_states):
@@ -188,44 +590,139 @@ class CollectionManager:
                          f'    shots_unassigned={task.shots_unassigned}')
         return '\n' + '\n'.join(lines) + '\n'
 
-    def process_message(self) -> bool:
+    def _running_worker_sentinels(self) -> Dict[int, int]:
+        """The sentinels of worker processes that haven't been seen exiting.
+
+        This includes processes that already exited (their sentinels are
+        ready) until `_handle_dead_workers` sees them, so that exits happening
+        while the manager is busy aren't missed.
+        """
+        result = {}
+        for worker_state in self.worker_states:
+            process = worker_state.process
+            if process is not None and process.pid is not None and not worker_state.exit_handled:
+                result[process.sentinel] = worker_state.worker_id
+        return result
+
+    def _wait_for_messages(self, timeout: Optional[float]) -> Tuple[List[Any], Dict[int, int]]:
+        """Waits for a message to arrive or a worker to die.
+
+        Returns:
+            The ready objects, and the sentinels that were waited on (mapped to
+            their worker ids).
+        """
+        reader = self.shared_worker_output_queue._reader
+        sentinels = self._running_worker_sentinels()
+        return multiprocessing.connection.wait([reader, *sentinels.keys()], timeout=timeout), sentinels
+
+    def _handle_dead_workers(self, ready: List[Any], sentinels: Dict[int, int]) -> None:
+        """Handles worker processes whose sentinels became ready."""
+        for sentinel in ready:
+            if sentinel not in sentinels:
+                continue
+            worker_state = self.worker_states[sentinels[sentinel]]
+            worker_state.exit_handled = True
+            if self.shutting_down:
+                # Workers are expected to exit.
+                continue
+            self._handle_worker_failure(
+                worker_state.worker_id,
+                unflushed_results=None,
+                failure=f'Worker process exited unexpectedly (exitcode={worker_state.process.exitcode}).',
+            )
+
+    def process_message(self, *, timeout: Optional[float] = None) -> bool:
+        """Handles one message from the workers, or one worker dying.
+
+        Args:
+            timeout: How long to wait for something to happen. Defaults to
+                waiting forever.
+
+        Returns:
+            True if something was handled, False if the wait timed out.
+        """
+        ready, sentinels = self._wait_for_messages(timeout)
+        if not ready:
+            return False
+        if self.shared_worker_output_queue._reader not in ready:
+            # Only consider a worker dead once everything it sent has been read.
+            self._handle_dead_workers(ready, sentinels)
+            return True
+
         try:
             message = self.shared_worker_output_queue.get()
         except queue.Empty:
             return False
+        self._handle_message(message)
+        return True
 
+    def process_message_batch(self, *, max_messages: int = 1000) -> int:
+        """Handles the messages that have already arrived, without waiting.
+
+        Returns:
+            The number of messages handled.
+        """
+        reader = self.shared_worker_output_queue._reader
+        num_handled = 0
+        while num_handled < max_messages and reader.poll():
+            self._handle_message(self.shared_worker_output_queue.get())
+            num_handled += 1
+        return num_handled
+
+    def _handle_message(self, message: Tuple[str, int, Any]) -> None:
         message_type, worker_id, message_body = message
+        if message_type == 'remote_worker_connected':
+            if self.shutting_down:
+                connection, _ = self.remote_listener.take_connection(message_body)
+                connection.close()
+                return
+            self._add_remote_worker(message_body)
+            self._distribute_work()
+            self.progress_callback(None)
+            return
         worker_state = self.worker_states[worker_id]
+        if worker_state.disconnected:
+            # Its shots have already been given to other workers.
+            return
+        if message_type in ['flushed_results', 'flushed_shared_results', 'returned_shots']:
+            worker_state.lease_start = time.monotonic()
 
-        if message_type == 'flushed_results':
-            task_strong_id, anon_stat = message_body
-            assert isinstance(anon_stat, sinter.AnonTaskStats)
-            assert worker_state.assigned_work_key == task_strong_id
-            task_state = self.task_states[task_strong_id]
-            assert worker_state.assigned_shots >= anon_stat.shots
-            worker_state.assigned_shots -= anon_stat.shots
-            task_state.shots_left -= anon_stat.shots
-
-            stat = sinter.TaskStats(
-                strong_id=task_state.strong_id,
-                decoder=task_state.partial_task.decoder,
-                json_metadata=task_state.partial_task.json_metadata,
-                shots=anon_stat.shots,
-                discards=anon_stat.discards,
-                seconds=anon_stat.seconds,
-                errors=anon_stat.errors,
-                custom_counts=anon_stat.custom_counts,
+        if message_type == 'remote_worker_disconnected':
+            if self.shutting_down:
+                # It was told to stop.
+                worker_state.disconnected = True
+                return
+            self._handle_worker_failure(
+                worker_id,
+                unflushed_results=None,
+                failure=f'Lost connection to remote worker {worker_state.remote_info}.',
             )
 
-            self._try_del_task(task_strong_id)
+        elif message_type == 'flushed_results':
+            task_strong_id, anon_stat = message_body
+            assert isinstance(anon_stat, sinter.AnonTaskStats)
+            self._handle_flushed_results(worker_state, task_strong_id, anon_stat)
 
-            self.progress_callback(stat)
+        elif message_type == 'flushed_shared_results':
+            task_strong_id, overflow_counts = message_body
+            assert self.shared_results is not None
+            anon_stat = self.shared_results.take_delta(worker_id=worker_id, slot=self.task_slots[task_strong_id])
+            anon_stat += sinter.AnonTaskStats(custom_counts=overflow_counts)
+            # An earlier announcement may have already taken this flush's counts.
+            if anon_stat.shots or anon_stat.custom_counts:
+                self._handle_flushed_results(worker_state, task_strong_id, anon_stat)
 
-        elif message_type == 'changed_job':
-            pass
+        elif message_type == 'worker_status':
+            task_strong_id, status = message_body
+            if worker_state.assigned_work_key == task_strong_id:
+                worker_state.status = status
+                self.progress_callback(None)
 
-        elif message_type == 'accepted_shots':
-            pass
+        elif message_type == 'worker_metrics':
+            task_strong_id, metrics = message_body
+            self.task_metrics[task_strong_id].update(metrics)
+            if self.metrics_callback is not None:
+                self.metrics_callback(worker_id, task_strong_id, metrics)
 
         elif message_type == 'returned_shots':
             task_key, shots_returned = message_body
@@ -237,40 +734,269 @@ class CollectionManager:
             worker_state.asked_to_drop_shots = 0
             task_state.shots_unassigned += shots_returned
             worker_state.assigned_shots -= shots_returned
+            self._release_leaving_worker(task_state, worker_state)
             self._try_del_task(task_key)
 
         elif message_type == 'stopped_due_to_exception':
             cur_task, cur_shots_left, unflushed_work_done, traceback, ex = message_body
-            raise ValueError(f'Worker failed: traceback={traceback}') from ex
+            if cur_task != worker_state.assigned_work_key:
+                unflushed_work_done = None
+            self._handle_worker_failure(worker_id, unflushed_results=unflushed_work_done, failure=traceback)
 
         else:
             raise NotImplementedError(f'{message_type=}')
 
-        return True
+    def _handle_worker_failure(
+            self,
+            worker_id: int,
+            *,
+            unflushed_results: Optional[sinter.AnonTaskStats],
+            failure: str,
+    ):
+        """Salvages what a failed worker did, gives its shots to others, and restarts it."""
+        worker_state = self.worker_states[worker_id]
+        task_id = worker_state.assigned_work_key
+        print(f'Worker {worker_id} failed while working on task {task_id}:\n{failure}', file=sys.stderr, flush=True)
+
+        stat = None
+        if task_id is not None and task_id in self.task_states:
+            task_state = self.task_states[task_id]
+            if unflushed_results is not None and unflushed_results.shots > 0:
+                assert worker_state.assigned_shots >= unflushed_results.shots
+                worker_state.assigned_shots -= unflushed_results.shots
+                stat = self._record_results(task_state, unflushed_results)
+            task_state.shots_unassigned += worker_state.assigned_shots
+            if worker_state.asked_to_drop_shots:
+                task_state.shot_return_requests -= 1
+            task_state.workers_assigned.remove(worker_id)
+            task_state.stop_asked_workers.discard(worker_id)
+            task_state.leaving_workers.discard(worker_id)
+            task_state.failures += 1
+            if task_state.failures >= self.max_task_failures and not task_state.stopping:
+                print(f'Quarantining task {task_id} after {task_state.failures} failures.', file=sys.stderr, flush=True)
+                self.quarantined_tasks[task_id] = failure
+                task_state.stopping = True
+
+        worker_state.assigned_work_key = None
+        worker_state.assigned_shots = 0
+        worker_state.asked_to_drop_shots = 0
+        worker_state.status = {}
+        if worker_state.remote_info is not None:
+            self._disconnect_remote_worker(worker_id)
+        elif not self.shutting_down:
+            self._restart_worker(worker_id)
+
+        if task_id is not None and task_id in self.task_states:
+            task_state = self.task_states[task_id]
+            if task_state.stopping or task_state.shots_left <= 0:
+                self._try_del_task(task_id)
+        # Handles the restarted worker (and the failed worker's shots).
+        self._distribute_work()
+        if stat is not None:
+            self.progress_callback(stat)
+
+    def _handle_flushed_results(self, worker_state: _ManagedWorkerState, task_strong_id: str, anon_stat: sinter.AnonTaskStats):
+        assert worker_state.assigned_work_key == task_strong_id
+        task_state = self.task_states[task_strong_id]
+        assert worker_state.assigned_shots >= anon_stat.shots
+        worker_state.assigned_shots -= anon_stat.shots
+        stat = self._record_results(task_state, anon_stat)
+
+        self._release_leaving_worker(task_state, worker_state)
+        self._try_del_task(task_strong_id)
+
+        self.progress_callback(stat)
+
+    def _record_results(self, task_state: _ManagedTaskState, anon_stat: sinter.AnonTaskStats) -> sinter.TaskStats:
+        task_state.shots_left -= anon_stat.shots
+        task_state.measured_shots += anon_stat.shots
+        task_state.measured_seconds += anon_stat.seconds
+        task_state.total_stats += anon_stat
+        if self.stop_condition is not None and not task_state.stopping and task_state.shots_left > 0 and self.stop_condition(task_state.total_stats):
+            task_state.stopping = True
+
+        return sinter.TaskStats(
+            strong_id=task_state.strong_id,
+            decoder=task_state.partial_task.decoder,
+            json_metadata=task_state.partial_task.json_metadata,
+            shots=anon_stat.shots,
+            discards=anon_stat.discards,
+            seconds=anon_stat.seconds,
+            errors=anon_stat.errors,
+            custom_counts=anon_stat.custom_counts,
+        )
+
+    def _periodic_work(
+            self,
+            periodic_callbacks: Iterable[Tuple[float, Callable[[], None]]],
+    ) -> List[Tuple[float, Callable[[], None]]]:
+        result = list(periodic_callbacks)
+        if self.remote_listener is not None:
+            result.append((1, self._expire_remote_leases))
+        if self.cost_aware_scheduling:
+            result.append((self.cost_rebalance_period, self._rebalance_busy_workers_by_cost))
+        return result
+
+    def run_until_done(self, *, periodic_callbacks: Iterable[Tuple[float, Callable[[], None]]] = ()):
+        """Handles messages from the workers until all tasks are done.
 
-    def run_until_done(self):
+        Args:
+            periodic_callbacks: (period, callback) pairs. Each callback is
+                called every `period` seconds while waiting for the workers
+                (e.g. to keep a status file fresh when no results arrive).
+        """
+        calls = _PeriodicCalls(self._periodic_work(periodic_callbacks))
         try:
             while self.task_states:
-                self.process_message()
+                self.process_message(timeout=calls.seconds_until_next())
+                calls.run_due()
 
         except KeyboardInterrupt:
             pass
 
         finally:
-            self.hard_stop()
+            try:
+                self.flush_and_stop_workers()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.hard_stop()
+
+    async def run_until_done_async(
+            self,
+            *,
+            rebalance_period: float = 0.25,
+            write_period: float = 1,
+            max_batch_messages: int = 1000,
+            periodic_callbacks: Iterable[Tuple[float, Callable[[], None]]] = (),
+    ):
+        """Like `run_until_done`, but built to keep up with many workers.
+
+        Instead of handling one message at a time and reacting to each one
+        fully, this
+
+        - waits for messages in an executor thread, so the event loop stays
+            free, then drains every message that has already arrived in one
+            batch;
+        - defers rebalancing (reassigning idle workers and shots across
+            tasks) to a timer that runs at most every `rebalance_period`
+            seconds, instead of redoing it after every flush;
+        - passes results to `progress_callback` from a separate writer task,
+            so printing and file writes happen between batches instead of in
+            the middle of message handling. The writer runs at most every
+            `write_period` seconds, and merges the results it got for each
+            task, so there's one result (one CSV row) per task per write
+            instead of one per worker flush.
+
+        Args:
+            rebalance_period: Seconds between rebalancing passes (and remote
+                lease checks).
+            write_period: Minimum seconds between calls of the writer task
+                to `progress_callback`.
+            max_batch_messages: The most messages to handle before giving the
+                writer and rebalancer a chance to run.
+            periodic_callbacks: (period, callback) pairs. Each callback is
+                called every `period` seconds from the event loop, whether or
+                not results arrive.
+        """
+        loop = asyncio.get_running_loop()
+        callback = self.progress_callback
+        pending: asyncio.Queue = asyncio.Queue()
+        self.progress_callback = pending.put_nowait
+        writer = asyncio.create_task(_write_progress(pending, callback, write_period))
+        self.defer_rebalancing = True
+        calls = _PeriodicCalls([
+            (rebalance_period, self._rebalance_if_pending),
+            *self._periodic_work(periodic_callbacks),
+        ])
+        try:
+            while self.task_states:
+                calls.run_due()
+                if not self.task_states:
+                    break
+                if not self.process_message_batch(max_messages=max_batch_messages):
+                    timeout = calls.seconds_until_next()
+                    ready, sentinels = await loop.run_in_executor(None, self._wait_for_messages, timeout)
+                    if ready and self.shared_worker_output_queue._reader not in ready:
+                        # Only consider a worker dead once everything it sent has been read.
+                        self._handle_dead_workers(ready, sentinels)
+                # Let the writer catch up.
+                await asyncio.sleep(0)
+                if writer.done():
+                    writer.result()
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            self.defer_rebalancing = False
+            self.rebalance_pending = False
+            self.progress_callback = callback
+            pending.put_nowait(_STOP_WRITING)
+            try:
+                # Let the writer pass on everything that was queued.
+                await writer
+            finally:
+                try:
+                    self.flush_and_stop_workers()
+                except KeyboardInterrupt:
+                    pass
+                finally:
+                    self.hard_stop()
+
+    def _rebalance_if_pending(self):
+        if self.rebalance_pending:
+            self.rebalance()
+
+    def rebalance(self):
+        """Runs a rebalancing pass that was deferred by `run_until_done_async`."""
+        self.rebalance_pending = False
+        defer = self.defer_rebalancing
+        self.defer_rebalancing = False
+        try:
+            self._distribute_work()
+        finally:
+            self.defer_rebalancing = defer
+
+    def flush_and_stop_workers(self):
+        """Asks workers to flush and stop, and handles what they send until they exit.
+
+        This keeps results that were sampled but not yet flushed from being
+        lost when stopping early. Gives up after `shutdown_timeout` seconds.
+        """
+        if not self.started:
+            return
+        self.shutting_down = True
+        for worker_state in self.worker_states:
+            if worker_state.input_queue is not None:
+                worker_state.input_queue.put(('flush_results', None))
+                worker_state.input_queue.put(('stop', None))
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        while self._running_worker_sentinels() or any(w.remote_info is not None and not w.disconnected for w in self.worker_states):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.process_message(timeout=remaining)
+        while not self.shared_worker_output_queue.empty():
+            self.process_message(timeout=0)
 
     def _distribute_idle_workers_to_jobs(self):
         idle_workers = [
             w
-            for w in range(self.num_workers)[::-1]
-            if self.worker_states[w].assigned_work_key is None and not self.worker_states[w].asked_to_drop_shots
+            for w in range(len(self.worker_states))[::-1]
+            if self.worker_states[w].assigned_work_key is None and not self.worker_states[w].asked_to_drop_shots and not self.worker_states[w].disconnected
         ]
         if not idle_workers or not self.started:
             return
 
+        if self.cost_aware_scheduling:
+            self._distribute_idle_workers_by_cost(idle_workers)
+            return
+
         groups = collections.defaultdict(list)
         for work_state in self.task_states.values():
-            if work_state.shots_left > 0:
+            if work_state.shots_left > 0 and not work_state.stopping:
                 groups[len(work_state.workers_assigned)].append(work_state)
         for k in groups.keys():
             groups[k] = groups[k][::-1]
@@ -285,24 +1011,130 @@ class CollectionManager:
             if not groups[min_assigned]:
                 min_assigned += 1
 
-            worker_id = idle_workers.pop()
-            task_state.workers_assigned.append(worker_id)
-            worker_state = self.worker_states[worker_id]
-            worker_state.assigned_work_key = task_state.strong_id
-            worker_state.input_queue.put((
-                'change_job',
-                (task_state.partial_task, 0),
-            ))
+            self._assign_worker_to_task(idle_workers.pop(), task_state)
+
+    def _assign_worker_to_task(self, worker_id: int, task_state: _ManagedTaskState):
+        task_state.workers_assigned.append(worker_id)
+        worker_state = self.worker_states[worker_id]
+        worker_state.assigned_work_key = task_state.strong_id
+        worker_state.status = {}
+        task = task_state.partial_task
+        if worker_state.remote_info is not None:
+            task = self._self_contained_task(task_state)
+        worker_state.input_queue.put((
+            'change_job',
+            (task, 0),
+        ))
+
+    def estimated_seconds_per_shot(self, task_state: _ManagedTaskState) -> float:
+        if task_state.measured_shots > 0 and task_state.measured_seconds > 0:
+            return task_state.measured_seconds / task_state.measured_shots
+
+        # Guess by scaling the circuit size by how other tasks are doing.
+        seconds_per_shot_per_byte = [
+            t.measured_seconds / t.measured_shots / t.size_bytes
+            for t in self.task_states.values()
+            if t.measured_shots > 0 and t.measured_seconds > 0 and t.size_bytes > 0
+        ]
+        scale = statistics.median(seconds_per_shot_per_byte) if seconds_per_shot_per_byte else 1e-9
+        return max(task_state.size_bytes, 1) * scale
+
+    def _distribute_idle_workers_by_cost(self, idle_workers: List[int]):
+        task_states = [t for t in self.task_states.values() if t.shots_left > 0 and not t.stopping]
+        if not task_states:
+            return
+        costs = {t.strong_id: t.shots_left * self.estimated_seconds_per_shot(t) for t in task_states}
+
+        # Make sure every task is making progress (and being measured), most
+        # expensive first.
+        for task_state in sorted(task_states, key=lambda t: costs[t.strong_id], reverse=True):
+            if idle_workers and not task_state.workers_assigned:
+                self._assign_worker_to_task(idle_workers.pop(), task_state)
+
+        # Give each remaining worker to the task with the largest cost per
+        # worker after the assignment, so that workers end up proportional to
+        # cost.
+        while idle_workers:
+            task_state = max(task_states, key=lambda t: costs[t.strong_id] / (len(t.workers_assigned) + 1))
+            self._assign_worker_to_task(idle_workers.pop(), task_state)
+
+    def _rebalance_busy_workers_by_cost(self):
+        """Moves busy workers from tasks that will finish early to tasks that will finish late.
+
+        Idle workers are handed out by cost, but a task keeps its workers
+        after measurements show it's cheaper than it was estimated to be. This
+        re-estimates the seconds each task needs per worker, and while moving
+        a worker would shorten the slowest task without making its donor the
+        new slowest task, asks a donor worker to give back its shots. Once it
+        has nothing left to flush, it's released and assigned like any idle
+        worker.
+        """
+        if self.shutting_down or not self.started:
+            return
+        if any(t.leaving_workers for t in self.task_states.values()):
+            # Estimates don't account for moves in progress yet.
+            return
+        task_states = [t for t in self.task_states.values() if t.shots_left > 0 and not t.stopping]
+        costs = {t.strong_id: t.shots_left * self.estimated_seconds_per_shot(t) for t in task_states}
+        counts = {t.strong_id: len(t.workers_assigned) for t in task_states}
+
+        def seconds_left(task_state: _ManagedTaskState, workers: int) -> float:
+            return costs[task_state.strong_id] / workers if workers else float('inf')
+
+        donors = []
+        while True:
+            receiver = max(task_states, key=lambda t: seconds_left(t, counts[t.strong_id]), default=None)
+            candidates = [t for t in task_states if t is not receiver and counts[t.strong_id] >= 2]
+            if not candidates:
+                break
+            donor = min(candidates, key=lambda t: seconds_left(t, counts[t.strong_id] - 1))
+            if seconds_left(receiver, counts[receiver.strong_id]) <= seconds_left(donor, counts[donor.strong_id] - 1):
+                break
+            counts[donor.strong_id] -= 1
+            counts[receiver.strong_id] += 1
+            donors.append(donor)
+
+        for task_state in donors:
+            worker_ids = [
+                w
+                for w in task_state.workers_assigned
+                if w not in task_state.leaving_workers and not self.worker_states[w].asked_to_drop_shots
+            ]
+            if not worker_ids:
+                continue
+            worker_state = self.worker_states[min(worker_ids, key=lambda w: self.worker_states[w].assigned_shots)]
+            task_state.leaving_workers.add(worker_state.worker_id)
+            if worker_state.assigned_shots:
+                worker_state.asked_to_drop_shots = worker_state.assigned_shots
+                task_state.shot_return_requests += 1
+                worker_state.input_queue.put((
+                    'return_shots',
+                    (task_state.strong_id, worker_state.assigned_shots),
+                ))
+            else:
+                self._release_leaving_worker(task_state, worker_state)
+
+    def _release_leaving_worker(self, task_state: _ManagedTaskState, worker_state: _ManagedWorkerState):
+        """Unassigns a worker that is being moved off a task, once it has nothing left to flush."""
+        worker_id = worker_state.worker_id
+        if worker_id not in task_state.leaving_workers or worker_state.assigned_shots or worker_state.asked_to_drop_shots:
+            return
+        task_state.leaving_workers.discard(worker_id)
+        task_state.workers_assigned.remove(worker_id)
+        worker_state.assigned_work_key = None
+        worker_state.status = {}
+        self._distribute_work()
 
     def _distribute_unassigned_work_to_workers_within_a_job(self, task_state: _ManagedTaskState):
-        if not self.started or not task_state.workers_assigned or task_state.shots_left <= 0:
+        workers = [w for w in task_state.workers_assigned if w not in task_state.leaving_workers]
+        if not self.started or not workers or task_state.shots_left <= 0 or task_state.stopping:
             return
 
-        w = len(task_state.workers_assigned)
+        w = len(workers)
         expected_work_per_worker = (task_state.shots_left + w - 1) // w
 
         # Give unassigned shots to idle workers.
-        for worker_id in sorted(task_state.workers_assigned, key=lambda w: self.worker_states[w].assigned_shots):
+        for worker_id in sorted(workers, key=lambda w: self.worker_states[w].assigned_shots):
             worker_state = self.worker_states[worker_id]
             if worker_state.assigned_shots < expected_work_per_worker:
                 shots_to_assign = min(expected_work_per_worker - worker_state.assigned_shots,
@@ -310,23 +1142,25 @@ class CollectionManager:
                 if shots_to_assign > 0:
                     task_state.shots_unassigned -= shots_to_assign
                     worker_state.assigned_shots += shots_to_assign
+                    worker_state.lease_start = time.monotonic()
                     worker_state.input_queue.put((
                         'accept_shots',
                         (task_state.strong_id, shots_to_assign),
                     ))
 
     def _take_work_if_unsatisfied_workers_within_a_job(self, task_state: _ManagedTaskState):
-        if not self.started or not task_state.workers_assigned or task_state.shots_left <= 0:
+        workers = [w for w in task_state.workers_assigned if w not in task_state.leaving_workers]
+        if not self.started or not workers or task_state.shots_left <= 0 or task_state.stopping:
             return
 
-        if all(self.worker_states[w].assigned_shots for w in task_state.workers_assigned):
+        if all(self.worker_states[w].assigned_shots for w in workers):
             return
 
-        w = len(task_state.workers_assigned)
+        w = len(workers)
         expected_work_per_worker = (task_state.shots_left + w - 1) // w
 
         # There are idle workers that couldn't be given any shots. Take shots from other workers.
-        for worker_id in sorted(task_state.workers_assigned, key=lambda w: self.worker_states[w].assigned_shots, reverse=True):
+        for worker_id in sorted(workers, key=lambda w: self.worker_states[w].assigned_shots, reverse=True):
             worker_state = self.worker_states[worker_id]
             if worker_state.asked_to_drop_shots or worker_state.assigned_shots <= expected_work_per_worker + 128:
                 continue
@@ -340,10 +1174,17 @@ class CollectionManager:
             ))
 
     def _distribute_work_within_a_job(self, w: _ManagedTaskState):
+        if self.shutting_down:
+            return
         self._distribute_unassigned_work_to_workers_within_a_job(w)
         self._take_work_if_unsatisfied_workers_within_a_job(w)
 
     def _distribute_work(self):
+        if self.shutting_down:
+            return
+        if self.defer_rebalancing:
+            self.rebalance_pending = True
+            return
         self._distribute_idle_workers_to_jobs()
         for w in self.task_states.values():
             self._distribute_work_within_a_job(w)
@@ -1,11 +1,15 @@
+import asyncio
+import collections
 import multiprocessing
+import os
 import time
-from typing import Any, List, Union
+from typing import Any, List, Optional, Union
 
+import pytest
 import sinter
 import stim
 
-from yoked.gap._collection_manager import CollectionManager
+from yoked.gap._collection_manager import CollectionManager, _forward_progress
 from yoked.gap._collection_work_handler import CollectionWorkHandler
 
 
@@ -279,3 +283,464 @@ task task.strong_id='a9165b6e4ab1053c04c017d0739a7bfff0910d62091fc9ee81716833eda
         ('return_shots', (t1.strong_id(), 1000000)),
         ('change_job', (t0, 0)),
     ])
+
+
+def test_manager_cost_aware_scheduling():
+    t0 = sinter.Task(
+        circuit=stim.Circuit('H 0'),
+        detector_error_model=stim.DetectorErrorModel(),
+        decoder='pymatching',
+        json_metadata={'a': 0},
+    )
+    t1 = sinter.Task(
+        circuit=stim.Circuit('H 0'),
+        detector_error_model=stim.DetectorErrorModel(),
+        decoder='pymatching',
+        json_metadata={'a': 1},
+    )
+    t2 = sinter.Task(
+        circuit=stim.Circuit('H 0'),
+        detector_error_model=stim.DetectorErrorModel(),
+        decoder='pymatching',
+        json_metadata={'a': 2},
+    )
+    existing_data = {
+        t0.strong_id(): sinter.TaskStats(strong_id=t0.strong_id(), decoder='pymatching', json_metadata={'a': 0}, shots=100, seconds=3),
+        t1.strong_id(): sinter.TaskStats(strong_id=t1.strong_id(), decoder='pymatching', json_metadata={'a': 1}, shots=100, seconds=1.2),
+    }
+    manager = CollectionManager(
+        num_workers=5,
+        work_handler=TestWorkHandler(),
+        worker_flush_period=30,
+        tasks=[t0, t1, t2],
+        progress_callback=lambda _: None,
+        existing_data=existing_data,
+        collection_options=sinter.CollectionOptions(max_shots=1100),
+        cost_aware_scheduling=True,
+    )
+    manager.start_workers(actually_start_worker_processes=False)
+    # Only t2's strong id is unknown (the others were computed for the existing data).
+    manager.shared_worker_output_queue.put(('computed_strong_id', 4, t2.strong_id()))
+    manager.start_distributing_work()
+    assert manager.task_strong_ids == [t0.strong_id(), t1.strong_id(), t2.strong_id()]
+
+    # t2 has no measurements, so it's estimated using the median cost per circuit byte of the others.
+    assert manager.estimated_seconds_per_shot(manager.task_states[t0.strong_id()]) == pytest.approx(0.03)
+    assert manager.estimated_seconds_per_shot(manager.task_states[t1.strong_id()]) == pytest.approx(0.012)
+    assert manager.estimated_seconds_per_shot(manager.task_states[t2.strong_id()]) == pytest.approx(0.021)
+    # Remaining costs are 30s, 12s, and 23.1s.
+    assert len(manager.task_states[t0.strong_id()].workers_assigned) == 2
+    assert len(manager.task_states[t1.strong_id()].workers_assigned) == 1
+    assert len(manager.task_states[t2.strong_id()].workers_assigned) == 2
+
+
+class _SleepyWorkHandler(CollectionWorkHandler):
+    def do_some_work(self, request: sinter.Task, max_shots: int) -> sinter.AnonTaskStats:
+        shots = min(max_shots, 10)
+        seconds = shots * request.json_metadata['seconds_per_shot']
+        time.sleep(seconds)
+        return sinter.AnonTaskStats(shots=shots, seconds=seconds)
+
+
+@pytest.mark.parametrize('cost_aware_scheduling', [False, True])
+def test_manager_cost_aware_scheduling_moves_busy_workers(cost_aware_scheduling: bool):
+    # The circuits are the same size, so the tasks look equally expensive until they're measured.
+    tasks = [
+        sinter.Task(
+            circuit=stim.Circuit(f'H {k}'),
+            detector_error_model=stim.DetectorErrorModel(),
+            decoder='pymatching',
+            json_metadata={'seconds_per_shot': seconds_per_shot},
+        )
+        for k, seconds_per_shot in enumerate([0.002, 0.006])
+    ]
+    shots_done = collections.Counter()
+    end_times = {}
+
+    def progress_callback(stat: Optional[sinter.TaskStats]):
+        if stat is not None:
+            shots_done[stat.json_metadata['seconds_per_shot']] += stat.shots
+            if shots_done[stat.json_metadata['seconds_per_shot']] == 1000:
+                end_times[stat.json_metadata['seconds_per_shot']] = time.monotonic()
+
+    manager = CollectionManager(
+        num_workers=4,
+        work_handler=_SleepyWorkHandler(),
+        worker_flush_period=0.05,
+        tasks=tasks,
+        progress_callback=progress_callback,
+        existing_data={},
+        collection_options=sinter.CollectionOptions(max_shots=1000),
+        cost_aware_scheduling=cost_aware_scheduling,
+        cost_rebalance_period=0.2,
+    )
+    manager.start_workers()
+    manager.start_distributing_work()
+    assert [len(manager.task_states[t].workers_assigned) for t in manager.task_strong_ids] == [2, 2]
+    t0 = time.monotonic()
+    manager.run_until_done()
+
+    # Evenly split, the cheap task ends at around a third of the total
+    # time. Moving one of its workers early lets the tasks end together.
+    cheap_seconds = end_times[0.002] - t0
+    expensive_seconds = end_times[0.006] - t0
+    if cost_aware_scheduling:
+        assert cheap_seconds > 0.75 * expensive_seconds
+    else:
+        assert cheap_seconds < 0.6 * expensive_seconds
+
+
+def test_manager_stop_condition():
+    t0 = sinter.Task(
+        circuit=stim.Circuit('H 0'),
+        detector_error_model=stim.DetectorErrorModel(),
+        decoder='pymatching',
+        json_metadata={'a': 0},
+    )
+    # Computing the strong id up front means no worker is asked to compute it.
+    t0.strong_id()
+    log = []
+    manager = CollectionManager(
+        num_workers=2,
+        work_handler=TestWorkHandler(),
+        worker_flush_period=30,
+        tasks=[t0],
+        progress_callback=log.append,
+        existing_data={},
+        collection_options=sinter.CollectionOptions(max_shots=1000),
+        stop_condition=lambda stats: stats.errors >= 10,
+    )
+    manager.start_workers(actually_start_worker_processes=False)
+    manager.start_distributing_work()
+    _assert_drain_queue(manager.worker_states[0].input_queue, [
+        ('change_job', (t0, 0)),
+        ('accept_shots', (t0.strong_id(), 500)),
+    ])
+    _assert_drain_queue(manager.worker_states[1].input_queue, [
+        ('change_job', (t0, 0)),
+        ('accept_shots', (t0.strong_id(), 500)),
+    ])
+
+    # Not done yet.
+    _put_wait_not_empty(manager.shared_worker_output_queue, (
+        'flushed_results', 0, (t0.strong_id(), sinter.AnonTaskStats(shots=100, errors=5)),
+    ))
+    assert manager.process_message()
+    _assert_drain_queue(manager.worker_states[0].input_queue, [])
+    _assert_drain_queue(manager.worker_states[1].input_queue, [])
+
+    # Done. Workers are asked to give back everything.
+    _put_wait_not_empty(manager.shared_worker_output_queue, (
+        'flushed_results', 1, (t0.strong_id(), sinter.AnonTaskStats(shots=100, errors=5)),
+    ))
+    assert manager.process_message()
+    _assert_drain_queue(manager.worker_states[0].input_queue, [
+        ('return_shots', (t0.strong_id(), 400)),
+    ])
+    _assert_drain_queue(manager.worker_states[1].input_queue, [
+        ('return_shots', (t0.strong_id(), 400)),
+    ])
+
+    # Worker 0 had some shots it had already sampled.
+    _put_wait_not_empty(manager.shared_worker_output_queue, (
+        'returned_shots', 0, (t0.strong_id(), 350),
+    ))
+    assert manager.process_message()
+    _put_wait_not_empty(manager.shared_worker_output_queue, (
+        'returned_shots', 1, (t0.strong_id(), 400),
+    ))
+    assert manager.process_message()
+    assert t0.strong_id() in manager.task_states
+    _assert_drain_queue(manager.worker_states[0].input_queue, [])
+    _assert_drain_queue(manager.worker_states[1].input_queue, [])
+
+    _put_wait_not_empty(manager.shared_worker_output_queue, (
+        'flushed_results', 0, (t0.strong_id(), sinter.AnonTaskStats(shots=50, errors=1)),
+    ))
+    assert manager.process_message()
+    assert not manager.task_states
+    assert [e.shots for e in log if e is not None] == [100, 100, 50]
+
+
+def test_manager_worker_metrics():
+    t0 = sinter.Task(
+        circuit=stim.Circuit('H 0'),
+        detector_error_model=stim.DetectorErrorModel(),
+        decoder='pymatching',
+        json_metadata={'a': 0},
+    )
+    t0.strong_id()
+    reports = []
+    manager = CollectionManager(
+        num_workers=2,
+        work_handler=TestWorkHandler(),
+        worker_flush_period=30,
+        tasks=[t0],
+        progress_callback=lambda _: None,
+        existing_data={},
+        collection_options=sinter.CollectionOptions(max_shots=1000),
+        metrics_callback=lambda *args: reports.append(args),
+    )
+    manager.start_workers(actually_start_worker_processes=False)
+    manager.start_distributing_work()
+    _put_wait_not_empty(manager.shared_worker_output_queue, (
+        'worker_metrics', 0, (t0.strong_id(), {'sample_seconds': 0.5, 'shots': 100}),
+    ))
+    assert manager.process_message()
+    _put_wait_not_empty(manager.shared_worker_output_queue, (
+        'worker_metrics', 1, (t0.strong_id(), {'sample_seconds': 0.25, 'shots': 50, 'decode_calls': 2}),
+    ))
+    assert manager.process_message()
+    assert reports == [
+        (0, t0.strong_id(), {'sample_seconds': 0.5, 'shots': 100}),
+        (1, t0.strong_id(), {'sample_seconds': 0.25, 'shots': 50, 'decode_calls': 2}),
+    ]
+    assert manager.task_metrics[t0.strong_id()] == {'sample_seconds': 0.75, 'shots': 150, 'decode_calls': 2}
+
+
+def test_manager_worker_failures():
+    t0 = sinter.Task(
+        circuit=stim.Circuit('H 0'),
+        detector_error_model=stim.DetectorErrorModel(),
+        decoder='pymatching',
+        json_metadata={'a': 0},
+    )
+    # Computing the strong id up front means no worker is asked to compute it.
+    t0.strong_id()
+    log = []
+    manager = CollectionManager(
+        num_workers=2,
+        work_handler=TestWorkHandler(),
+        worker_flush_period=30,
+        tasks=[t0],
+        progress_callback=log.append,
+        existing_data={},
+        collection_options=sinter.CollectionOptions(max_shots=1000),
+        max_task_failures=2,
+    )
+    manager.start_workers(actually_start_worker_processes=False)
+    manager.start_distributing_work()
+    old_queue = manager.worker_states[0].input_queue
+    _assert_drain_queue(old_queue, [
+        ('change_job', (t0, 0)),
+        ('accept_shots', (t0.strong_id(), 500)),
+    ])
+    _assert_drain_queue(manager.worker_states[1].input_queue, [
+        ('change_job', (t0, 0)),
+        ('accept_shots', (t0.strong_id(), 500)),
+    ])
+
+    # The results the failed worker had sampled are kept, and it's replaced.
+    _put_wait_not_empty(manager.shared_worker_output_queue, (
+        'stopped_due_to_exception',
+        0,
+        (t0.strong_id(), 400, sinter.AnonTaskStats(shots=100, errors=3), 'fake traceback', ValueError('fake')),
+    ))
+    assert manager.process_message()
+    assert log.pop() == sinter.TaskStats(
+        strong_id=t0.strong_id(),
+        decoder='pymatching',
+        json_metadata={'a': 0},
+        shots=100,
+        errors=3,
+    )
+    assert manager.worker_restarts == 1
+    assert manager.worker_states[0].input_queue is not old_queue
+    _assert_drain_queue(manager.worker_states[0].input_queue, [
+        ('change_job', (t0, 0)),
+        ('accept_shots', (t0.strong_id(), 400)),
+    ])
+    _assert_drain_queue(manager.worker_states[1].input_queue, [])
+    assert manager.state_summary() == f"""
+worker 0: asked_to_drop_shots=0 assigned_shots=400 assigned_work_key={t0.strong_id()}
+worker 1: asked_to_drop_shots=0 assigned_shots=500 assigned_work_key={t0.strong_id()}
+task task.strong_id='{t0.strong_id()}':
+    workers_assigned=[1, 0]
+    shot_return_requests=0
+    shots_left=900
+    shots_unassigned=0
+"""
+
+    # Failing again quarantines the task.
+    _put_wait_not_empty(manager.shared_worker_output_queue, (
+        'stopped_due_to_exception',
+        1,
+        (t0.strong_id(), 500, sinter.AnonTaskStats(), 'fake traceback 2', ValueError('fake')),
+    ))
+    assert manager.process_message()
+    assert manager.quarantined_tasks == {t0.strong_id(): 'fake traceback 2'}
+    _assert_drain_queue(manager.worker_states[0].input_queue, [
+        ('return_shots', (t0.strong_id(), 400)),
+    ])
+    _assert_drain_queue(manager.worker_states[1].input_queue, [])
+    _put_wait_not_empty(manager.shared_worker_output_queue, (
+        'returned_shots', 0, (t0.strong_id(), 400),
+    ))
+    assert manager.process_message()
+    assert not manager.task_states
+
+
+class _FailOnceWorkHandler(CollectionWorkHandler):
+    def __init__(self, marker_path: str, hard_exit: bool):
+        self.marker_path = marker_path
+        self.hard_exit = hard_exit
+
+    def do_some_work(self, request: sinter.Task, max_shots: int) -> sinter.AnonTaskStats:
+        try:
+            # Created atomically, so that only one worker fails.
+            os.close(os.open(self.marker_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return sinter.AnonTaskStats(shots=min(max_shots, 100), errors=1)
+        if self.hard_exit:
+            os._exit(1)
+        raise ValueError('fail once')
+
+
+@pytest.mark.parametrize('hard_exit,shared_memory_results', [(False, False), (True, False), (True, True)])
+def test_manager_recovers_from_worker_failure(tmp_path, hard_exit: bool, shared_memory_results: bool):
+    t0 = sinter.Task(
+        circuit=stim.Circuit('H 0'),
+        detector_error_model=stim.DetectorErrorModel(),
+        decoder='pymatching',
+        json_metadata={'a': 0},
+    )
+    log = []
+    manager = CollectionManager(
+        num_workers=2,
+        work_handler=_FailOnceWorkHandler(str(tmp_path / 'marker'), hard_exit),
+        worker_flush_period=0.1,
+        tasks=[t0],
+        progress_callback=log.append,
+        existing_data={},
+        collection_options=sinter.CollectionOptions(max_shots=3000),
+        shared_memory_results=shared_memory_results,
+    )
+    manager.start_workers()
+    manager.start_distributing_work()
+    manager.run_until_done()
+    assert manager.worker_restarts == 1
+    assert not manager.quarantined_tasks
+    assert sum(e.shots for e in log if e is not None) == 3000
+
+
+def test_manager_notices_worker_that_exited_while_busy(tmp_path):
+    t0 = sinter.Task(
+        circuit=stim.Circuit('H 0'),
+        detector_error_model=stim.DetectorErrorModel(),
+        decoder='pymatching',
+        json_metadata={'a': 0},
+    )
+    manager = CollectionManager(
+        num_workers=1,
+        work_handler=_FailOnceWorkHandler(str(tmp_path / 'marker'), False),
+        worker_flush_period=0.1,
+        tasks=[t0],
+        progress_callback=lambda _: None,
+        existing_data={},
+        collection_options=sinter.CollectionOptions(max_shots=3000),
+    )
+    manager.start_workers()
+    try:
+        manager.start_distributing_work()
+        # The worker exits before the manager next waits for something to happen.
+        process = manager.worker_states[0].process
+        process.kill()
+        process.join()
+        while manager.worker_states[0].process is process:
+            assert manager.process_message(timeout=10)
+        assert manager.worker_restarts == 1
+    finally:
+        manager.hard_stop()
+
+
+@pytest.mark.parametrize('hard_exit', [False, True])
+def test_manager_async_recovers_from_worker_failure(tmp_path, hard_exit: bool):
+    t0 = sinter.Task(
+        circuit=stim.Circuit('H 0'),
+        detector_error_model=stim.DetectorErrorModel(),
+        decoder='pymatching',
+        json_metadata={'a': 0},
+    )
+    log = []
+    manager = CollectionManager(
+        num_workers=2,
+        work_handler=_FailOnceWorkHandler(str(tmp_path / 'marker'), hard_exit),
+        worker_flush_period=0.1,
+        tasks=[t0],
+        progress_callback=log.append,
+        existing_data={},
+        collection_options=sinter.CollectionOptions(max_shots=3000),
+    )
+    manager.start_workers()
+    manager.start_distributing_work()
+    asyncio.run(manager.run_until_done_async(rebalance_period=0.05))
+    assert manager.worker_restarts == 1
+    assert sum(e.shots for e in log if e is not None) == 3000
+    assert manager.progress_callback == log.append
+    assert not manager.defer_rebalancing
+
+
+def test_manager_deferred_rebalancing():
+    tasks = []
+    for k in range(3):
+        task = sinter.Task(
+            circuit=stim.Circuit(f'H {k}'),
+            detector_error_model=stim.DetectorErrorModel(),
+            decoder='pymatching',
+            json_metadata={'k': k},
+            collection_options=sinter.CollectionOptions(max_shots=1000 * (k + 1)),
+        )
+        tasks.append(sinter.Task(
+            circuit=task.circuit,
+            detector_error_model=task.detector_error_model,
+            decoder=task.decoder,
+            json_metadata=task.json_metadata,
+            collection_options=task.collection_options,
+            skip_validation=True,
+            _unvalidated_strong_id=task.strong_id(),
+        ))
+    log = []
+    manager = CollectionManager(
+        num_workers=6,
+        work_handler=_FailOnceWorkHandler('unused', False),
+        worker_flush_period=0.05,
+        tasks=tasks,
+        progress_callback=log.append,
+        existing_data={},
+        collection_options=sinter.CollectionOptions(),
+    )
+    manager.start_workers(actually_start_worker_processes=False)
+    manager.start_distributing_work()
+
+    manager.defer_rebalancing = True
+    task_state = manager.task_states[tasks[0].strong_id()]
+    worker_id = next(iter(task_state.workers_assigned))
+    for w in task_state.workers_assigned:
+        manager.worker_states[w].assigned_shots = 0
+    task_state.shots_left = 0
+    manager._try_del_task(tasks[0].strong_id())
+    # The finished task's workers stay idle until the next rebalancing pass.
+    assert manager.rebalance_pending
+    assert manager.worker_states[worker_id].assigned_work_key is None
+    manager.rebalance()
+    assert not manager.rebalance_pending
+    assert manager.worker_states[worker_id].assigned_work_key is not None
+    manager.hard_stop()
+
+
+def test_forward_progress_merges_results_per_task():
+    a1 = sinter.TaskStats(strong_id='a', decoder='pymatching', json_metadata=None, shots=10, errors=1)
+    a2 = sinter.TaskStats(strong_id='a', decoder='pymatching', json_metadata=None, shots=20, errors=3)
+    b = sinter.TaskStats(strong_id='b', decoder='pymatching', json_metadata=None, shots=5)
+
+    log = []
+    _forward_progress([None, a1, b, None, a2], log.append)
+    assert log == [a1 + a2, b]
+
+    log = []
+    _forward_progress([None, None], log.append)
+    assert log == [None]
+
+    log = []
+    _forward_progress([], log.append)
+    assert log == []
@@ -0,0 +1,178 @@
+import collections
+import json
+import os
+import pathlib
+import time
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union, TYPE_CHECKING
+
+import sinter
+
+from yoked.gap._gap_stopping_rule import gap_key_bucket
+from yoked.gap._importance_sampling import WEIGHT_SCALE
+
+if TYPE_CHECKING:
+    from yoked.gap._collection_manager import CollectionManager
+
+
+class _TaskStatus:
+    def __init__(self, *, strong_id: str, json_metadata: Any, existing: sinter.AnonTaskStats):
+        self.strong_id = strong_id
+        self.json_metadata = json_metadata
+        self.total = existing
+        self.histogram: Dict[Tuple[int, bool], int] = collections.Counter()
+        self.weighted_histogram: Dict[Tuple[int, bool], int] = collections.Counter()
+        self.recent: Deque[Tuple[float, int]] = collections.deque()
+        self.cached_tail: Optional[List[List[int]]] = None
+        self.cached_weighted_tail: Optional[List[List[float]]] = None
+        self._add_counts(existing.custom_counts)
+
+    def _add_counts(self, custom_counts: Dict[str, int]) -> None:
+        for key, value in custom_counts.items():
+            # Importance sampling's likelihood-ratio weighted counts ('WC5', 'WE5').
+            histogram = self.histogram
+            if key.startswith('W'):
+                key = key[1:]
+                histogram = self.weighted_histogram
+            bucket = gap_key_bucket(key)
+            if bucket is not None:
+                histogram[bucket] += value
+
+    def record(self, stat: sinter.AnonTaskStats, now: float, window: float) -> None:
+        self.total += stat
+        self._add_counts(stat.custom_counts)
+        self.cached_tail = None
+        self.cached_weighted_tail = None
+        self.recent.append((now, stat.shots))
+        while self.recent and self.recent[0][0] < now - window:
+            self.recent.popleft()
+
+    def tail(self, num_buckets: int) -> List[List[int]]:
+        if self.cached_tail is None:
+            gaps = sorted({g for g, _ in self.histogram}, reverse=True)[:num_buckets]
+            self.cached_tail = [[g, self.histogram[(g, False)], self.histogram[(g, True)]] for g in gaps]
+        return self.cached_tail
+
+    def weighted_tail(self, num_buckets: int) -> List[List[float]]:
+        if self.cached_weighted_tail is None:
+            h = self.weighted_histogram
+            gaps = sorted({g for g, _ in h}, reverse=True)[:num_buckets]
+            self.cached_weighted_tail = [[g, h[(g, False)] / WEIGHT_SCALE, h[(g, True)] / WEIGHT_SCALE] for g in gaps]
+        return self.cached_weighted_tail
+
+
+class CollectionStatusWriter:
+    """Keeps a JSON file describing how a gap collection is going.
+
+    The file is meant to be polled by a dashboard (or `watch jq`), and is
+    replaced atomically so readers never see a partial write. It contains the
+    overall worker count and ETA, and for each task:
+
+        shots, errors, shots_left: Totals (including existing data).
+        workers: How many workers are assigned to the task.
+        shots_per_second: Throughput over the last `throughput_window`
+            seconds.
+        core_seconds_per_shot, eta_seconds: The manager's estimate of the cost
+            of a shot, and the time left given the task's current workers.
+        gap_tail: [gap, corrected, errored] for the largest gaps seen.
+        weighted_gap_tail: Only for importance sampled tasks, whose gap_tail
+            counts biased shots. The same buckets, but with each shot counted
+            by its likelihood ratio (see `importance_weighted_stats`), so
+            dividing by shots estimates the unbiased rates.
+
+    Writes are throttled to at most one per `min_period` seconds, and the
+    per-task histogram work is only redone for tasks that got new results,
+    so updating on every manager event is cheap.
+    """
+
+    def __init__(
+            self,
+            path: Union[str, pathlib.Path],
+            *,
+            min_period: float = 0.1,
+            tail_buckets: int = 8,
+            throughput_window: float = 60,
+    ):
+        self.path = pathlib.Path(path)
+        self.min_period = min_period
+        self.tail_buckets = tail_buckets
+        self.throughput_window = throughput_window
+        self.start_time = time.monotonic()
+        self.next_write_time = self.start_time
+        self.tasks: Dict[str, _TaskStatus] = {}
+
+    def add_tasks(self, manager: 'CollectionManager') -> None:
+        """Starts tracking the manager's tasks. Call after their strong ids are known."""
+        for k, strong_id in enumerate(manager.task_strong_ids):
+            existing = manager.existing_data.get(strong_id)
+            self.tasks[strong_id] = _TaskStatus(
+                strong_id=strong_id,
+                json_metadata=manager.partial_tasks[k].json_metadata,
+                existing=sinter.AnonTaskStats() if existing is None else existing.to_anon_stats(),
+            )
+
+    def record(self, stat: sinter.TaskStats) -> None:
+        task = self.tasks.get(stat.strong_id)
+        if task is not None:
+            task.record(stat.to_anon_stats(), now=time.monotonic(), window=self.throughput_window)
+
+    def status(self, manager: 'CollectionManager') -> Dict[str, Any]:
+        now = time.monotonic()
+        tasks = []
+        total_core_seconds_left = 0.0
+        for task in self.tasks.values():
+            task_state = manager.task_states.get(task.strong_id)
+            entry = {
+                'strong_id': task.strong_id,
+                'json_metadata': task.json_metadata,
+                'done': task_state is None,
+                'shots': task.total.shots,
+                'errors': task.total.errors,
+                'shots_left': 0,
+                'workers': 0,
+                'shots_per_second': 0,
+                'core_seconds_per_shot': None,
+                'eta_seconds': 0,
+                'gap_tail': task.tail(self.tail_buckets),
+            }
+            if task.weighted_histogram:
+                entry['weighted_gap_tail'] = task.weighted_tail(self.tail_buckets)
+            while task.recent and task.recent[0][0] < now - self.throughput_window:
+                task.recent.popleft()
+            if task.recent:
+                span = max(now - task.recent[0][0], min(now - self.start_time, self.throughput_window), 1e-9)
+                entry['shots_per_second'] = sum(shots for _, shots in task.recent) / span
+            if task_state is not None:
+                workers = len(task_state.workers_assigned)
+                seconds_per_shot = manager.estimated_seconds_per_shot(task_state)
+                core_seconds_left = task_state.shots_left * seconds_per_shot
+                total_core_seconds_left += core_seconds_left
+                entry['shots_left'] = task_state.shots_left
+                entry['workers'] = workers
+                entry['core_seconds_per_shot'] = seconds_per_shot
+                entry['eta_seconds'] = None if workers == 0 else core_seconds_left / workers
+            tasks.append(entry)
+
+        num_workers = sum(not w.disconnected for w in manager.worker_states)
+        return {
+            'time': time.time(),
+            'elapsed_seconds': now - self.start_time,
+            'workers': num_workers,
+            'tasks_left': sum(not e['done'] for e in tasks),
+            'eta_seconds': None if num_workers == 0 else total_core_seconds_left / num_workers,
+            'tasks': tasks,
+        }
+
+    def maybe_write(self, manager: 'CollectionManager', *, force: bool = False) -> bool:
+        """Rewrites the status file, unless it was rewritten too recently.
+
+        Returns:
+            Whether the file was written.
+        """
+        now = time.monotonic()
+        if not force and now < self.next_write_time:
+            return False
+        self.next_write_time = now + self.min_period
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        tmp_path.write_text(json.dumps(self.status(manager)))
+        os.replace(tmp_path, self.path)
+        return True
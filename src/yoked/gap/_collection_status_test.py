@@ -0,0 +1,105 @@
+import collections
+import json
+
+import sinter
+import stim
+
+from yoked.gap._collection_manager import CollectionManager
+from yoked.gap._collection_status import CollectionStatusWriter
+from yoked.gap._collection_work_handler import CollectionWorkHandler
+from yoked.gap._importance_sampling import WEIGHT_SCALE
+
+
+class _NoWorkHandler(CollectionWorkHandler):
+    def do_some_work(self, request: sinter.Task, max_shots: int) -> sinter.AnonTaskStats:
+        raise NotImplementedError()
+
+
+def test_collection_status_writer(tmp_path):
+    t0 = sinter.Task(
+        circuit=stim.Circuit('H 0'),
+        detector_error_model=stim.DetectorErrorModel(),
+        decoder='pymatching',
+        json_metadata={'a': 0},
+    )
+    t1 = sinter.Task(
+        circuit=stim.Circuit('H 1'),
+        detector_error_model=stim.DetectorErrorModel(),
+        decoder='pymatching',
+        json_metadata={'a': 1},
+    )
+    t0.strong_id()
+    t1.strong_id()
+    manager = CollectionManager(
+        num_workers=2,
+        work_handler=_NoWorkHandler(),
+        worker_flush_period=30,
+        tasks=[t0, t1],
+        progress_callback=lambda _: None,
+        existing_data={t1.strong_id(): sinter.TaskStats(
+            strong_id=t1.strong_id(),
+            decoder='pymatching',
+            json_metadata={'a': 1},
+            shots=1000,
+            errors=2,
+            custom_counts=collections.Counter({'C1': 998, 'E1': 2}),
+        )},
+        collection_options=sinter.CollectionOptions(max_shots=1000),
+    )
+    manager.start_workers(actually_start_worker_processes=False)
+    manager.start_distributing_work()
+
+    path = tmp_path / 'status.json'
+    writer = CollectionStatusWriter(path, min_period=1000, tail_buckets=2)
+    writer.add_tasks(manager)
+    writer.record(sinter.TaskStats(
+        strong_id=t0.strong_id(),
+        decoder='pymatching',
+        json_metadata={'a': 0},
+        shots=100,
+        errors=3,
+        seconds=1,
+        custom_counts=collections.Counter({'C0': 50, 'C2': 40, 'E5': 1, 'C7_9': 7, 'E0': 2}),
+    ))
+    manager.task_states[t0.strong_id()].shots_left = 900
+    manager.task_states[t0.strong_id()].measured_shots = 100
+    manager.task_states[t0.strong_id()].measured_seconds = 1
+    assert writer.maybe_write(manager)
+    assert not writer.maybe_write(manager)
+
+    status = json.loads(path.read_text())
+    assert status['workers'] == 2
+    assert status['tasks_left'] == 1
+    assert status['eta_seconds'] == 900 * 0.01 / 2
+    task0, task1 = status['tasks']
+    assert task0['strong_id'] == t0.strong_id()
+    assert task0['json_metadata'] == {'a': 0}
+    assert not task0['done']
+    assert task0['shots'] == 100
+    assert task0['errors'] == 3
+    assert task0['shots_left'] == 900
+    assert task0['workers'] == 2
+    assert task0['shots_per_second'] > 0
+    assert task0['core_seconds_per_shot'] == 0.01
+    assert task0['eta_seconds'] == 900 * 0.01 / 2
+    assert task0['gap_tail'] == [[7, 7, 0], [5, 0, 1]]
+    assert task1['done']
+    assert task1['shots'] == 1000
+    assert task1['gap_tail'] == [[1, 998, 2]]
+    assert 'weighted_gap_tail' not in task0
+
+    writer.record(sinter.TaskStats(
+        strong_id=t0.strong_id(),
+        decoder='pymatching',
+        json_metadata={'a': 0},
+        shots=10,
+        custom_counts=collections.Counter({'C7': 10, 'WC7': 3 * WEIGHT_SCALE, 'WE7': WEIGHT_SCALE // 4}),
+    ))
+    assert writer.maybe_write(manager, force=True)
+    task0 = json.loads(path.read_text())['tasks'][0]
+    assert task0['gap_tail'] == [[7, 17, 0], [5, 0, 1]]
+    assert task0['weighted_gap_tail'] == [[7, 3, 0.25]]
+
+    assert writer.maybe_write(manager, force=True)
+    assert not list(tmp_path.glob('*.tmp'))
+    manager.hard_stop()
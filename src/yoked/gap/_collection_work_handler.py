@@ -1,4 +1,5 @@
 import abc
+from typing import Any, Dict
 
 import sinter
 
@@ -7,3 +8,19 @@ class CollectionWorkHandler(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def do_some_work(self, task: sinter.Task, max_shots: int) -> sinter.AnonTaskStats:
         pass
+
+    def status(self) -> Dict[str, Any]:
+        """Returns details about how the work is going, to show in progress output.
+
+        Sent to the manager when a worker flushes its results, if it changed
+        since it was last sent. Defaults to nothing.
+        """
+        return {}
+
+    def take_metrics(self) -> Dict[str, float]:
+        """Returns and clears profiling metrics accumulated since the last call.
+
+        Sent to the manager each time a worker flushes its results, where they
+        are summed per task. Defaults to nothing.
+        """
+        return {}
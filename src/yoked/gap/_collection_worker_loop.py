@@ -4,6 +4,7 @@ from typing import Optional, TYPE_CHECKING
 
 from yoked.gap._collection_work_handler import CollectionWorkHandler
 from yoked.gap._collection_worker_state import CollectionWorkerState
+from yoked.gap._shared_gap_histograms import SharedGapHistograms
 
 if TYPE_CHECKING:
     import multiprocessing
@@ -14,7 +15,9 @@ def collection_worker_loop(flush_period: float,
                            work_handler: CollectionWorkHandler,
                            inp: 'multiprocessing.Queue',
                            out: 'multiprocessing.Queue',
-                           core_affinity: Optional[int]) -> None:
+                           core_affinity: Optional[int],
+                           shared_results: Optional[SharedGapHistograms] = None,
+                           dem_dir: Optional[str] = None) -> None:
     try:
         if core_affinity is not None and hasattr(os, 'sched_setaffinity'):
             os.sched_setaffinity(0, {core_affinity})
@@ -28,5 +31,11 @@ def collection_worker_loop(flush_period: float,
         work_handler=work_handler,
         inp=inp,
         out=out,
+        shared_results=shared_results,
+        dem_dir=dem_dir,
     )
-    worker.run_message_loop()
+    try:
+        worker.run_message_loop()
+    finally:
+        if shared_results is not None:
+            shared_results.close()
@@ -1,24 +1,49 @@
+import os
+import pathlib
 import queue
+import random
 import sys
 import time
-from typing import Optional, TYPE_CHECKING
+from typing import Any, Dict, Optional, TYPE_CHECKING, Union
 
 import sinter
 import stim
 
 from yoked.gap._collection_work_handler import CollectionWorkHandler
+from yoked.gap._memory_circuit_task import MemoryCircuitTask
+from yoked.gap._phase_timers import PhaseTimers
+from yoked.gap._shared_gap_histograms import SharedGapHistograms
 
 if TYPE_CHECKING:
     import multiprocessing
 
 
-def _fill_in_task(task: sinter.Task) -> sinter.Task:
+def _dem_cache_path(dem_dir: Union[str, pathlib.Path], strong_id: str) -> pathlib.Path:
+    return pathlib.Path(dem_dir) / f'{strong_id}.dem'
+
+
+def _fill_in_task(task: sinter.Task, *, dem_dir: Optional[Union[str, pathlib.Path]] = None) -> sinter.Task:
+    """Loads (or generates) the circuit and computes the detector error model, if missing.
+
+    If `dem_dir` is given and the task came with a precomputed strong id, the
+    detector error model is read from the file that the manager's strong id
+    pass saved there instead of being recomputed.
+    """
     changed = False
     circuit = task.circuit
     if circuit is None:
-        circuit = stim.Circuit.from_file(task.circuit_path)
+        if isinstance(task, MemoryCircuitTask):
+            circuit = task.params.make_circuit()
+        else:
+            circuit = stim.Circuit.from_file(task.circuit_path)
         changed = True
     dem = task.detector_error_model
+    known_strong_id = task._unvalidated_strong_id
+    if dem is None and dem_dir is not None and known_strong_id is not None:
+        dem_path = _dem_cache_path(dem_dir, known_strong_id)
+        if dem_path.exists():
+            dem = stim.DetectorErrorModel.from_file(dem_path)
+            changed = True
     if dem is None:
         dem = circuit.detector_error_model(decompose_errors=True, approximate_disjoint_errors=True)
         changed = True
@@ -32,10 +57,38 @@ def _fill_in_task(task: sinter.Task) -> sinter.Task:
         postselected_observables_mask=task.postselected_observables_mask,
         json_metadata=task.json_metadata,
         collection_options=task.collection_options,
+        skip_validation=known_strong_id is not None,
+        _unvalidated_strong_id=known_strong_id,
     )
 
 
+def compute_strong_id(task: sinter.Task, *, dem_dir: Optional[str], tmp_suffix: str = 'tmp') -> str:
+    """Computes a task's strong id, saving its detector error model into `dem_dir`.
+
+    Saving the model lets whoever samples the task later load it (see
+    `_fill_in_task`) instead of redoing the work.
+    """
+    filled_task = _fill_in_task(task)
+    strong_id = filled_task.strong_id()
+    if dem_dir is not None and task.detector_error_model is None:
+        dem_path = _dem_cache_path(dem_dir, strong_id)
+        tmp_path = dem_path.with_name(f'{dem_path.name}.{tmp_suffix}')
+        filled_task.detector_error_model.to_file(tmp_path)
+        os.replace(tmp_path, dem_path)
+    return strong_id
+
+
 class CollectionWorkerState:
+    """The state of a worker process, sampling shots for the task the manager assigned it.
+
+    To keep the number of messages down when there are many workers, the
+    worker only talks to the manager when there's something to report:
+    accepting shots or changing jobs isn't acknowledged, results from many
+    batches are combined into one flush per flush period (randomly stretched
+    by up to 25%, so workers that started together don't all flush at
+    once), and work handler status is only resent when it changes.
+    """
+
     def __init__(
             self,
             *,
@@ -43,36 +96,72 @@ class CollectionWorkerState:
             worker_id: int,
             work_handler: CollectionWorkHandler,
             inp: 'multiprocessing.Queue',
-            out: 'multiprocessing.Queue'
+            out: 'multiprocessing.Queue',
+            shared_results: Optional[SharedGapHistograms] = None,
+            dem_dir: Optional[str] = None,
     ):
         self.flush_period = flush_period
         self.inp = inp
         self.out = out
         self.work_handler = work_handler
         self.worker_id = worker_id
+        self.shared_results = shared_results
+        self.dem_dir = dem_dir
+        self.task_slots: Dict[str, int] = {}
+        self.timers = PhaseTimers()
 
         self.current_task: Optional[sinter.Task] = None
         self.current_task_shots_left: int = 0
         self.unflushed_results: sinter.AnonTaskStats = sinter.AnonTaskStats()
-        self.last_flush_message_time = time.monotonic()
+        self.last_sent_status: Optional[Dict[str, Any]] = None
+        self.next_flush_time = 0.0
+        self._schedule_next_flush()
+
+    def _schedule_next_flush(self):
+        self.next_flush_time = time.monotonic() + self.flush_period * (1 + random.random() / 4)
 
     def flush_results(self):
         if self.unflushed_results.shots > 0:
-            self.last_flush_message_time = time.monotonic()
-            self.out.put((
-                'flushed_results',
-                self.worker_id,
-                (self.current_task.strong_id(), self.unflushed_results),
-            ))
+            self._schedule_next_flush()
+            strong_id = self.current_task.strong_id()
+            slot = self.task_slots.get(strong_id)
+            if self.shared_results is not None and slot is not None:
+                overflow = self.shared_results.add(
+                    worker_id=self.worker_id,
+                    slot=slot,
+                    stats=self.unflushed_results,
+                )
+                self.out.put((
+                    'flushed_shared_results',
+                    self.worker_id,
+                    (strong_id, overflow),
+                ))
+            else:
+                self.out.put((
+                    'flushed_results',
+                    self.worker_id,
+                    (strong_id, self.unflushed_results),
+                ))
             self.unflushed_results = sinter.AnonTaskStats()
+            status = self.work_handler.status()
+            if status and status != self.last_sent_status:
+                self.last_sent_status = status
+                self.out.put((
+                    'worker_status',
+                    self.worker_id,
+                    (self.current_task.strong_id(), status),
+                ))
+            metrics = self.timers.take()
+            metrics.update(self.work_handler.take_metrics())
+            if metrics:
+                self.out.put((
+                    'worker_metrics',
+                    self.worker_id,
+                    (self.current_task.strong_id(), metrics),
+                ))
 
     def accept_shots(self, *, shots_delta: int):
         self.current_task_shots_left += shots_delta
-        self.out.put((
-            'accepted_shots',
-            self.worker_id,
-            (self.current_task.strong_id(), shots_delta),
-        ))
 
     def return_shots(self, *, requested_shots: int):
         returned_shots = min(requested_shots, self.current_task_shots_left)
@@ -84,7 +173,7 @@ class CollectionWorkerState:
         ))
 
     def compute_strong_id(self, *, new_task: sinter.Task):
-        strong_id = _fill_in_task(new_task).strong_id()
+        strong_id = compute_strong_id(new_task, dem_dir=self.dem_dir, tmp_suffix=f'{self.worker_id}.tmp')
         self.out.put((
             'computed_strong_id',
             self.worker_id,
@@ -94,16 +183,13 @@ class CollectionWorkerState:
     def change_job(self, *, new_task: sinter.Task, new_shots: int):
         self.flush_results()
 
-        self.current_task = _fill_in_task(new_task)
+        with self.timers.phase('load_task_files'):
+            self.current_task = _fill_in_task(new_task, dem_dir=self.dem_dir)
         assert self.current_task.strong_id() is not None
         self.current_task_shots_left = new_shots
-        self.last_flush_message_time = time.monotonic()
-
-        self.out.put((
-            'changed_job',
-            self.worker_id,
-            (self.current_task.strong_id(), self.current_task_shots_left),
-        ))
+        # The manager forgets a worker's status when reassigning it.
+        self.last_sent_status = None
+        self._schedule_next_flush()
 
     def process_messages(self) -> int:
         num_processed = 0
@@ -122,6 +208,10 @@ class CollectionWorkerState:
             elif message_type == 'flush_results':
                 self.flush_results()
 
+            elif message_type == 'set_task_slots':
+                assert isinstance(message_body, dict)
+                self.task_slots = message_body
+
             elif message_type == 'compute_strong_id':
                 assert isinstance(message_body, sinter.Task)
                 self.compute_strong_id(new_task=message_body)
@@ -158,7 +248,7 @@ class CollectionWorkerState:
             self.unflushed_results += some_work_done
             did_some_work = True
 
-        if self.unflushed_results.shots > 0 and (self.current_task_shots_left == 0 or self.last_flush_message_time + self.flush_period < time.monotonic()):
+        if self.unflushed_results.shots > 0 and (self.current_task_shots_left == 0 or self.next_flush_time < time.monotonic()):
             self.flush_results()
             did_some_work = True
 
@@ -175,7 +265,8 @@ class CollectionWorkerState:
                     time.sleep(0.01)
 
         except KeyboardInterrupt:
-            pass
+            # Keep what was sampled, so it doesn't need to be redone.
+            self.flush_results()
 
         except BaseException as ex:
             import traceback
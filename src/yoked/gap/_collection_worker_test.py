@@ -2,6 +2,7 @@ import collections
 import multiprocessing
 import time
 from typing import Any, List
+from unittest import mock
 
 import numpy as np
 import sinter
@@ -9,6 +10,7 @@ import stim
 
 from yoked.gap._collection_work_handler import CollectionWorkHandler
 from yoked.gap._collection_worker_state import CollectionWorkerState
+from yoked.gap._shared_gap_histograms import SharedGapHistograms
 
 
 class MockWorkHandler(CollectionWorkHandler):
@@ -64,7 +66,7 @@ def test_worker_stop():
 
     _put_wait_not_empty(inp, ('change_job', (t0, 0)))
     assert worker.process_messages() == 1
-    _assert_drain_queue(out, [('changed_job', 5, (t0.strong_id(), 0))])
+    _assert_drain_queue(out, [])
 
     _put_wait_not_empty(inp, ('stop', None))
     assert worker.process_messages() == -1
@@ -98,11 +100,12 @@ def test_worker_skip_work():
     )
     _put_wait_not_empty(inp, ('change_job', (t0, 0)))
     assert worker.process_messages() == 1
-    _assert_drain_queue(out, [('changed_job', 5, (t0.strong_id(), 0))])
+    _assert_drain_queue(out, [])
 
+    # Accepting shots isn't acknowledged.
     _put_wait_not_empty(inp, ('accept_shots', (t0.strong_id(), 10000)))
     assert worker.process_messages() == 1
-    _assert_drain_queue(out, [('accepted_shots', 5, (t0.strong_id(), 10000))])
+    _assert_drain_queue(out, [])
 
     assert worker.current_task == t0
     assert worker.current_task_shots_left == 10000
@@ -152,7 +155,7 @@ def test_worker_finish_work():
     )
     _put_wait_not_empty(inp, ('change_job', (ta, 10000)))
     assert worker.process_messages() == 1
-    _assert_drain_queue(out, [('changed_job', 5, (ta.strong_id(), 10000))])
+    _assert_drain_queue(out, [])
 
     assert worker.current_task == ta
     assert worker.current_task_shots_left == 10000
@@ -171,7 +174,10 @@ def test_worker_finish_work():
     ))
     assert worker.do_some_work()
     _assert_drain_queue(out, [
-        ('flushed_results', 5, (ta.strong_id(), sinter.AnonTaskStats(shots=1000, errors=23, discards=0, seconds=1)))])
+        ('flushed_results', 5, (ta.strong_id(), sinter.AnonTaskStats(shots=1000, errors=23, discards=0, seconds=1))),
+        # The time spent loading the task's files.
+        ('worker_metrics', 5, (ta.strong_id(), {'load_task_files_seconds': mock.ANY})),
+    ])
 
     handler.expected.append((
         ta,
@@ -195,3 +201,222 @@ def test_worker_finish_work():
     ])
     assert not worker.do_some_work()
     _assert_drain_queue(out, [])
+
+
+def test_worker_flush_to_shared_memory():
+    handler = MockWorkHandler()
+
+    inp = multiprocessing.Queue()
+    out = multiprocessing.Queue()
+    inp.cancel_join_thread()
+    out.cancel_join_thread()
+    shared = SharedGapHistograms.create(num_workers=6, num_task_slots=2, max_abs_gap=10)
+
+    try:
+        worker = CollectionWorkerState(
+            flush_period=-1,
+            worker_id=5,
+            work_handler=handler,
+            inp=inp,
+            out=out,
+            shared_results=shared,
+        )
+
+        ta = sinter.Task(
+            circuit=stim.Circuit('H 0'),
+            detector_error_model=stim.DetectorErrorModel(),
+            decoder='fusion_blossom',
+            collection_options=sinter.CollectionOptions(max_shots=100_000_000),
+            json_metadata={'a': 3},
+        )
+        _put_wait_not_empty(inp, ('set_task_slots', {ta.strong_id(): 1}))
+        assert worker.process_messages() == 1
+        _assert_drain_queue(out, [])
+
+        _put_wait_not_empty(inp, ('change_job', (ta, 1000)))
+        assert worker.process_messages() == 1
+        _assert_drain_queue(out, [])
+
+        handler.expected.append((
+            ta,
+            1000,
+            sinter.AnonTaskStats(
+                shots=1000,
+                errors=23,
+                seconds=1,
+                custom_counts=collections.Counter({'C3': 977, 'E2': 22, 'E50': 1}),
+            ),
+        ))
+        assert worker.do_some_work()
+        _assert_drain_queue(out, [
+            ('flushed_shared_results', 5, (ta.strong_id(), collections.Counter({'E50': 1}))),
+            ('worker_metrics', 5, (ta.strong_id(), {'load_task_files_seconds': mock.ANY})),
+        ])
+        assert shared.take_delta(worker_id=5, slot=1) == sinter.AnonTaskStats(
+            shots=1000,
+            errors=23,
+            seconds=1,
+            custom_counts=collections.Counter({'C3': 977, 'E2': 22}),
+        )
+    finally:
+        shared.unlink()
+
+
+def test_worker_reuses_dem_computed_for_strong_id(tmp_path):
+    handler = MockWorkHandler()
+
+    inp = multiprocessing.Queue()
+    out = multiprocessing.Queue()
+    inp.cancel_join_thread()
+    out.cancel_join_thread()
+
+    worker = CollectionWorkerState(
+        flush_period=-1,
+        worker_id=5,
+        work_handler=handler,
+        inp=inp,
+        out=out,
+        dem_dir=str(tmp_path),
+    )
+
+    circuit = stim.Circuit('''
+        X_ERROR(0.125) 0
+        M 0
+        DETECTOR rec[-1]
+    ''')
+    circuit_path = tmp_path / 'circuit.stim'
+    circuit.to_file(circuit_path)
+    task = sinter.Task(circuit_path=circuit_path, decoder='pymatching')
+    expected_strong_id = sinter.Task(
+        circuit=circuit,
+        decoder='pymatching',
+        detector_error_model=circuit.detector_error_model(decompose_errors=True, approximate_disjoint_errors=True),
+    ).strong_id()
+
+    _put_wait_not_empty(inp, ('compute_strong_id', task))
+    assert worker.process_messages() == 1
+    _assert_drain_queue(out, [('computed_strong_id', 5, expected_strong_id)])
+    assert (tmp_path / f'{expected_strong_id}.dem').exists()
+
+    # Tamper with the saved model to check that it's what gets loaded.
+    stim.DetectorErrorModel('error(0.25) D0').to_file(tmp_path / f'{expected_strong_id}.dem')
+    known_task = sinter.Task(
+        circuit_path=circuit_path,
+        decoder='pymatching',
+        skip_validation=True,
+        _unvalidated_strong_id=expected_strong_id,
+    )
+    _put_wait_not_empty(inp, ('change_job', (known_task, 0)))
+    assert worker.process_messages() == 1
+    _assert_drain_queue(out, [])
+    assert worker.current_task.detector_error_model == stim.DetectorErrorModel('error(0.25) D0')
+    assert worker.current_task.circuit == circuit
+
+
+class _StatusWorkHandler(MockWorkHandler):
+    def __init__(self):
+        super().__init__()
+        self.current_status = {'batch_shots': 100}
+
+    def status(self):
+        return dict(self.current_status)
+
+
+def test_worker_only_sends_changed_status():
+    handler = _StatusWorkHandler()
+
+    inp = multiprocessing.Queue()
+    out = multiprocessing.Queue()
+    inp.cancel_join_thread()
+    out.cancel_join_thread()
+
+    worker = CollectionWorkerState(
+        flush_period=-1,
+        worker_id=5,
+        work_handler=handler,
+        inp=inp,
+        out=out,
+    )
+    ta = sinter.Task(
+        circuit=stim.Circuit('H 0'),
+        detector_error_model=stim.DetectorErrorModel(),
+        decoder='fusion_blossom',
+        collection_options=sinter.CollectionOptions(max_shots=100_000_000),
+        json_metadata={'a': 3},
+    )
+    worker.change_job(new_task=ta, new_shots=300)
+    worker.timers.take()
+    result = sinter.AnonTaskStats(shots=100, errors=1, seconds=1)
+
+    handler.expected.append((ta, 300, result))
+    assert worker.do_some_work()
+    _assert_drain_queue(out, [
+        ('flushed_results', 5, (ta.strong_id(), result)),
+        ('worker_status', 5, (ta.strong_id(), {'batch_shots': 100})),
+    ])
+
+    handler.expected.append((ta, 200, result))
+    assert worker.do_some_work()
+    _assert_drain_queue(out, [
+        ('flushed_results', 5, (ta.strong_id(), result)),
+    ])
+
+    handler.current_status['batch_shots'] = 200
+    handler.expected.append((ta, 100, result))
+    assert worker.do_some_work()
+    _assert_drain_queue(out, [
+        ('flushed_results', 5, (ta.strong_id(), result)),
+        ('worker_status', 5, (ta.strong_id(), {'batch_shots': 200})),
+    ])
+
+    # The manager forgets the status of reassigned workers, so it's resent.
+    worker.change_job(new_task=ta, new_shots=100)
+    worker.timers.take()
+    handler.expected.append((ta, 100, result))
+    assert worker.do_some_work()
+    _assert_drain_queue(out, [
+        ('flushed_results', 5, (ta.strong_id(), result)),
+        ('worker_status', 5, (ta.strong_id(), {'batch_shots': 200})),
+    ])
+
+
+def test_worker_coalesces_results_between_flushes():
+    handler = MockWorkHandler()
+
+    inp = multiprocessing.Queue()
+    out = multiprocessing.Queue()
+    inp.cancel_join_thread()
+    out.cancel_join_thread()
+
+    worker = CollectionWorkerState(
+        flush_period=1000,
+        worker_id=5,
+        work_handler=handler,
+        inp=inp,
+        out=out,
+    )
+    ta = sinter.Task(
+        circuit=stim.Circuit('H 0'),
+        detector_error_model=stim.DetectorErrorModel(),
+        decoder='fusion_blossom',
+        collection_options=sinter.CollectionOptions(max_shots=100_000_000),
+        json_metadata={'a': 3},
+    )
+    worker.change_job(new_task=ta, new_shots=300)
+    worker.timers.take()
+    # Flushes are spread out so that workers don't flush in lockstep.
+    assert 999 < worker.next_flush_time - time.monotonic() <= 1250
+
+    result = sinter.AnonTaskStats(shots=100, errors=1, seconds=1)
+    handler.expected.append((ta, 300, result))
+    handler.expected.append((ta, 200, result))
+    assert worker.do_some_work()
+    assert worker.do_some_work()
+    _assert_drain_queue(out, [])
+
+    # Finishing the assigned shots flushes immediately.
+    handler.expected.append((ta, 100, result))
+    assert worker.do_some_work()
+    _assert_drain_queue(out, [
+        ('flushed_results', 5, (ta.strong_id(), sinter.AnonTaskStats(shots=300, errors=3, seconds=3))),
+    ])
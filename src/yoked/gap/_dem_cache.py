@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import pathlib
+from typing import Iterable, Optional, Union
+
+import sinter
+import stim
+
+
+class DemCache:
+    """An on-disk cache of detector error models and strong ids for circuit files.
+
+    Layout:
+        dems/<strong_id>.dem: The decomposed detector error model of a task.
+            This is also the `dem_dir` layout that collection workers read
+            from, so the directory can be handed to them directly.
+        strong_ids/<key>.txt: The strong id of a task, where the key hashes
+            the circuit file's contents together with everything else that
+            goes into the strong id (decoder, metadata, postselection, and the
+            stim version that derives the detector error model).
+
+    Entries are evicted least-recently-used first (by file mtime, which is
+    refreshed on each hit) once the cache holds more than `max_bytes`.
+    """
+
+    def __init__(self, directory: Union[str, pathlib.Path], *, max_bytes: int = 2**32):
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        self.dem_dir = self.directory / 'dems'
+        self.strong_id_dir = self.directory / 'strong_ids'
+        self.dem_dir.mkdir(parents=True, exist_ok=True)
+        self.strong_id_dir.mkdir(parents=True, exist_ok=True)
+
+    def _strong_id_path(self, task: sinter.Task) -> pathlib.Path:
+        h = hashlib.sha256()
+        with open(task.circuit_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                h.update(chunk)
+        h.update(json.dumps({
+            'decoder': task.decoder,
+            'json_metadata': task.json_metadata,
+            'postselection_mask': None if task.postselection_mask is None else [int(e) for e in task.postselection_mask],
+            'postselected_observables_mask': None if task.postselected_observables_mask is None else [int(e) for e in task.postselected_observables_mask],
+            'stim_version': stim.__version__,
+        }, sort_keys=True).encode('utf8'))
+        return self.strong_id_dir / f'{h.hexdigest()}.txt'
+
+    def dem_path(self, strong_id: str) -> pathlib.Path:
+        return self.dem_dir / f'{strong_id}.dem'
+
+    def lookup_strong_id(self, task: sinter.Task) -> Optional[str]:
+        """Returns the cached strong id of a task given by circuit path.
+
+        Only returns a strong id when the task's detector error model is also
+        cached, so the caller can skip computing both.
+        """
+        if task.circuit_path is None or task.circuit is not None or task.detector_error_model is not None:
+            return None
+        id_path = self._strong_id_path(task)
+        if not id_path.exists():
+            return None
+        strong_id = id_path.read_text().strip()
+        dem_path = self.dem_path(strong_id)
+        if not dem_path.exists():
+            return None
+        os.utime(id_path)
+        os.utime(dem_path)
+        return strong_id
+
+    def with_cached_strong_id(self, task: sinter.Task) -> sinter.Task:
+        """Returns a task that skips strong id computation, if the cache allows it."""
+        strong_id = self.lookup_strong_id(task)
+        if strong_id is None:
+            return task
+        return sinter.Task(
+            circuit_path=task.circuit_path,
+            decoder=task.decoder,
+            postselection_mask=task.postselection_mask,
+            postselected_observables_mask=task.postselected_observables_mask,
+            json_metadata=task.json_metadata,
+            collection_options=task.collection_options,
+            skip_validation=True,
+            _unvalidated_strong_id=strong_id,
+        )
+
+    def record_strong_id(self, task: sinter.Task, strong_id: str) -> None:
+        """Remembers the strong id of a task given by circuit path.
+
+        The task's detector error model is expected to be written into
+        `dem_dir` separately (e.g. by the worker that computed the strong id).
+        """
+        if task.circuit_path is None or task.circuit is not None or task.detector_error_model is not None:
+            return
+        id_path = self._strong_id_path(task)
+        tmp_path = id_path.with_name(id_path.name + '.tmp')
+        tmp_path.write_text(strong_id)
+        os.replace(tmp_path, id_path)
+
+    def evict(self, *, keep: Iterable[str] = ()) -> None:
+        """Deletes least recently used entries until the cache fits in its budget.
+
+        Args:
+            keep: Strong ids whose detector error models must not be deleted
+                (e.g. because workers are about to read them). They still
+                count towards the budget.
+        """
+        kept_paths = {os.fspath(self.dem_path(strong_id)) for strong_id in keep}
+        entries = []
+        for d in [self.dem_dir, self.strong_id_dir]:
+            for entry in os.scandir(d):
+                if entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path in kept_paths:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
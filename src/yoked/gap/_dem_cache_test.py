@@ -0,0 +1,56 @@
+import os
+
+import sinter
+import stim
+
+from yoked.gap._dem_cache import DemCache
+
+
+def test_dem_cache_round_trip(tmp_path):
+    cache = DemCache(tmp_path / 'cache')
+    circuit_path = tmp_path / 'circuit.stim'
+    stim.Circuit('X_ERROR(0.125) 0\nM 0\nDETECTOR rec[-1]').to_file(circuit_path)
+    task = sinter.Task(circuit_path=circuit_path, decoder='pymatching', json_metadata={'a': 1})
+
+    assert cache.lookup_strong_id(task) is None
+    assert cache.with_cached_strong_id(task) is task
+
+    cache.record_strong_id(task, 'abc')
+    # The detector error model hasn't been saved yet.
+    assert cache.lookup_strong_id(task) is None
+    stim.DetectorErrorModel('error(0.125) D0').to_file(cache.dem_path('abc'))
+    assert cache.lookup_strong_id(task) == 'abc'
+    cached_task = cache.with_cached_strong_id(task)
+    assert cached_task.strong_id() == 'abc'
+    assert cached_task.circuit_path == circuit_path
+    assert cached_task.json_metadata == {'a': 1}
+
+    other_metadata = sinter.Task(circuit_path=circuit_path, decoder='pymatching', json_metadata={'a': 2})
+    assert cache.lookup_strong_id(other_metadata) is None
+
+    stim.Circuit('X_ERROR(0.25) 0\nM 0\nDETECTOR rec[-1]').to_file(circuit_path)
+    assert cache.lookup_strong_id(task) is None
+
+
+def test_dem_cache_evicts_least_recently_used(tmp_path):
+    cache = DemCache(tmp_path, max_bytes=150)
+    for k, name in enumerate(['a', 'b', 'c']):
+        path = cache.dem_path(name)
+        path.write_text('x' * 60)
+        os.utime(path, (k, k))
+    cache.evict()
+    assert not cache.dem_path('a').exists()
+    assert cache.dem_path('b').exists()
+    assert cache.dem_path('c').exists()
+
+
+def test_dem_cache_evict_keeps_given_strong_ids(tmp_path):
+    cache = DemCache(tmp_path, max_bytes=150)
+    for k, name in enumerate(['a', 'b', 'c']):
+        path = cache.dem_path(name)
+        path.write_text('x' * 60)
+        os.utime(path, (k, k))
+    cache.evict(keep=['a'])
+    assert cache.dem_path('a').exists()
+    assert not cache.dem_path('b').exists()
+    assert cache.dem_path('c').exists()
@@ -0,0 +1,156 @@
+import collections
+from typing import Tuple
+
+import numpy as np
+import sinter
+
+from yoked.gap._gap_stopping_rule import gap_key_bucket
+from yoked.gap._importance_sampling import importance_weighted_stats, WEIGHT_SCALE
+
+
+def unsigned_gap_distribution(stat: sinter.TaskStats) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Gets the probability of each unsigned gap, split by whether the shot was a logical error.
+
+    Gaps are folded like `with_unsigned_gap(invert_success_if_negative=True)`:
+    a correct shot with a negative gap counts as an error (the other parity
+    class was more likely), and correct shots with a gap of 0 count as half
+    correct and half error.
+
+    Returns:
+        A (gaps, p_correct, p_error) tuple of arrays, with gaps sorted in
+        increasing order. The probabilities are relative to the non-discarded
+        shots, so they sum to 1.
+    """
+    correct = collections.Counter()
+    errors = collections.Counter()
+    for key, value in stat.custom_counts.items():
+        bucket = gap_key_bucket(key)
+        if bucket is None:
+            continue
+        gap, is_error = bucket
+        if gap == 0 and not is_error:
+            correct[0] += value / 2
+            errors[0] += value / 2
+        elif is_error or gap < 0:
+            errors[abs(gap)] += value
+        else:
+            correct[gap] += value
+    gaps = np.array(sorted(correct.keys() | errors.keys()), dtype=np.int64)
+    p_correct = np.array([correct[g] for g in gaps.tolist()], dtype=np.float64)
+    p_error = np.array([errors[g] for g in gaps.tolist()], dtype=np.float64)
+    total = np.sum(p_correct) + np.sum(p_error)
+    if total > 0:
+        p_correct /= total
+        p_error /= total
+    return gaps, p_correct, p_error
+
+
+def _parity_product(a: Tuple[np.ndarray, np.ndarray], b: Tuple[np.ndarray, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Combines (even, odd) probabilities of two independent events."""
+    return a[0] * b[0] + a[1] * b[1], a[0] * b[1] + a[1] * b[0]
+
+
+class _Composition:
+    """Per-gap (correct, error) probabilities that the smallest gap is at, or is above, each gap."""
+
+    def __init__(self, *, at: Tuple[np.ndarray, np.ndarray], above: Tuple[np.ndarray, np.ndarray]):
+        self.at = at
+        self.above = above
+
+    def then(self, other: '_Composition') -> '_Composition':
+        at_at = _parity_product(self.at, other.at)
+        at_above = _parity_product(self.at, other.above)
+        above_at = _parity_product(self.above, other.at)
+        return _Composition(
+            at=(at_at[0] + at_above[0] + above_at[0], at_at[1] + at_above[1] + above_at[1]),
+            above=_parity_product(self.above, other.above),
+        )
+
+
+def compose_gap_blocks(stat: sinter.TaskStats, *, blocks: int) -> sinter.TaskStats:
+    """Estimates the gap statistics of a circuit that repeats a sampled block of rounds.
+
+    Each block is treated as independent. A composed shot's gap is the
+    smallest gap of its blocks (the cheapest way to change the decoding),
+    and it's a logical error when an odd number of its blocks were. So if
+    A(g) and B(g) are the probabilities that a block has a gap of at least g
+    and is correct or an error respectively, the composed probabilities are
+
+        P(gap >= g, correct) = ((A + B)**blocks + (A - B)**blocks) / 2
+        P(gap >= g, error) = ((A + B)**blocks - (A - B)**blocks) / 2
+
+    which generalizes raising the block's cumulative distribution to a power
+    (as done by `tools/plot_gap_cumulative_distribution`) to also track
+    logical errors. This lets e.g. 1000d rounds be estimated from samples of
+    a 10d round circuit. (The computation is arranged differently, so that
+    tiny tail probabilities aren't lost to cancellation.)
+
+    Args:
+        stat: Gap statistics of one block. Importance sampled stats are
+            reweighted first (see `importance_weighted_stats`).
+        blocks: The number of times the block is repeated.
+
+    Returns:
+        Synthetic stats for the repeated block. Their strong id is the block's
+        strong id with a 'composed_r{blocks}_' prefix (the marker that
+        `tools/plot_extrapolations` uses to recognize gap sampled results),
+        their metadata has 'r' multiplied by `blocks` and a 'blocks' entry,
+        and their custom counts have unsigned gaps. Probabilities are stored
+        as integers in units of 1/WEIGHT_SCALE shots, so `shots` is the
+        block's shot count times WEIGHT_SCALE and binomial confidence
+        intervals computed from the result are not meaningful.
+    """
+    if blocks < 1:
+        raise ValueError(f'{blocks=} < 1')
+    if stat.strong_id.startswith('composed_'):
+        raise ValueError(f'Already composed: {stat.strong_id=}')
+    weighted = importance_weighted_stats(stat)
+    shots = weighted.shots if weighted is not stat else stat.shots * WEIGHT_SCALE
+    stat = weighted
+    gaps, p_correct, p_error = unsigned_gap_distribution(stat)
+
+    # For each gap g, track (by logical error parity) the probability that
+    # the smallest gap so far is exactly g, and that every gap so far is
+    # above g. Everything is a sum of products of probabilities, avoiding the
+    # catastrophic cancellation of subtracting survival functions.
+    above_correct = np.append(np.cumsum(p_correct[::-1])[::-1][1:], 0)
+    above_error = np.append(np.cumsum(p_error[::-1])[::-1][1:], 0)
+    # Combine blocks by repeated squaring.
+    power = _Composition(at=(p_correct, p_error), above=(above_correct, above_error))
+    result = None
+    remaining = blocks
+    while True:
+        if remaining & 1:
+            result = power if result is None else result.then(power)
+        remaining >>= 1
+        if not remaining:
+            break
+        power = power.then(power)
+    composed_correct, composed_error = result.at
+
+    keep_fraction = 1 - stat.discards / stat.shots if stat.shots else 1
+    kept_shots = shots * keep_fraction ** blocks
+    custom_counts = collections.Counter()
+    for g, c, e in zip(gaps.tolist(), composed_correct.tolist(), composed_error.tolist()):
+        if round(c * kept_shots):
+            custom_counts[f'C{g}'] = round(c * kept_shots)
+        if round(e * kept_shots):
+            custom_counts[f'E{g}'] = round(e * kept_shots)
+
+    json_metadata = stat.json_metadata
+    if isinstance(json_metadata, dict):
+        json_metadata = dict(json_metadata)
+        if isinstance(json_metadata.get('r'), int):
+            json_metadata['r'] *= blocks
+        json_metadata['blocks'] = blocks
+
+    return sinter.TaskStats(
+        strong_id=f'composed_r{blocks}_{stat.strong_id}',
+        decoder=stat.decoder,
+        json_metadata=json_metadata,
+        shots=shots,
+        errors=sum(v for k, v in custom_counts.items() if k[0] == 'E'),
+        discards=shots - round(kept_shots),
+        seconds=stat.seconds,
+        custom_counts=custom_counts,
+    )
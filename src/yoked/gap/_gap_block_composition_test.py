@@ -0,0 +1,98 @@
+import collections
+import itertools
+
+import pytest
+import sinter
+
+from yoked.gap._gap_block_composition import compose_gap_blocks, unsigned_gap_distribution
+from yoked.gap._importance_sampling import WEIGHT_SCALE
+
+
+def _stat(custom_counts: dict, **kwargs) -> sinter.TaskStats:
+    return sinter.TaskStats(
+        strong_id='abc',
+        decoder='pymatching',
+        json_metadata={'d': 3, 'r': 30},
+        shots=sum(custom_counts.values()),
+        errors=sum(v for k, v in custom_counts.items() if k[0] == 'E'),
+        custom_counts=collections.Counter(custom_counts),
+        **kwargs,
+    )
+
+
+def test_unsigned_gap_distribution():
+    gaps, p_correct, p_error = unsigned_gap_distribution(_stat({
+        'C5': 4,
+        'C-5': 1,
+        'E-2': 1,
+        'C0': 2,
+        'E0': 1,
+        'E1': 1,
+    }))
+    assert gaps.tolist() == [0, 1, 2, 5]
+    assert p_correct.tolist() == [0.1, 0, 0, 0.4]
+    assert p_error.tolist() == [0.2, 0.1, 0.1, 0.1]
+
+
+def test_compose_gap_blocks_matches_enumeration():
+    counts = {'C1': 2, 'E1': 1, 'C3': 5, 'E4': 2}
+    stat = _stat(counts, seconds=2)
+    n = sum(counts.values())
+    outcomes = [(int(k[1:]), k[0] == 'E', v / n) for k, v in counts.items()]
+
+    for blocks in [1, 2, 3]:
+        expected = collections.Counter()
+        for combo in itertools.product(outcomes, repeat=blocks):
+            gap = min(g for g, _, _ in combo)
+            error = sum(e for _, e, _ in combo) % 2 == 1
+            p = 1
+            for _, _, q in combo:
+                p *= q
+            expected[f'{"CE"[error]}{gap}'] += p
+
+        composed = compose_gap_blocks(stat, blocks=blocks)
+        assert composed.strong_id == f'composed_r{blocks}_abc'
+        assert composed.json_metadata == {'d': 3, 'r': 30 * blocks, 'blocks': blocks}
+        assert composed.shots == n * WEIGHT_SCALE
+        assert composed.seconds == 2
+        assert composed.custom_counts.keys() == {k for k, v in expected.items() if v > 1e-12}
+        for k, v in composed.custom_counts.items():
+            assert v / composed.shots == pytest.approx(expected[k])
+        assert composed.errors / composed.shots == pytest.approx(sum(v for k, v in expected.items() if k[0] == 'E'))
+
+
+def test_compose_gap_blocks_discards_and_weights():
+    stat = _stat({'C4': 6, 'E2': 2}, discards=2)
+    stat = sinter.TaskStats(
+        strong_id=stat.strong_id,
+        decoder=stat.decoder,
+        json_metadata=stat.json_metadata,
+        shots=10,
+        errors=2,
+        discards=2,
+        custom_counts=stat.custom_counts,
+    )
+    composed = compose_gap_blocks(stat, blocks=2)
+    assert composed.shots == 10 * WEIGHT_SCALE
+    assert composed.discards / composed.shots == pytest.approx(1 - 0.8**2)
+    assert composed.custom_counts['C2'] / composed.shots == pytest.approx(0.64 * 0.25**2)
+    assert composed.custom_counts['E2'] / composed.shots == pytest.approx(0.64 * 2 * 0.75 * 0.25)
+
+    # Importance sampled stats are composed using their weighted counts.
+    weighted = _stat({'C4': 1, 'E2': 1, 'WC4': WEIGHT_SCALE * 3 // 2, 'WE2': WEIGHT_SCALE // 2})
+    composed = compose_gap_blocks(weighted, blocks=2)
+    assert composed.shots == weighted.shots * WEIGHT_SCALE
+    assert composed.custom_counts['C4'] / composed.shots == pytest.approx(0.75**2)
+
+    with pytest.raises(ValueError):
+        compose_gap_blocks(stat, blocks=0)
+    with pytest.raises(ValueError):
+        compose_gap_blocks(composed, blocks=2)
+
+
+def test_compose_gap_blocks_keeps_tiny_tails():
+    composed = compose_gap_blocks(_stat({'C10': 10**15, 'E20': 1, 'E3': 10**5}), blocks=3)
+    n = 10**15 + 10**5 + 1
+    # Only reachable when every block has the rare error.
+    assert composed.custom_counts['E20'] / composed.shots == pytest.approx(n**-3)
+    assert composed.custom_counts['C10'] / composed.shots == pytest.approx((10**15 / n)**3 + 3 * (10**15 / n) * n**-2)
@@ -1,85 +1,261 @@
-from typing import Any, TextIO, Dict, List, Optional
+import json
+import sys
+import time
+from typing import Any, TextIO, Dict, List, Optional, Union
 
 import sinter
 from sinter._printer import ThrottledProgressPrinter
 
 from yoked.gap._collection_manager import CollectionManager
+from yoked.gap._collection_status import CollectionStatusWriter
+from yoked.gap._dem_cache import DemCache
+from yoked.gap._gap_stats_store import GapStatsStore
+from yoked.gap._gap_stopping_rule import GapStoppingRule
+from yoked.gap._importance_sampling import ImportanceGapWorkHandler
+from yoked.gap._memory_circuit_task import MemoryCircuitTask
+from yoked.gap._remote_collection_workers import Address
 from yoked.gap._gap_worker_handler import GapWorkHandler
+from yoked.gap._multi_gap_worker_handler import MultiGapWorkHandler
+
+
+def _phase_breakdown(metrics: Dict[str, float]) -> str:
+    """Summarizes where time went, e.g. 'decode_first:45%,decode_flipped:44%,sample:9%'."""
+    phases = {k[:-len('_seconds')]: v for k, v in metrics.items() if k.endswith('_seconds')}
+    total = sum(phases.values())
+    if total <= 0:
+        return '?'
+    percents = [(k, round(100 * v / total)) for k, v in sorted(phases.items(), key=lambda e: -e[1])]
+    return ','.join(f'{k}:{p}%' for k, p in percents if p > 0)
+
+
+def sampling_metadata(base: Dict[str, Any], *, multi_yoke: bool, importance_bias: Optional[float]) -> Dict[str, Any]:
+    """Adds how a task is sampled to its metadata.
+
+    Multi-yoke and importance sampled stats aren't interchangeable with plain
+    gap stats, so they need their own strong ids.
+    """
+    if multi_yoke:
+        base = {**base, 'multi_yoke': True}
+    if importance_bias is not None:
+        base = {**base, 'importance_bias': importance_bias}
+    return base
+
+
+def _params_dict_to_task(params: Dict[str, Any], *, multi_yoke: bool, importance_bias: Optional[float] = None) -> MemoryCircuitTask:
+    """Converts memory circuit parameters into a task, marking its metadata with how it's sampled."""
+    task = MemoryCircuitTask.from_params_dict(params)
+    metadata = sampling_metadata(task.json_metadata, multi_yoke=multi_yoke, importance_bias=importance_bias)
+    if metadata == task.json_metadata:
+        return task
+    return MemoryCircuitTask(params=task.params, json_metadata=metadata)
 
 
 def collect_gap_stats(
         *,
         num_workers: int,
-        tasks: List[sinter.Task],
+        tasks: List[Union[sinter.Task, Dict[str, Any]]],
         existing_data: Dict[Any, sinter.TaskStats],
         worker_flush_period: float,
         num_shots: int,
         out: TextIO,
         print_progress: bool,
         print_header: bool,
+        multi_yoke: bool = False,
+        max_parity_classes: int = 16,
+        batch_seconds: float = 1,
+        max_batch_bytes: int = 2**28,
+        shared_memory_results: bool = False,
+        dem_cache: Optional[DemCache] = None,
+        stopping_rule: Optional[GapStoppingRule] = None,
+        listen_address: Optional[Address] = None,
+        authkey: Optional[bytes] = None,
+        store: Optional[GapStatsStore] = None,
+        metrics_out: Optional[TextIO] = None,
+        show_metrics: bool = False,
+        status_path: Optional[str] = None,
+        importance_bias: Optional[float] = None,
 ) -> None:
+    """Collects gap statistics for the given tasks, printing them as CSV rows to `out`.
+
+    Args:
+        tasks: The tasks to sample. Dictionaries are memory circuit parameters
+            (see `MemoryCircuitTask.from_params_dict`), whose circuits are
+            generated by the workers instead of being read from files. Their
+            metadata gets 'multi_yoke' and 'importance_bias' entries when
+            those arguments are set (see `sampling_metadata`).
+        multi_yoke: Record a gap for each parity class of the yokes (see
+            `MultiGapWorkHandler`) instead of a single gap. The tasks'
+            metadata should say so, so their strong ids differ from single
+            yoke tasks.
+        metrics_out: Optional. Where to write the profiling metrics reported by
+            workers (time per phase, shots, bytes sampled, decode calls, etc),
+            as one JSON object per line per report.
+        show_metrics: Show each task's breakdown of time per phase in the
+            progress output.
+        status_path: Optional. A JSON file to keep up to date with each
+            task's progress, throughput, ETA, and gap histogram tail (see
+            `CollectionStatusWriter`).
+        importance_bias: Optional. Sample from the detector error models with
+            every error probability multiplied by this factor, and also record
+            likelihood-ratio weighted gap counts (see
+            `ImportanceGapWorkHandler`). The tasks' metadata should say so, so
+            their strong ids differ from unbiased tasks. Can't be combined
+            with `multi_yoke` or `stopping_rule` (whose criteria are about
+            shot counts, which biased sampling doesn't preserve).
+
+    Raises:
+        ValueError: An unsupported combination of arguments was given.
+    """
     starting = True
     printer = ThrottledProgressPrinter(outs=[out], print_progress=print_progress, min_progress_delay=0.1)
     printer.show_latest_progress(f"Starting {num_workers} workers...")
 
+    if importance_bias is not None and multi_yoke:
+        raise ValueError('importance_bias is not supported with multi_yoke.')
+    if importance_bias is not None and stopping_rule is not None:
+        raise ValueError('importance_bias is not supported with a stopping_rule.')
+    tasks = [
+        _params_dict_to_task(task, multi_yoke=multi_yoke, importance_bias=importance_bias) if isinstance(task, dict) else task
+        for task in tasks
+    ]
     for task in tasks:
         assert task.decoder == 'pymatching'
 
     total_collected = {k: v.to_anon_stats() for k, v in existing_data.items()}
+    status_writer = None if status_path is None else CollectionStatusWriter(status_path)
+    next_progress_time = time.monotonic()
+    # Filled in once the strong ids are known (before any metrics are reported).
+    task_indices: Dict[str, int] = {}
 
     def progress_callback(stat: Optional[sinter.TaskStats]):
         if stat is not None:
             total_collected[stat.strong_id] += stat.to_anon_stats()
             printer.print_out(str(stat))
+            if store is not None:
+                store.append([stat])
+            if status_writer is not None:
+                status_writer.record(stat)
+        if status_writer is not None and not starting:
+            status_writer.maybe_write(m)
         show_progress()
 
-    def show_progress():
+    def metrics_callback(worker_id: int, strong_id: str, metrics: Dict[str, float]):
+        if metrics_out is not None:
+            k = task_indices[strong_id]
+            print(json.dumps({
+                'time': time.time(),
+                'worker': worker_id,
+                'strong_id': strong_id,
+                'json_metadata': m.partial_tasks[k].json_metadata,
+                'metrics': metrics,
+            }), file=metrics_out, flush=True)
+
+    def show_progress(force: bool = False):
+        nonlocal next_progress_time
         if starting:
             printer.show_latest_progress(f"Analyzed {sum(e is not None for e in m.task_strong_ids)}/{len(tasks)} circuits...")
             return
+        # Building the message is the expensive part, so don't do it more often than it can be shown.
+        now = time.monotonic()
+        if not force and now < next_progress_time:
+            return
+        next_progress_time = now + printer.min_progress_delay
 
         tasks_left = 0
         lines = []
         for k, strong_id in enumerate(m.task_strong_ids):
             c = total_collected[strong_id]
-            if c.shots >= num_shots:
+            if c.shots >= num_shots or strong_id not in m.task_states:
                 continue
             tasks_left += 1
-            w = len(m.task_states[strong_id].workers_assigned)
-            dt = None if c.shots == 0 else round(c.seconds / c.shots * (num_shots - c.shots) / 60)
+            workers_assigned = m.task_states[strong_id].workers_assigned
+            w = len(workers_assigned)
+            batch_sizes = [
+                m.worker_states[worker_id].status['batch_shots']
+                for worker_id in workers_assigned
+                if 'batch_shots' in m.worker_states[worker_id].status
+            ]
+            batch_str = '?' if not batch_sizes else f'{min(batch_sizes)}' if min(batch_sizes) == max(batch_sizes) else f'{min(batch_sizes)}..{max(batch_sizes)}'
+            dt = None if c.shots == 0 else c.seconds / c.shots * (num_shots - c.shots) / 60
             lines.append(
                 f'     '
                 f'workers={w} '
-                f'core_mins_left={dt} '
+                f'batch_shots={batch_str} '
+                f'core_mins_left={None if dt is None else round(dt)} '
+                f'eta_mins={None if dt is None or w == 0 else round(dt / w, 1)} '
                 f'shots_left={num_shots - c.shots} '
-                f'errors={c.errors} ' + ",".join(f"{k}={v}" for k, v in m.partial_tasks[k].json_metadata.items()))
+                f'errors={c.errors} ' +
+                (f'phases={_phase_breakdown(m.task_metrics[strong_id])} ' if show_metrics else '') +
+                ",".join(f"{k}={v}" for k, v in m.partial_tasks[k].json_metadata.items()))
         msg = f'{tasks_left} tasks left:\n' + '\n'.join(lines)
+        if m.remote_listener is not None:
+            remote_workers = sum(w.remote_info is not None and not w.disconnected for w in m.worker_states)
+            msg = f'{remote_workers} remote workers connected to {m.remote_listener.address}. ' + msg
         printer.show_latest_progress(msg + '\n')
 
+    if multi_yoke:
+        work_handler = MultiGapWorkHandler(
+            max_parity_classes=max_parity_classes,
+            batch_seconds=batch_seconds,
+            max_batch_bytes=max_batch_bytes,
+        )
+    elif importance_bias is not None:
+        work_handler = ImportanceGapWorkHandler(
+            bias=importance_bias,
+            batch_seconds=batch_seconds,
+            max_batch_bytes=max_batch_bytes,
+        )
+    else:
+        work_handler = GapWorkHandler(
+            batch_seconds=batch_seconds,
+            max_batch_bytes=max_batch_bytes,
+        )
     m = CollectionManager(
         existing_data=existing_data,
         collection_options=sinter.CollectionOptions(max_shots=num_shots),
-        work_handler=GapWorkHandler(),
+        work_handler=work_handler,
         num_workers=num_workers,
         worker_flush_period=worker_flush_period,
         tasks=tasks,
         progress_callback=progress_callback,
+        shared_memory_results=shared_memory_results,
+        dem_cache=dem_cache,
+        cost_aware_scheduling=True,
+        stop_condition=None if stopping_rule is None else stopping_rule.is_satisfied,
+        listen_address=listen_address,
+        authkey=authkey,
+        metrics_callback=metrics_callback,
     )
 
     m.start_workers()
+    if m.remote_listener is not None:
+        print(f'Listening for remote workers at {m.remote_listener.address}.', file=sys.stderr, flush=True)
 
     printer.show_latest_progress(f"Analyzing {len(tasks)} circuits...")
     m.start_distributing_work()
+    task_indices.update((strong_id, k) for k, strong_id in enumerate(m.task_strong_ids))
     starting = False
+    if print_progress:
+        print(f'Analyzed {len(tasks)} circuits in {m.startup_seconds:.1f} seconds.', file=sys.stderr, flush=True)
 
     for strong_id in m.task_strong_ids:
         if strong_id not in total_collected:
             total_collected[strong_id] = sinter.AnonTaskStats()
+    if status_writer is not None:
+        status_writer.add_tasks(m)
+        status_writer.maybe_write(m, force=True)
     if print_header:
         printer.print_out(sinter.CSV_HEADER)
 
-    show_progress()
-    m.run_until_done()
+    show_progress(force=True)
+    try:
+        m.run_until_done()
+    except KeyboardInterrupt:
+        pass
+    if status_writer is not None:
+        status_writer.maybe_write(m, force=True)
 
     printer.show_latest_progress(f'Done')
     printer.flush()
+    for strong_id, failure in m.quarantined_tasks.items():
+        print(f'Task {strong_id} was quarantined because its workers kept failing. Last failure:\n{failure}', file=sys.stderr, flush=True)
@@ -1,11 +1,16 @@
 import contextlib
 import pathlib
 import sys
-from typing import Optional, List
+from typing import Any, Dict, Optional, List, Sequence, Union
 
 import sinter
 
 from yoked.gap import collect_gap_stats
+from yoked.gap._dem_cache import DemCache
+from yoked.gap._gap_collect import sampling_metadata
+from yoked.gap._gap_stats_store import GapStatsStore, read_gap_stats
+from yoked.gap._gap_stopping_rule import GapStoppingRule
+from yoked.gap._remote_collection_workers import Address
 
 
 def collect_circuit_paths(
@@ -16,7 +21,32 @@ def collect_circuit_paths(
         save_resume_filepath: Optional[str],
         processes: int,
         flush_period: float,
+        multi_yoke: bool = False,
+        max_parity_classes: int = 16,
+        batch_seconds: float = 1,
+        max_batch_bytes: int = 2**28,
+        shared_memory_results: bool = False,
+        dem_cache_dir: Optional[str] = None,
+        dem_cache_max_bytes: int = 2**32,
+        stopping_rule: Optional[GapStoppingRule] = None,
+        listen_address: Optional[Address] = None,
+        authkey: Optional[bytes] = None,
+        out_store_path: Optional[str] = None,
+        metrics_path: Optional[str] = None,
+        show_metrics: bool = False,
+        status_path: Optional[str] = None,
+        importance_bias: Optional[float] = None,
+        circuit_params: Sequence[Dict[str, Any]] = (),
 ):
+    if out_store_path is not None and save_resume_filepath is not None:
+        # Results are written to both, and both would be resumed from.
+        raise ValueError('out_store_path and save_resume_filepath would both be resumed from, double counting shots.')
+    store = None
+    if out_store_path is not None:
+        store = GapStatsStore(out_store_path)
+        if store.is_store(out_store_path):
+            # Resume from what's already in the store.
+            existing_data = [*existing_data, out_store_path]
     with contextlib.ExitStack() as ctx:
         existing_data_dict = None
         print_header = True
@@ -27,7 +57,7 @@ def collect_circuit_paths(
                 print('\033[31m' + msg + '\033[0m', file=sys.stderr, flush=True)
                 existing_data_dict = {
                     stat.strong_id: stat
-                    for stat in sinter.read_stats_from_csv_files(save_resume_filepath, *existing_data)
+                    for stat in read_gap_stats(save_resume_filepath, *existing_data)
                 }
                 print_header = False
                 out = ctx.enter_context(open(save_resume_filepath, 'a'))
@@ -40,18 +70,33 @@ def collect_circuit_paths(
         if existing_data_dict is None:
             existing_data_dict = {
                 stat.strong_id: stat
-                for stat in sinter.read_stats_from_csv_files(*existing_data)
+                for stat in read_gap_stats(*existing_data)
             }
 
-        tasks = [
+        tasks: List[Union[sinter.Task, Dict[str, Any]]] = [
             sinter.Task(
                 circuit_path=pathlib.Path(circuit_path).absolute(),
-                json_metadata=sinter.comma_separated_key_values(circuit_path),
+                json_metadata=sampling_metadata(
+                    sinter.comma_separated_key_values(circuit_path),
+                    multi_yoke=multi_yoke,
+                    importance_bias=importance_bias,
+                ),
                 decoder='pymatching',
             )
             for circuit_path in circuit_paths
         ]
 
+        metrics_out = None
+        if metrics_path is not None:
+            metrics_out = ctx.enter_context(open(metrics_path, 'a'))
+
+        dem_cache = None
+        if dem_cache_dir is not None:
+            dem_cache = DemCache(dem_cache_dir, max_bytes=dem_cache_max_bytes)
+            tasks = [dem_cache.with_cached_strong_id(task) for task in tasks]
+        # Generated circuits get their metadata from `collect_gap_stats`.
+        tasks.extend(circuit_params)
+
         collect_gap_stats(
             num_workers=processes,
             tasks=tasks,
@@ -61,4 +106,18 @@ def collect_circuit_paths(
             existing_data=existing_data_dict,
             print_progress=True,
             worker_flush_period=flush_period,
+            multi_yoke=multi_yoke,
+            max_parity_classes=max_parity_classes,
+            batch_seconds=batch_seconds,
+            max_batch_bytes=max_batch_bytes,
+            shared_memory_results=shared_memory_results,
+            dem_cache=dem_cache,
+            stopping_rule=stopping_rule,
+            listen_address=listen_address,
+            authkey=authkey,
+            store=store,
+            metrics_out=metrics_out,
+            show_metrics=show_metrics,
+            status_path=status_path,
+            importance_bias=importance_bias,
         )
@@ -1,10 +1,13 @@
 import io
+import json
 
+import pytest
 import sinter
 
 import gen
 from yoked._yoked_memory_circuits import yoked_magic_memory_circuit
-from yoked.gap._gap_collect import collect_gap_stats
+from yoked.gap._gap_collect import _params_dict_to_task, _phase_breakdown, collect_gap_stats
+from yoked.gap._gap_stopping_rule import GapStoppingRule
 
 
 def test_collect():
@@ -21,6 +24,7 @@ def test_collect():
         json_metadata={'d': 5, 'r': 25, 'p': 1e-3},
     )
     out = io.StringIO()
+    metrics_out = io.StringIO()
     collect_gap_stats(
         num_workers=2,
         tasks=[task],
@@ -30,9 +34,51 @@ def test_collect():
         print_header=True,
         existing_data={},
         worker_flush_period=5,
+        metrics_out=metrics_out,
     )
 
     out.seek(0)
     data = out.read()
     assert data.startswith(sinter.CSV_HEADER)
     assert ''',""C''' in data and ''',""E''' in data
+
+    reports = [json.loads(line) for line in metrics_out.getvalue().splitlines()]
+    assert sum(report['metrics']['shots'] for report in reports) == 1000
+    assert all(report['json_metadata'] == {'d': 5, 'r': 25, 'p': 1e-3} for report in reports)
+
+
+def test_phase_breakdown():
+    assert _phase_breakdown({}) == '?'
+    assert _phase_breakdown({'shots': 5, 'a_seconds': 1, 'b_seconds': 3, 'c_seconds': 0.001}) == 'b:75%,a:25%'
+
+
+def test_params_dict_to_task_marks_sampling_metadata():
+    params = {'patch_diameter': 3, 'rounds': 3, 'noise_strength': 1e-3, 'patches': 1, 'yokes': 1}
+    single = _params_dict_to_task(params, multi_yoke=False)
+    multi = _params_dict_to_task(params, multi_yoke=True)
+    biased = _params_dict_to_task(params, multi_yoke=False, importance_bias=3)
+    assert 'multi_yoke' not in single.json_metadata
+    assert 'importance_bias' not in single.json_metadata
+    assert multi.json_metadata == {**single.json_metadata, 'multi_yoke': True}
+    assert biased.json_metadata == {**single.json_metadata, 'importance_bias': 3}
+    assert multi.params == single.params == biased.params
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'multi_yoke': True},
+    {'stopping_rule': GapStoppingRule(max_gap=5, min_errors_above_gap=1)},
+])
+def test_collect_rejects_importance_bias_with(kwargs):
+    with pytest.raises(ValueError):
+        collect_gap_stats(
+            num_workers=1,
+            tasks=[],
+            num_shots=1000,
+            out=io.StringIO(),
+            print_progress=False,
+            print_header=True,
+            existing_data={},
+            worker_flush_period=5,
+            importance_bias=3,
+            **kwargs,
+        )
@@ -0,0 +1,266 @@
+import collections
+import dataclasses
+import json
+import pathlib
+from typing import Any, Counter, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import sinter
+
+
+def split_gap_counts(custom_counts: Dict[str, int]) -> Tuple[int, np.ndarray, np.ndarray, Counter[str]]:
+    """Splits gap custom counts into dense histograms and everything else.
+
+    Args:
+        custom_counts: Custom counts with keys like 'C5' and 'E-3'.
+
+    Returns:
+        A (min_gap, corrected, errored, other_counts) tuple where
+        corrected[k] is the count of 'C{min_gap + k}', errored[k] is the count
+        of 'E{min_gap + k}', and other_counts holds the keys that aren't
+        single integer gaps (e.g. multi-yoke keys like 'C5_12').
+    """
+    gaps = {}
+    other_counts = collections.Counter()
+    for key, value in custom_counts.items():
+        gap = None
+        if len(key) >= 2 and key[0] in 'CE':
+            try:
+                gap = int(key[1:])
+            except ValueError:
+                pass
+        if gap is None or key != f'{key[0]}{gap}':
+            other_counts[key] += value
+        else:
+            gaps[(gap, key[0] == 'E')] = value
+
+    if not gaps:
+        return 0, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), other_counts
+    min_gap = min(g for g, _ in gaps)
+    max_gap = max(g for g, _ in gaps)
+    hist = np.zeros((2, max_gap - min_gap + 1), dtype=np.int64)
+    for (g, is_error), value in gaps.items():
+        hist[int(is_error), g - min_gap] = value
+    return min_gap, hist[0], hist[1], other_counts
+
+
+def _padded(min_gap: int, hist: np.ndarray, lo: int, hi: int) -> np.ndarray:
+    result = np.zeros(hi - lo, dtype=np.int64)
+    result[min_gap - lo:min_gap - lo + len(hist)] = hist
+    return result
+
+
+@dataclasses.dataclass
+class StoredGapStats:
+    """A row of a `GapStatsStore`, with its gap histograms as dense arrays.
+
+    Attributes:
+        min_gap: The gap of the first entry of `corrected` and `errored`.
+        corrected: corrected[k] is the number of shots with gap min_gap + k
+            that were decoded correctly (the 'C' custom counts).
+        errored: errored[k] is the number of shots with gap min_gap + k that
+            were logical errors (the 'E' custom counts).
+        other_counts: Custom counts that aren't single gaps.
+    """
+    strong_id: str
+    decoder: str
+    json_metadata: Any
+    shots: int
+    errors: int
+    discards: int
+    seconds: float
+    min_gap: int
+    corrected: np.ndarray
+    errored: np.ndarray
+    other_counts: Counter[str]
+
+    @staticmethod
+    def from_task_stats(stat: sinter.TaskStats) -> 'StoredGapStats':
+        min_gap, corrected, errored, other_counts = split_gap_counts(stat.custom_counts)
+        return StoredGapStats(
+            strong_id=stat.strong_id,
+            decoder=stat.decoder,
+            json_metadata=stat.json_metadata,
+            shots=stat.shots,
+            errors=stat.errors,
+            discards=stat.discards,
+            seconds=stat.seconds,
+            min_gap=min_gap,
+            corrected=corrected,
+            errored=errored,
+            other_counts=other_counts,
+        )
+
+    def to_task_stats(self) -> sinter.TaskStats:
+        custom_counts = collections.Counter(self.other_counts)
+        for prefix, hist in [('C', self.corrected), ('E', self.errored)]:
+            for k in np.flatnonzero(hist).tolist():
+                custom_counts[f'{prefix}{self.min_gap + k}'] += int(hist[k])
+        return sinter.TaskStats(
+            strong_id=self.strong_id,
+            decoder=self.decoder,
+            json_metadata=self.json_metadata,
+            shots=self.shots,
+            errors=self.errors,
+            discards=self.discards,
+            seconds=self.seconds,
+            custom_counts=custom_counts,
+        )
+
+    def __add__(self, other: 'StoredGapStats') -> 'StoredGapStats':
+        if self.strong_id != other.strong_id:
+            raise ValueError(f'{self.strong_id=} != {other.strong_id=}')
+        ranges = [(r.min_gap, r.min_gap + len(r.corrected)) for r in [self, other] if len(r.corrected)]
+        lo = min([a for a, _ in ranges], default=0)
+        hi = max([b for _, b in ranges], default=0)
+        return StoredGapStats(
+            strong_id=self.strong_id,
+            decoder=self.decoder,
+            json_metadata=self.json_metadata,
+            shots=self.shots + other.shots,
+            errors=self.errors + other.errors,
+            discards=self.discards + other.discards,
+            seconds=self.seconds + other.seconds,
+            min_gap=lo,
+            corrected=_padded(self.min_gap, self.corrected, lo, hi) + _padded(other.min_gap, other.corrected, lo, hi),
+            errored=_padded(self.min_gap, self.errored, lo, hi) + _padded(other.min_gap, other.errored, lo, hi),
+            other_counts=self.other_counts + other.other_counts,
+        )
+
+
+class GapStatsStore:
+    """An append-only binary store of gap statistics.
+
+    CSV rows hold gap histograms as JSON dicts with hundreds of keys, which
+    makes appending, reading, and combining large files slow. A store is a
+    directory containing:
+
+        counts.bin: The gap histograms of each row, as consecutive int64
+            arrays of the form [C gap bins..., E gap bins...]. Memory mapped
+            when read.
+        index.jsonl: One JSON object per row, with the row's non-histogram
+            fields and where its histograms are in counts.bin.
+
+    Rows are appended by writing the histograms first and the index line
+    second, so a writer dying part way through never produces a row pointing
+    at missing data. Incomplete index lines are ignored when reading.
+    """
+
+    def __init__(self, directory: Union[str, pathlib.Path]):
+        self.directory = pathlib.Path(directory)
+        self.counts_path = self.directory / 'counts.bin'
+        self.index_path = self.directory / 'index.jsonl'
+
+    @staticmethod
+    def is_store(path: Union[str, pathlib.Path]) -> bool:
+        return (pathlib.Path(path) / 'index.jsonl').exists()
+
+    def append(self, stats: Iterable[sinter.TaskStats]) -> None:
+        """Appends rows to the store, creating it if needed."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        index_lines = []
+        with open(self.counts_path, 'ab') as f:
+            for stat in stats:
+                row = StoredGapStats.from_task_stats(stat)
+                offset = f.tell()
+                if offset % 8:
+                    # Left behind by a writer that died part way through a row.
+                    f.write(b'\0' * (8 - offset % 8))
+                    offset = f.tell()
+                f.write(np.concatenate([row.corrected, row.errored]).astype('<i8').tobytes())
+                index_lines.append(json.dumps({
+                    'strong_id': row.strong_id,
+                    'decoder': row.decoder,
+                    'json_metadata': row.json_metadata,
+                    'shots': row.shots,
+                    'errors': row.errors,
+                    'discards': row.discards,
+                    'seconds': row.seconds,
+                    'min_gap': row.min_gap,
+                    'num_gaps': len(row.corrected),
+                    'offset': offset,
+                    'other_counts': row.other_counts,
+                }) + '\n')
+        with open(self.index_path, 'a+b') as f:
+            if f.tell() > 0:
+                f.seek(f.tell() - 1)
+                if f.read(1) != b'\n':
+                    # Terminate a line left partially written by a writer that died.
+                    f.write(b'\n')
+            f.write(''.join(index_lines).encode('utf8'))
+
+    def rows(self) -> List[StoredGapStats]:
+        """Returns the rows of the store, in the order they were appended.
+
+        The histograms are read-only views into the memory-mapped counts file.
+        """
+        if not self.index_path.exists():
+            return []
+        counts: Optional[np.ndarray] = None
+        # Ignore a partially written trailing value; no index line refers to it.
+        num_values = self.counts_path.stat().st_size // 8
+        if num_values > 0:
+            counts = np.memmap(self.counts_path, dtype='<i8', mode='r', shape=(num_values,))
+        result = []
+        with open(self.index_path) as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Partially written by a writer that died.
+                    continue
+                n = entry['num_gaps']
+                start = entry['offset'] // 8
+                if n:
+                    hist = counts[start:start + 2 * n]
+                    corrected, errored = hist[:n], hist[n:]
+                else:
+                    corrected = errored = np.zeros(0, dtype=np.int64)
+                result.append(StoredGapStats(
+                    strong_id=entry['strong_id'],
+                    decoder=entry['decoder'],
+                    json_metadata=entry['json_metadata'],
+                    shots=entry['shots'],
+                    errors=entry['errors'],
+                    discards=entry['discards'],
+                    seconds=entry['seconds'],
+                    min_gap=entry['min_gap'],
+                    corrected=corrected,
+                    errored=errored,
+                    other_counts=collections.Counter(entry['other_counts']),
+                ))
+        return result
+
+    def combined_rows(self) -> List[StoredGapStats]:
+        """Returns the rows of the store, with rows of the same task added together."""
+        return combine_stored_gap_stats(self.rows())
+
+
+def combine_stored_gap_stats(rows: Iterable[StoredGapStats]) -> List[StoredGapStats]:
+    combined: Dict[str, StoredGapStats] = {}
+    for row in rows:
+        if row.strong_id in combined:
+            combined[row.strong_id] += row
+        else:
+            combined[row.strong_id] = row
+    return list(combined.values())
+
+
+def read_gap_stats(*paths: Union[str, pathlib.Path]) -> List[sinter.TaskStats]:
+    """Reads and combines gap statistics from sinter CSV files and gap stats stores.
+
+    This is a drop-in replacement for `sinter.read_stats_from_csv_files` that
+    also accepts `GapStatsStore` directories.
+    """
+    rows = []
+    csv_paths = []
+    for path in paths:
+        if GapStatsStore.is_store(path):
+            rows.extend(GapStatsStore(path).rows())
+        else:
+            csv_paths.append(path)
+    if csv_paths:
+        rows.extend(StoredGapStats.from_task_stats(stat) for stat in sinter.read_stats_from_csv_files(*csv_paths))
+    return [row.to_task_stats() for row in combine_stored_gap_stats(rows)]
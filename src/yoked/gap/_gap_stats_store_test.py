@@ -0,0 +1,86 @@
+import collections
+
+import numpy as np
+import sinter
+
+from yoked.gap._gap_stats_store import GapStatsStore, read_gap_stats, split_gap_counts, StoredGapStats
+
+
+def _stat(strong_id: str, shots: int, custom_counts: dict) -> sinter.TaskStats:
+    return sinter.TaskStats(
+        strong_id=strong_id,
+        decoder='pymatching',
+        json_metadata={'d': 3, 'p': 0.001},
+        shots=shots,
+        errors=sum(v for k, v in custom_counts.items() if k[0] == 'E'),
+        discards=1,
+        seconds=2.5,
+        custom_counts=collections.Counter(custom_counts),
+    )
+
+
+def test_split_gap_counts():
+    min_gap, corrected, errored, other = split_gap_counts({'C5': 2, 'E-2': 3, 'C-1': 4, 'C3_4': 1, 'E+2': 7})
+    assert min_gap == -2
+    assert corrected.tolist() == [0, 4, 0, 0, 0, 0, 0, 2]
+    assert errored.tolist() == [3, 0, 0, 0, 0, 0, 0, 0]
+    assert other == collections.Counter({'C3_4': 1, 'E+2': 7})
+
+    min_gap, corrected, errored, other = split_gap_counts({'x': 1})
+    assert len(corrected) == len(errored) == 0
+    assert other == collections.Counter({'x': 1})
+
+
+def test_stored_gap_stats_add():
+    a = StoredGapStats.from_task_stats(_stat('a', 10, {'C1': 5, 'E2': 1}))
+    b = StoredGapStats.from_task_stats(_stat('a', 20, {'C-3': 2, 'C1': 1, 'C1_2': 4}))
+    c = StoredGapStats.from_task_stats(_stat('a', 5, {}))
+    assert (a + b + c).to_task_stats() == _stat('a', 10, {'C1': 5, 'E2': 1}) + _stat('a', 20, {'C-3': 2, 'C1': 1, 'C1_2': 4}) + _stat('a', 5, {})
+    assert (c + a).to_task_stats() == _stat('a', 5, {}) + _stat('a', 10, {'C1': 5, 'E2': 1})
+
+
+def test_store_round_trip(tmp_path):
+    stats = [
+        _stat('a', 10, {'C1': 5, 'E2': 1, 'C-4': 4}),
+        _stat('b', 3, {'C0_7': 3}),
+        _stat('a', 20, {'C1': 20}),
+    ]
+    store = GapStatsStore(tmp_path / 'store')
+    assert not GapStatsStore.is_store(tmp_path / 'store')
+    assert store.rows() == []
+    store.append(stats[:2])
+    store.append(stats[2:])
+    assert GapStatsStore.is_store(tmp_path / 'store')
+
+    rows = store.rows()
+    assert [row.to_task_stats() for row in rows] == stats
+    assert isinstance(rows[0].corrected, np.memmap)
+    assert sorted(read_gap_stats(tmp_path / 'store'), key=lambda e: e.strong_id) == [stats[0] + stats[2], stats[1]]
+
+
+def test_store_ignores_incomplete_writes(tmp_path):
+    store = GapStatsStore(tmp_path)
+    store.append([_stat('a', 10, {'C1': 10})])
+    with open(store.counts_path, 'ab') as f:
+        f.write(b'\1\2\3')
+    with open(store.index_path, 'a') as f:
+        f.write('{"strong_id": "b", "dec')
+    assert [row.to_task_stats() for row in store.rows()] == [_stat('a', 10, {'C1': 10})]
+
+    # Appending after a partial write still works.
+    store.append([_stat('a', 5, {'E-1': 4})])
+    assert read_gap_stats(tmp_path) == [_stat('a', 10, {'C1': 10}) + _stat('a', 5, {'E-1': 4})]
+
+
+def test_read_gap_stats_mixes_csv_and_stores(tmp_path):
+    csv_path = tmp_path / 'stats.csv'
+    with open(csv_path, 'w') as f:
+        print(sinter.CSV_HEADER, file=f)
+        print(_stat('a', 10, {'C1': 10}), file=f)
+        print(_stat('b', 10, {'C2': 10}), file=f)
+    GapStatsStore(tmp_path / 'store').append([_stat('a', 5, {'C1': 2, 'E3': 3})])
+    result = sorted(read_gap_stats(csv_path, tmp_path / 'store'), key=lambda e: e.strong_id)
+    assert result == [
+        _stat('a', 10, {'C1': 10}) + _stat('a', 5, {'C1': 2, 'E3': 3}),
+        _stat('b', 10, {'C2': 10}),
+    ]
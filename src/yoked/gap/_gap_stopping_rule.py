@@ -0,0 +1,77 @@
+import collections
+import dataclasses
+from typing import Dict, Optional, Tuple
+
+import sinter
+
+
+def gap_key_bucket(key: str) -> Optional[Tuple[int, bool]]:
+    """Parses a gap custom count key into its (gap, is_error) bucket.
+
+    Multi-yoke keys (like 'C5_12') are bucketed by their smallest gap, which
+    is the gap to the nearest other parity class. Returns None for keys that
+    aren't gap keys.
+    """
+    if len(key) < 2 or key[0] not in 'CE':
+        return None
+    try:
+        gap = min(int(g) for g in key[1:].split('_'))
+    except ValueError:
+        return None
+    return gap, key[0] == 'E'
+
+
+@dataclasses.dataclass(frozen=True)
+class GapStoppingRule:
+    """Decides when enough gap statistics have been collected for a task.
+
+    A task is done once every one of the specified criteria holds:
+
+    - min_shots_per_bucket: every gap from 0 to max_gap has at least this
+        many shots.
+    - max_relative_ci_width: at every gap from 0 to max_gap, the logical
+        error rate's confidence interval (per `sinter.fit_binomial` with a
+        max likelihood factor of 1000) is at most this wide relative to the
+        best estimate. Gaps without any errors never satisfy this.
+    - min_errors_above_gap: there are at least this many errors with a gap
+        of max_gap or more.
+    """
+    max_gap: int
+    min_shots_per_bucket: Optional[int] = None
+    max_relative_ci_width: Optional[float] = None
+    min_errors_above_gap: Optional[int] = None
+
+    def __post_init__(self):
+        if self.max_gap < 0:
+            raise ValueError(f'{self.max_gap=} < 0')
+        if self.min_shots_per_bucket is None and self.max_relative_ci_width is None and self.min_errors_above_gap is None:
+            raise ValueError('No stopping criteria specified.')
+
+    def is_satisfied(self, stats: sinter.AnonTaskStats) -> bool:
+        buckets: Dict[Tuple[int, bool], int] = collections.Counter()
+        for key, value in stats.custom_counts.items():
+            bucket = gap_key_bucket(key)
+            if bucket is not None:
+                buckets[bucket] += value
+
+        if self.min_errors_above_gap is not None:
+            errors_above = sum(v for (g, is_error), v in buckets.items() if is_error and g >= self.max_gap)
+            if errors_above < self.min_errors_above_gap:
+                return False
+
+        if self.min_shots_per_bucket is not None:
+            for g in range(self.max_gap + 1):
+                if buckets[(g, False)] + buckets[(g, True)] < self.min_shots_per_bucket:
+                    return False
+
+        if self.max_relative_ci_width is not None:
+            # High gaps have the fewest errors, so they're the most likely to fail.
+            for g in range(self.max_gap, -1, -1):
+                e = buckets[(g, True)]
+                if e == 0:
+                    return False
+                fit = sinter.fit_binomial(num_shots=buckets[(g, False)] + e, num_hits=e, max_likelihood_factor=1000)
+                if fit.high - fit.low > self.max_relative_ci_width * fit.best:
+                    return False
+
+        return True
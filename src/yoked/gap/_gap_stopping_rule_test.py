@@ -0,0 +1,52 @@
+import collections
+
+import pytest
+import sinter
+
+from yoked.gap._gap_stopping_rule import gap_key_bucket, GapStoppingRule
+
+
+def test_gap_key_bucket():
+    assert gap_key_bucket('C5') == (5, False)
+    assert gap_key_bucket('E-3') == (-3, True)
+    assert gap_key_bucket('C7_2_9') == (2, False)
+    assert gap_key_bucket('E4_-1') == (-1, True)
+    assert gap_key_bucket('X5') is None
+    assert gap_key_bucket('C') is None
+    assert gap_key_bucket('Cx') is None
+
+
+def _stats(**counts: int) -> sinter.AnonTaskStats:
+    custom_counts = collections.Counter({k.replace('m', '-'): v for k, v in counts.items()})
+    return sinter.AnonTaskStats(shots=sum(custom_counts.values()), custom_counts=custom_counts)
+
+
+def test_gap_stopping_rule_validation():
+    with pytest.raises(ValueError, match='criteria'):
+        GapStoppingRule(max_gap=5)
+    with pytest.raises(ValueError):
+        GapStoppingRule(max_gap=-1, min_shots_per_bucket=5)
+
+
+def test_gap_stopping_rule_min_shots_per_bucket():
+    rule = GapStoppingRule(max_gap=2, min_shots_per_bucket=10)
+    assert not rule.is_satisfied(sinter.AnonTaskStats())
+    assert not rule.is_satisfied(_stats(C0=10, C1=10, C2=9, Cm1=100))
+    assert rule.is_satisfied(_stats(C0=10, C1=5, E1=5, C2=9, E2=1))
+
+
+def test_gap_stopping_rule_min_errors_above_gap():
+    rule = GapStoppingRule(max_gap=3, min_errors_above_gap=4)
+    assert not rule.is_satisfied(_stats(E2=100, E3=3, C10=1000))
+    assert rule.is_satisfied(_stats(E3=3, E7=1))
+    assert rule.is_satisfied(_stats(E3_8=4))
+
+
+def test_gap_stopping_rule_max_relative_ci_width():
+    rule = GapStoppingRule(max_gap=1, max_relative_ci_width=1)
+    assert not rule.is_satisfied(_stats(C0=1000, E0=100, C1=1000))
+    assert not rule.is_satisfied(_stats(C0=1000, E0=100, C1=1000, E1=2))
+    assert rule.is_satisfied(_stats(C0=1000, E0=100, C1=10000, E1=100))
+
+    both = GapStoppingRule(max_gap=1, max_relative_ci_width=1, min_shots_per_bucket=100000)
+    assert not both.is_satisfied(_stats(C0=1000, E0=100, C1=10000, E1=100))
@@ -1,96 +1,117 @@
 import collections
 import math
 import time
-from typing import Optional, cast
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 import pymatching
 import sinter
 import stim
 
+from yoked.gap._batch_size_controller import BatchSizeController
 from yoked.gap._collection_work_handler import CollectionWorkHandler
+from yoked.gap._phase_timers import PhaseTimers
+
+
+def gap_histogram(*, gaps: np.ndarray, errors: np.ndarray) -> collections.Counter:
+    """Counts shots by their rounded gap and whether they were a logical error.
+
+    Args:
+        gaps: An int64 array of rounded gaps, one per shot.
+        errors: A bool array indicating which shots were logical errors.
+
+    Returns:
+        A counter with keys like 'E5' (error with gap 5) and 'C-3' (correct
+        with gap -3), mapping to the number of shots in that bucket.
+    """
+    result = collections.Counter()
+    if len(gaps) == 0:
+        return result
+
+    # Interleave gap and error flag into one bucket index, then count buckets.
+    buckets = gaps * 2 + errors
+    offset = int(np.min(buckets))
+    counts = np.bincount(buckets - offset)
+    for k in np.flatnonzero(counts).tolist():
+        b = k + offset
+        result[f'{"CE"[b & 1]}{b >> 1}'] = int(counts[k])
+    return result
 
 
 class GapWorkHandler(CollectionWorkHandler):
-    def __init__(self):
+    def __init__(self, *, batch_seconds: float = 1, max_batch_bytes: int = 2**28):
+        """
+        Args:
+            batch_seconds: Target wall time of each sample+decode call.
+            max_batch_bytes: Memory budget of each sample+decode call.
+        """
         self.loaded_key = None
         self.matcher: Optional[pymatching.Matching] = None
         self.sampler: Optional[stim.CompiledDetectorSampler] = None
         self.decibels_per_w: float = 1
-        self.check_mask_for_last_byte: int = 0
-        self.num_safe_work = 1
+        self.num_det_bytes: int = 0
+        self.num_obs_bytes: int = 0
+        self.flips: List[np.ndarray] = []
+        self.batch_size_controller = BatchSizeController(
+            target_seconds=batch_seconds,
+            max_bytes=max_batch_bytes,
+        )
+        self.timers = PhaseTimers()
 
     def do_some_work(self, task: sinter.Task, max_shots: int) -> sinter.AnonTaskStats:
         self._load_task(task)
+        num_shots = self.batch_size_controller.next_batch_size(
+            max_shots=max_shots,
+            bytes_per_shot=self._bytes_per_shot(),
+        )
         t0 = time.monotonic()
-        result = self._sample_loaded_task(num_shots=min(max_shots, self.num_safe_work))
-        dt = time.monotonic() - t0
-        if self.num_safe_work > 1:
-            if dt > 10:
-                self.num_safe_work //= 2
-        if self.num_safe_work < 1024:
-            if dt < 1:
-                self.num_safe_work *= 2
-            if dt < 0.5:
-                self.num_safe_work *= 2
-            if dt < 0.25:
-                self.num_safe_work *= 2
-            if dt < 0.125:
-                self.num_safe_work *= 2
+        result = self._sample_loaded_task(num_shots=num_shots)
+        self.batch_size_controller.record(shots=num_shots, seconds=time.monotonic() - t0)
         return result
 
+    def status(self) -> Dict[str, Any]:
+        return {'batch_shots': self.batch_size_controller.last_batch_size}
+
+    def take_metrics(self) -> Dict[str, float]:
+        return self.timers.take()
+
+    def _bytes_per_shot(self) -> int:
+        """Estimates the peak memory used per shot while sampling and decoding."""
+        f = len(self.flips)
+        # Sampled detection events plus a flipped copy, predictions and
+        # weights per flip, and the per-shot gap/error arrays.
+        return self.num_det_bytes * 2 + self.num_obs_bytes * (1 + f) + 8 * f + 24
+
     def _load_task(self, task: sinter.Task) -> None:
         key = task.strong_id()
         if self.loaded_key == key:
             return
         self.loaded_key = key
-        self.matcher = pymatching.Matching.from_detector_error_model(task.detector_error_model)
-        self.sampler = task.circuit.compile_detector_sampler()
-        self.num_safe_work = 1
+        self.timers.count('task_loads')
+        with self.timers.phase('load_matcher'):
+            self.matcher = pymatching.Matching.from_detector_error_model(task.detector_error_model)
+        with self.timers.phase('compile_sampler'):
+            self.sampler = task.circuit.compile_detector_sampler()
+        self.batch_size_controller.reset()
 
         edge = next(iter(self.matcher.to_networkx().edges.values()))
         edge_w = edge['weight']
         edge_p = edge['error_probability']
         self.decibels_per_w = -math.log10(edge_p / (1 - edge_p)) * 10 / edge_w
 
-        self.check_mask_for_last_byte = 1 << ((task.circuit.num_detectors - 1) % 8)
+        self.num_det_bytes = (task.circuit.num_detectors + 7) // 8
+        self.num_obs_bytes = (task.circuit.num_observables + 7) // 8
+        no_flip = np.zeros(shape=self.num_det_bytes, dtype=np.uint8)
+        check_flip = np.zeros(shape=self.num_det_bytes, dtype=np.uint8)
+        check_flip[-1] = 1 << ((task.circuit.num_detectors - 1) % 8)
+        self.flips = [no_flip, check_flip]
 
     def _sample_loaded_task(self, *, num_shots: int) -> sinter.AnonTaskStats:
-        assert self.loaded_key is not None
-
         t0 = time.monotonic()
-        dets, actual_obs = self.sampler.sample(
-            shots=num_shots,
-            bit_packed=True,
-            separate_observables=True,
-        )
-
-        predicted_obs, weights = self.matcher.decode_batch(
-            dets,
-            return_weights=True,
-            bit_packed_shots=True,
-            bit_packed_predictions=True,
-        )
-
-        dets[:, -1] ^= self.check_mask_for_last_byte
-        predicted_obs_with_inverted_check, weights_with_inverted_check = self.matcher.decode_batch(
-            dets,
-            return_weights=True,
-            bit_packed_shots=True,
-            bit_packed_predictions=True,
-        )
-
-        errors = np.any(predicted_obs != actual_obs, axis=1)
-        num_errors = np.count_nonzero(errors)
-
-        # Classify all shots by their error + gap.
-        custom_counts = collections.Counter()
-        gaps = (weights_with_inverted_check - weights) * self.decibels_per_w
-        gaps = np.round(gaps).astype(dtype=np.int64)
-        for k in range(len(gaps)):
-            g = gaps[k]
-            key = f'E{g}' if errors[k] else f'C{g}'
-            custom_counts[key] += 1
+        gaps, errors = self._sample_loaded_task_gaps(num_shots=num_shots)
+        with self.timers.phase('histogram'):
+            num_errors = np.count_nonzero(errors)
+            custom_counts = gap_histogram(gaps=gaps, errors=errors)
         t1 = time.monotonic()
 
         return sinter.AnonTaskStats(
@@ -99,3 +120,50 @@ class GapWorkHandler(CollectionWorkHandler):
             seconds=t1 - t0,
             custom_counts=custom_counts,
         )
+
+    def _sample_loaded_task_dets(self, *, num_shots: int) -> Tuple[np.ndarray, np.ndarray]:
+        with self.timers.phase('sample'):
+            dets, actual_obs = self.sampler.sample(
+                shots=num_shots,
+                bit_packed=True,
+                separate_observables=True,
+            )
+        self.timers.count('shots', num_shots)
+        self.timers.count('bytes_sampled', dets.nbytes + actual_obs.nbytes)
+        return dets, actual_obs
+
+    def _decode_under_flips(self, dets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Decodes the shots once per entry of self.flips (the first is always empty).
+
+        Returns:
+            A (predictions, weights) tuple with shapes
+            (len(self.flips), shots, observable_bytes) and
+            (len(self.flips), shots).
+        """
+        all_predictions = []
+        all_weights = []
+        for k, flip in enumerate(self.flips):
+            with self.timers.phase('decode_first' if k == 0 else 'decode_flipped'):
+                predictions, weights = self.matcher.decode_batch(
+                    dets ^ flip if k else dets,
+                    return_weights=True,
+                    bit_packed_shots=True,
+                    bit_packed_predictions=True,
+                )
+            self.timers.count('decode_calls')
+            all_predictions.append(predictions)
+            all_weights.append(weights)
+        return np.array(all_predictions), np.array(all_weights)
+
+    def _sample_loaded_task_gaps(self, *, num_shots: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Samples shots and returns their rounded gaps and logical error flags."""
+        assert self.loaded_key is not None
+
+        dets, actual_obs = self._sample_loaded_task_dets(num_shots=num_shots)
+        (predicted_obs, _), (weights, weights_with_inverted_check) = self._decode_under_flips(dets)
+
+        with self.timers.phase('histogram'):
+            errors = np.any(predicted_obs != actual_obs, axis=1)
+            gaps = (weights_with_inverted_check - weights) * self.decibels_per_w
+            gaps = np.round(gaps).astype(dtype=np.int64)
+        return gaps, errors
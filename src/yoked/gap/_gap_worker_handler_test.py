@@ -0,0 +1,72 @@
+import collections
+
+import numpy as np
+import sinter
+
+import gen
+from yoked._yoked_memory_circuits import yoked_magic_memory_circuit
+from yoked.gap._gap_worker_handler import gap_histogram, GapWorkHandler
+
+
+def test_gap_histogram():
+    assert gap_histogram(
+        gaps=np.array([], dtype=np.int64),
+        errors=np.array([], dtype=np.bool_),
+    ) == collections.Counter()
+
+    assert gap_histogram(
+        gaps=np.array([5, 5, -3, 0, 5, -3, 0], dtype=np.int64),
+        errors=np.array([0, 1, 0, 1, 0, 1, 0], dtype=np.bool_),
+    ) == collections.Counter({
+        'C5': 2,
+        'E5': 1,
+        'C-3': 1,
+        'E-3': 1,
+        'C0': 1,
+        'E0': 1,
+    })
+
+
+def test_gap_histogram_matches_per_shot_loop():
+    rng = np.random.default_rng(5)
+    gaps = rng.integers(-300, 300, size=10000, dtype=np.int64)
+    errors = rng.random(10000) < 0.1
+
+    expected = collections.Counter()
+    for k in range(len(gaps)):
+        g = gaps[k]
+        key = f'E{g}' if errors[k] else f'C{g}'
+        expected[key] += 1
+
+    actual = gap_histogram(gaps=gaps, errors=errors)
+    assert actual == expected
+    assert all(type(v) == int for v in actual.values())
+
+
+def test_gap_work_handler_metrics():
+    circuit = yoked_magic_memory_circuit(
+        patch_diameter=3,
+        rounds=3,
+        noise=gen.NoiseModel.uniform_depolarizing(1e-3),
+        yokes=True,
+        style='cz',
+        num_patches=1,
+    )
+    task = sinter.Task(
+        circuit=circuit,
+        detector_error_model=circuit.detector_error_model(decompose_errors=True),
+        decoder='pymatching',
+    )
+    handler = GapWorkHandler()
+    stats = handler.do_some_work(task, 100)
+    metrics = handler.take_metrics()
+    assert metrics['shots'] == stats.shots
+    assert metrics['task_loads'] == 1
+    assert metrics['decode_calls'] == 2
+    assert metrics['bytes_sampled'] > 0
+    for phase in ['load_matcher', 'compile_sampler', 'sample', 'decode_first', 'decode_flipped', 'histogram']:
+        assert metrics[f'{phase}_seconds'] >= 0
+    assert handler.take_metrics() == {}
+
+    handler.do_some_work(task, 100)
+    assert 'task_loads' not in handler.take_metrics()
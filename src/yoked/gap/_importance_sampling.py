@@ -0,0 +1,218 @@
+import collections
+import time
+from typing import Tuple
+
+import numpy as np
+import sinter
+import stim
+
+from yoked.gap._gap_worker_handler import GapWorkHandler, gap_histogram
+
+# Weighted custom counts are stored as integers in units of 2**-60 shots, so
+# that they can live alongside ordinary counts (which sinter requires to be
+# integers) while still resolving per-shot probabilities far below 1e-12.
+WEIGHT_SCALE = 2**60
+
+# Bounds the temporary memory used when computing likelihood ratios.
+_MAX_LOOKUP_ELEMENTS = 2**22
+
+
+def biased_detector_error_model(
+        dem: stim.DetectorErrorModel,
+        *,
+        bias: float,
+) -> Tuple[stim.DetectorErrorModel, float, np.ndarray]:
+    """Scales up the probability of every error mechanism in a detector error model.
+
+    Args:
+        dem: The model to bias.
+        bias: The factor to multiply each error probability by. Biased
+            probabilities are capped at 0.5.
+
+    Returns:
+        A (biased_dem, base_log_ratio, fired_log_ratios) tuple. The biased dem
+        is flattened, so its k'th error instruction corresponds to the k'th
+        bit of the errors returned by its sampler. The log likelihood ratio
+        (original over biased probability) of a sample is base_log_ratio
+        plus the sum of fired_log_ratios[k] over the errors k that fired.
+    """
+    if bias <= 0:
+        raise ValueError(f'{bias=} <= 0')
+    biased = stim.DetectorErrorModel()
+    ps = []
+    qs = []
+    for instruction in dem.flattened():
+        if isinstance(instruction, stim.DemInstruction) and instruction.type == 'error':
+            p = instruction.args_copy()[0]
+            q = min(p * bias, 0.5) if p < 0.5 else p
+            ps.append(p)
+            qs.append(q)
+            biased.append(stim.DemInstruction('error', [q], instruction.targets_copy()))
+        else:
+            biased.append(instruction)
+    ps = np.array(ps, dtype=np.float64)
+    qs = np.array(qs, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        not_fired = np.log1p(-ps) - np.log1p(-qs)
+        fired = np.log(ps) - np.log(qs)
+    # Mechanisms with probability 0 never fire under either distribution.
+    fired[ps == 0] = 0
+    return biased, float(np.sum(not_fired)), fired - not_fired
+
+
+def bit_packed_log_ratio_table(fired_log_ratios: np.ndarray) -> np.ndarray:
+    """Tabulates the log ratio contributed by each possible byte of bit packed errors.
+
+    Returns:
+        A float64 array of shape (num_error_bytes, 256) where entry [j, b] is
+        the sum of fired_log_ratios over the errors whose bits are set when
+        the j'th byte of the bit packed errors equals b.
+    """
+    n = len(fired_log_ratios)
+    padded = np.zeros(shape=(n + 7) // 8 * 8, dtype=np.float64)
+    padded[:n] = fired_log_ratios
+    bits = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1, bitorder='little').astype(np.float64)
+    return padded.reshape(-1, 8) @ bits.T
+
+
+def likelihood_ratios(*, errors: np.ndarray, base_log_ratio: float, table: np.ndarray) -> np.ndarray:
+    """Computes the likelihood ratio (importance weight) of each sampled shot.
+
+    Args:
+        errors: Bit packed errors with shape (shots, num_error_bytes), as
+            returned by a detector error model sampler.
+        base_log_ratio: From `biased_detector_error_model`.
+        table: From `bit_packed_log_ratio_table`.
+    """
+    num_shots, num_bytes = errors.shape
+    log_ratios = np.full(shape=num_shots, fill_value=base_log_ratio, dtype=np.float64)
+    if num_bytes == 0:
+        return np.exp(log_ratios)
+    columns = np.arange(num_bytes)
+    chunk = max(1, _MAX_LOOKUP_ELEMENTS // num_bytes)
+    for start in range(0, num_shots, chunk):
+        rows = errors[start:start + chunk]
+        log_ratios[start:start + chunk] += table[columns, rows].sum(axis=1)
+    return np.exp(log_ratios)
+
+
+def weighted_gap_histogram(*, gaps: np.ndarray, errors: np.ndarray, weights: np.ndarray) -> collections.Counter:
+    """Sums the importance weights of shots by their rounded gap and whether they were a logical error.
+
+    Returns:
+        A counter with keys like 'WE5' and 'WC-3' (the weighted versions of
+        the keys made by `gap_histogram`), mapping to summed weights in units
+        of 1/WEIGHT_SCALE.
+    """
+    result = collections.Counter()
+    if len(gaps) == 0:
+        return result
+    buckets = gaps * 2 + errors
+    offset = int(np.min(buckets))
+    sums = np.bincount(buckets - offset, weights=weights)
+    for k in np.flatnonzero(sums).tolist():
+        b = k + offset
+        value = int(round(sums[k] * WEIGHT_SCALE))
+        if value:
+            result[f'W{"CE"[b & 1]}{b >> 1}'] = value
+    return result
+
+
+def importance_weighted_stats(stat: sinter.TaskStats) -> sinter.TaskStats:
+    """Converts importance sampled stats into estimates of the unbiased stats.
+
+    Stats without weighted counts are returned unchanged. Otherwise the result
+    is in units of 1/WEIGHT_SCALE shots: shots and discards are multiplied by
+    WEIGHT_SCALE, while errors and the 'C'/'E' custom counts become the
+    corresponding summed weights. Ratios like `errors / shots` or
+    `custom_counts['E5'] / shots` are then unbiased estimates of the
+    unbiased rates.
+    """
+    weighted = {k[1:]: v for k, v in stat.custom_counts.items() if k.startswith('W')}
+    if not weighted:
+        return stat
+    return sinter.TaskStats(
+        strong_id=stat.strong_id,
+        decoder=stat.decoder,
+        json_metadata=stat.json_metadata,
+        shots=stat.shots * WEIGHT_SCALE,
+        errors=sum(v for k, v in weighted.items() if k[0] == 'E'),
+        discards=stat.discards * WEIGHT_SCALE,
+        seconds=stat.seconds,
+        custom_counts=collections.Counter(weighted),
+    )
+
+
+class ImportanceGapWorkHandler(GapWorkHandler):
+    """Collects gaps from a biased noise model, weighting each shot by its likelihood ratio.
+
+    Logical errors with large gaps need many physical errors, so they're
+    exponentially rare under the actual noise model and plain sampling spends
+    almost every shot in the bulk of the distribution. This handler samples
+    from the detector error model with every error probability multiplied by
+    `bias`, decodes with the unbiased model, and records both the raw
+    (biased) 'C'/'E' counts and the likelihood-ratio weighted 'WC'/'WE'
+    counts. Use `importance_weighted_stats` to turn the weighted counts into
+    estimates of the unbiased gap histogram.
+
+    Shots are sampled from the detector error model rather than the circuit,
+    which is equivalent up to the approximations made when deriving the
+    model. Biased results aren't comparable to unbiased ones, so tasks
+    sampled this way should have distinct metadata (and strong ids).
+    """
+
+    def __init__(self, *, bias: float, batch_seconds: float = 1, max_batch_bytes: int = 2**28):
+        super().__init__(batch_seconds=batch_seconds, max_batch_bytes=max_batch_bytes)
+        self.bias = bias
+        self.biased_sampler = None
+        self.base_log_ratio = 0.0
+        self.log_ratio_table = np.zeros(shape=(0, 256), dtype=np.float64)
+        self.last_weights = np.zeros(shape=0, dtype=np.float64)
+
+    def _bytes_per_shot(self) -> int:
+        return super()._bytes_per_shot() + len(self.log_ratio_table) + 16
+
+    def _load_task(self, task: sinter.Task) -> None:
+        if self.loaded_key == task.strong_id():
+            return
+        super()._load_task(task)
+        with self.timers.phase('bias_model'):
+            biased_dem, self.base_log_ratio, fired_log_ratios = biased_detector_error_model(
+                task.detector_error_model,
+                bias=self.bias,
+            )
+            self.log_ratio_table = bit_packed_log_ratio_table(fired_log_ratios)
+            self.biased_sampler = biased_dem.compile_sampler()
+
+    def _sample_loaded_task_dets(self, *, num_shots: int) -> Tuple[np.ndarray, np.ndarray]:
+        with self.timers.phase('sample'):
+            dets, actual_obs, errors = self.biased_sampler.sample(
+                shots=num_shots,
+                bit_packed=True,
+                return_errors=True,
+            )
+        with self.timers.phase('weights'):
+            self.last_weights = likelihood_ratios(
+                errors=errors,
+                base_log_ratio=self.base_log_ratio,
+                table=self.log_ratio_table,
+            )
+        self.timers.count('shots', num_shots)
+        self.timers.count('bytes_sampled', dets.nbytes + actual_obs.nbytes + errors.nbytes)
+        return dets, actual_obs
+
+    def _sample_loaded_task(self, *, num_shots: int) -> sinter.AnonTaskStats:
+        t0 = time.monotonic()
+        gaps, errors = self._sample_loaded_task_gaps(num_shots=num_shots)
+        with self.timers.phase('histogram'):
+            num_errors = np.count_nonzero(errors)
+            custom_counts = gap_histogram(gaps=gaps, errors=errors)
+            custom_counts += weighted_gap_histogram(gaps=gaps, errors=errors, weights=self.last_weights)
+        t1 = time.monotonic()
+
+        return sinter.AnonTaskStats(
+            shots=num_shots,
+            errors=num_errors,
+            seconds=t1 - t0,
+            custom_counts=custom_counts,
+        )
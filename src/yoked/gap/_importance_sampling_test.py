@@ -0,0 +1,180 @@
+import collections
+import math
+
+import numpy as np
+import pytest
+import sinter
+import stim
+
+import gen
+from yoked._yoked_memory_circuits import yoked_magic_memory_circuit
+from yoked.gap._gap_worker_handler import GapWorkHandler
+from yoked.gap._importance_sampling import (
+    WEIGHT_SCALE,
+    biased_detector_error_model,
+    bit_packed_log_ratio_table,
+    importance_weighted_stats,
+    ImportanceGapWorkHandler,
+    likelihood_ratios,
+    weighted_gap_histogram,
+)
+
+
+def test_biased_detector_error_model():
+    dem = stim.DetectorErrorModel('''
+        error(0.1) D0
+        REPEAT 2 {
+            error(0.3) D1 L0
+            shift_detectors 1
+        }
+        error(0) D0
+        detector D5
+    ''')
+    biased, base, fired = biased_detector_error_model(dem, bias=2)
+    assert biased == stim.DetectorErrorModel('''
+        error(0.2) D0
+        error(0.5) D1 L0
+        error(0.5) D2 L0
+        error(0) D2
+        detector D7
+    ''')
+    assert base == pytest.approx(math.log(0.9 / 0.8) + 2 * math.log(0.7 / 0.5))
+    np.testing.assert_allclose(fired, [
+        math.log(0.1 / 0.2) - math.log(0.9 / 0.8),
+        math.log(0.3 / 0.5) - math.log(0.7 / 0.5),
+        math.log(0.3 / 0.5) - math.log(0.7 / 0.5),
+        0,
+    ])
+
+    with pytest.raises(ValueError):
+        biased_detector_error_model(dem, bias=0)
+
+
+def test_likelihood_ratios_match_per_shot_products():
+    rng = np.random.default_rng(7)
+    ps = rng.random(21) * 0.01
+    qs = ps * 5
+    fired = np.log(ps / qs) - np.log((1 - ps) / (1 - qs))
+    base = float(np.sum(np.log((1 - ps) / (1 - qs))))
+    errors = rng.random((50, 21)) < 0.1
+
+    actual = likelihood_ratios(
+        errors=np.packbits(errors, axis=1, bitorder='little'),
+        base_log_ratio=base,
+        table=bit_packed_log_ratio_table(fired),
+    )
+    expected = [
+        np.prod(np.where(shot, ps / qs, (1 - ps) / (1 - qs)))
+        for shot in errors
+    ]
+    np.testing.assert_allclose(actual, expected)
+
+
+def test_weighted_gap_histogram():
+    assert weighted_gap_histogram(
+        gaps=np.array([], dtype=np.int64),
+        errors=np.array([], dtype=np.bool_),
+        weights=np.array([], dtype=np.float64),
+    ) == collections.Counter()
+
+    assert weighted_gap_histogram(
+        gaps=np.array([5, 5, -3, 5], dtype=np.int64),
+        errors=np.array([0, 1, 1, 0], dtype=np.bool_),
+        weights=np.array([0.25, 0.5, 2**-70, 0.125]),
+    ) == collections.Counter({
+        'WC5': WEIGHT_SCALE * 3 // 8,
+        'WE5': WEIGHT_SCALE // 2,
+    })
+
+
+def test_importance_weighted_stats():
+    plain = sinter.TaskStats(
+        strong_id='a',
+        decoder='pymatching',
+        json_metadata=None,
+        shots=10,
+        errors=1,
+        custom_counts=collections.Counter({'C5': 9, 'E1': 1}),
+    )
+    assert importance_weighted_stats(plain) is plain
+
+    weighted = importance_weighted_stats(sinter.TaskStats(
+        strong_id='a',
+        decoder='pymatching',
+        json_metadata=None,
+        shots=10,
+        errors=4,
+        discards=1,
+        seconds=2,
+        custom_counts=collections.Counter({
+            'C5': 5,
+            'E1': 4,
+            'WC5': WEIGHT_SCALE * 8,
+            'WE1': WEIGHT_SCALE // 4,
+            'WE2': WEIGHT_SCALE // 8,
+        }),
+    ))
+    assert weighted == sinter.TaskStats(
+        strong_id='a',
+        decoder='pymatching',
+        json_metadata=None,
+        shots=10 * WEIGHT_SCALE,
+        errors=WEIGHT_SCALE * 3 // 8,
+        discards=WEIGHT_SCALE,
+        seconds=2,
+        custom_counts=collections.Counter({
+            'C5': WEIGHT_SCALE * 8,
+            'E1': WEIGHT_SCALE // 4,
+            'E2': WEIGHT_SCALE // 8,
+        }),
+    )
+
+
+def test_importance_sampling_agrees_with_unbiased_sampling():
+    circuit = yoked_magic_memory_circuit(
+        patch_diameter=3,
+        rounds=3,
+        noise=gen.NoiseModel.uniform_depolarizing(2e-3),
+        yokes=True,
+        style='cz',
+        num_patches=1,
+    )
+    task = sinter.Task(
+        circuit=circuit,
+        detector_error_model=circuit.detector_error_model(decompose_errors=True),
+        decoder='pymatching',
+    )
+
+    unbiased = GapWorkHandler()
+    unbiased._load_task(task)
+    expected = sinter.AnonTaskStats()
+    for _ in range(4):
+        expected += unbiased._sample_loaded_task(num_shots=50000)
+
+    handler = ImportanceGapWorkHandler(bias=3)
+    handler._load_task(task)
+    biased = sinter.AnonTaskStats()
+    for _ in range(2):
+        biased += handler._sample_loaded_task(num_shots=25000)
+    assert np.mean(handler.last_weights) == pytest.approx(1, rel=0.1)
+    assert 'weights_seconds' in handler.take_metrics()
+    # The raw counts are from the biased distribution, which has many more errors.
+    assert biased.errors / biased.shots > 2 * expected.errors / expected.shots
+
+    actual = importance_weighted_stats(sinter.TaskStats(
+        strong_id='a',
+        decoder='pymatching',
+        json_metadata=None,
+        shots=biased.shots,
+        errors=biased.errors,
+        custom_counts=biased.custom_counts,
+    ))
+
+    def error_rate_above(stat, min_gap: int) -> float:
+        hits = sum(v for k, v in stat.custom_counts.items() if k[0] == 'E' and abs(int(k[1:])) >= min_gap)
+        return hits / stat.shots
+
+    assert actual.errors / actual.shots == pytest.approx(expected.errors / expected.shots, rel=0.25)
+    assert sum(actual.custom_counts.values()) / actual.shots == pytest.approx(1, rel=0.05)
+    for min_gap in [5, 10]:
+        assert error_rate_above(actual, min_gap) == pytest.approx(error_rate_above(expected, min_gap), rel=0.25)
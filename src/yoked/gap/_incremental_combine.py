@@ -0,0 +1,108 @@
+import hashlib
+import io
+import json
+import os
+import pathlib
+import shutil
+from typing import Dict, List, Optional, Union
+
+import sinter
+
+from yoked.gap._gap_stats_store import GapStatsStore, StoredGapStats, combine_stored_gap_stats
+
+_PREFIX_CHECK_BYTES = 4096
+
+
+def _prefix_hash(path: pathlib.Path, length: int) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read(min(length, _PREFIX_CHECK_BYTES))).hexdigest()
+
+
+class IncrementalCombiner:
+    """Combines the rows of an append-only sinter CSV file, one new chunk at a time.
+
+    Combining a save-resume file from scratch means parsing every row ever
+    written. Instead, the combiner keeps a snapshot directory containing:
+
+        state.json: How many bytes of the CSV file have been combined, a hash
+            of the start of the file (to notice it being replaced), and the
+            name of the totals directory.
+        totals_<offset>/: A `GapStatsStore` with one row per task, holding the
+            totals of the combined bytes.
+
+    Each update only parses the complete lines appended since the last one.
+    A new totals directory is written before state.json is replaced to point
+    at it, so an interrupted update leaves the previous snapshot intact.
+    """
+
+    def __init__(self, *, csv_path: Union[str, pathlib.Path], snapshot_dir: Union[str, pathlib.Path]):
+        self.csv_path = pathlib.Path(csv_path)
+        self.snapshot_dir = pathlib.Path(snapshot_dir)
+        self.state_path = self.snapshot_dir / 'state.json'
+
+    def _read_state(self) -> Optional[Dict]:
+        if not self.state_path.exists():
+            return None
+        state = json.loads(self.state_path.read_text())
+        if state['csv_path'] != str(self.csv_path.absolute()):
+            return None
+        if self.csv_path.stat().st_size < state['offset']:
+            return None
+        if _prefix_hash(self.csv_path, state['offset']) != state['prefix_sha256']:
+            return None
+        return state
+
+    def update(self) -> List[sinter.TaskStats]:
+        """Combines newly appended rows into the snapshot, and returns the totals."""
+        state = self._read_state()
+        if state is None:
+            offset = 0
+            header = None
+            totals = []
+        else:
+            offset = state['offset']
+            header = state['header']
+            totals = GapStatsStore(self.snapshot_dir / state['totals']).rows()
+
+        with open(self.csv_path, 'rb') as f:
+            f.seek(offset)
+            chunk = f.read()
+        # Leave a partially written last line for next time.
+        chunk = chunk[:chunk.rfind(b'\n') + 1]
+        new_offset = offset + len(chunk)
+        lines = chunk.decode('utf8').splitlines(keepends=True)
+        if header is None:
+            while lines and not lines[0].strip():
+                lines.pop(0)
+            if not lines:
+                return [row.to_task_stats() for row in totals]
+            header = lines.pop(0)
+        # Skip repeated headers (e.g. from runs that were told to print one).
+        lines = [line for line in lines if line.strip() and line.strip() != header.strip()]
+
+        if lines:
+            new_stats = sinter.read_stats_from_csv_files(io.StringIO(header + ''.join(lines)))
+            totals = combine_stored_gap_stats([*totals, *(StoredGapStats.from_task_stats(stat) for stat in new_stats)])
+        elif state is not None and new_offset == offset:
+            return [row.to_task_stats() for row in totals]
+
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        totals_name = f'totals_{new_offset}'
+        totals_dir = self.snapshot_dir / totals_name
+        shutil.rmtree(totals_dir, ignore_errors=True)
+        GapStatsStore(totals_dir).append(row.to_task_stats() for row in totals)
+        tmp_path = self.state_path.with_name('state.json.tmp')
+        tmp_path.write_text(json.dumps({
+            'csv_path': str(self.csv_path.absolute()),
+            'offset': new_offset,
+            'prefix_sha256': _prefix_hash(self.csv_path, new_offset),
+            'header': header,
+            'totals': totals_name,
+        }))
+        os.replace(tmp_path, self.state_path)
+
+        for entry in os.scandir(self.snapshot_dir):
+            if entry.is_dir() and entry.name.startswith('totals_') and entry.name != totals_name:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+        return [row.to_task_stats() for row in totals]
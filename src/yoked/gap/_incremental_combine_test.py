@@ -0,0 +1,70 @@
+import collections
+import json
+
+import sinter
+
+from yoked.gap._incremental_combine import IncrementalCombiner
+
+
+def _stat(strong_id: str, shots: int, custom_counts: dict) -> sinter.TaskStats:
+    return sinter.TaskStats(
+        strong_id=strong_id,
+        decoder='pymatching',
+        json_metadata={'d': 3},
+        shots=shots,
+        errors=sum(v for k, v in custom_counts.items() if k[0] == 'E'),
+        seconds=1.0,
+        custom_counts=collections.Counter(custom_counts),
+    )
+
+
+def _by_id(stats):
+    return sorted(stats, key=lambda e: e.strong_id)
+
+
+def test_incremental_combine(tmp_path):
+    csv_path = tmp_path / 'stats.csv'
+    combiner = IncrementalCombiner(csv_path=csv_path, snapshot_dir=tmp_path / 'snapshot')
+    with open(csv_path, 'w') as f:
+        print(sinter.CSV_HEADER, file=f)
+        print(_stat('a', 10, {'C1': 10}), file=f)
+        print(_stat('b', 5, {'E2': 5}), file=f)
+    assert _by_id(combiner.update()) == [_stat('a', 10, {'C1': 10}), _stat('b', 5, {'E2': 5})]
+    state = json.loads((tmp_path / 'snapshot' / 'state.json').read_text())
+    assert state['offset'] == csv_path.stat().st_size
+
+    # Only the new rows are parsed.
+    with open(csv_path, 'a') as f:
+        print(_stat('a', 7, {'C1': 3, 'E4': 4}), file=f)
+        # A partially written row is left for later.
+        print(str(_stat('c', 1, {'C0': 1}))[:20], file=f, end='')
+    assert _by_id(combiner.update()) == [
+        _stat('a', 10, {'C1': 10}) + _stat('a', 7, {'C1': 3, 'E4': 4}),
+        _stat('b', 5, {'E2': 5}),
+    ]
+    with open(csv_path, 'a') as f:
+        print(str(_stat('c', 1, {'C0': 1}))[20:], file=f)
+        print(sinter.CSV_HEADER, file=f)
+    expected = [
+        _stat('a', 10, {'C1': 10}) + _stat('a', 7, {'C1': 3, 'E4': 4}),
+        _stat('b', 5, {'E2': 5}),
+        _stat('c', 1, {'C0': 1}),
+    ]
+    assert _by_id(combiner.update()) == expected
+    assert _by_id(combiner.update()) == expected
+    assert len([p for p in (tmp_path / 'snapshot').iterdir() if p.name.startswith('totals_')]) == 1
+
+
+def test_incremental_combine_notices_replaced_file(tmp_path):
+    csv_path = tmp_path / 'stats.csv'
+    combiner = IncrementalCombiner(csv_path=csv_path, snapshot_dir=tmp_path / 'snapshot')
+    with open(csv_path, 'w') as f:
+        print(sinter.CSV_HEADER, file=f)
+        print(_stat('a', 10, {'C1': 10}), file=f)
+        print(_stat('b', 5, {'E2': 5}), file=f)
+    combiner.update()
+
+    with open(csv_path, 'w') as f:
+        print(sinter.CSV_HEADER, file=f)
+        print(_stat('c', 3, {'C1': 3}), file=f)
+    assert combiner.update() == [_stat('c', 3, {'C1': 3})]
@@ -0,0 +1,62 @@
+from typing import Any, Dict, Optional
+
+import sinter
+
+from yoked._memory_circuit_params import MemoryCircuitParams
+
+
+class MemoryCircuitTask(sinter.Task):
+    """A task whose circuit is generated by the worker that needs it.
+
+    Only the circuit's parameters are sent to workers, which call
+    `MemoryCircuitParams.make_circuit` instead of reading a circuit file
+    written by `tools/gen_memory_circuit`. The generated circuit is
+    deterministic, so the task's strong id is stable across runs and can be
+    used to resume collection.
+
+    The default metadata is `params.metadata()`. Unlike circuit files, it
+    doesn't include the qubit count ('q'), because that's only known once the
+    circuit is generated.
+    """
+
+    def __init__(
+            self,
+            *,
+            params: MemoryCircuitParams,
+            decoder: str = 'pymatching',
+            json_metadata: Any = None,
+            collection_options: sinter.CollectionOptions = sinter.CollectionOptions(),
+            _unvalidated_strong_id: Optional[str] = None,
+    ):
+        super().__init__(
+            decoder=decoder,
+            json_metadata=params.metadata() if json_metadata is None else json_metadata,
+            collection_options=collection_options,
+            skip_validation=True,
+            _unvalidated_strong_id=_unvalidated_strong_id,
+        )
+        self.params = params
+
+    @staticmethod
+    def from_params_dict(params: Dict[str, Any]) -> 'MemoryCircuitTask':
+        """Creates a task from a dictionary of `MemoryCircuitParams` fields.
+
+        An optional 'extra' entry holds more metadata to attach to the task
+        (like the `--extra` argument of `tools/gen_memory_circuit`).
+        """
+        params = dict(params)
+        extra = params.pop('extra', {})
+        circuit_params = MemoryCircuitParams(**params)
+        return MemoryCircuitTask(
+            params=circuit_params,
+            json_metadata={**circuit_params.metadata(), **extra},
+        )
+
+    def with_strong_id(self, strong_id: str) -> 'MemoryCircuitTask':
+        return MemoryCircuitTask(
+            params=self.params,
+            decoder=self.decoder,
+            json_metadata=self.json_metadata,
+            collection_options=self.collection_options,
+            _unvalidated_strong_id=strong_id,
+        )
@@ -0,0 +1,61 @@
+import io
+import pickle
+
+import sinter
+
+from yoked._memory_circuit_params import MemoryCircuitParams
+from yoked.gap._collection_worker_state import compute_strong_id
+from yoked.gap._gap_collect import collect_gap_stats
+from yoked.gap._memory_circuit_task import MemoryCircuitTask
+
+
+def test_memory_circuit_task_strong_id(tmp_path):
+    task = MemoryCircuitTask.from_params_dict({
+        'patch_diameter': 3,
+        'rounds': 3,
+        'noise_strength': 1e-3,
+        'patches': 1,
+        'yokes': 1,
+        'extra': {'tag': 'x'},
+    })
+    params = MemoryCircuitParams(patch_diameter=3, rounds=3, noise_strength=1e-3, patches=1, yokes=1)
+    assert task.params == params
+    assert task.json_metadata == {**params.metadata(), 'tag': 'x'}
+    assert task.circuit is None and task.circuit_path is None
+
+    # Workers generate the same circuit a circuit file would have contained.
+    circuit = params.make_circuit()
+    expected = sinter.Task(
+        circuit=circuit,
+        detector_error_model=circuit.detector_error_model(decompose_errors=True, approximate_disjoint_errors=True),
+        decoder='pymatching',
+        json_metadata=task.json_metadata,
+    ).strong_id()
+    copy = pickle.loads(pickle.dumps(task))
+    assert compute_strong_id(copy, dem_dir=str(tmp_path)) == expected
+    assert (tmp_path / f'{expected}.dem').exists()
+
+    known = task.with_strong_id(expected)
+    assert isinstance(known, MemoryCircuitTask)
+    assert known.params == params
+    assert known.strong_id() == expected
+
+
+def test_collect_gap_stats_from_params():
+    out = io.StringIO()
+    collect_gap_stats(
+        num_workers=1,
+        tasks=[{'patch_diameter': 3, 'rounds': 3, 'noise_strength': 1e-2, 'patches': 1, 'yokes': 1}],
+        num_shots=1000,
+        out=out,
+        print_progress=False,
+        print_header=True,
+        existing_data={},
+        worker_flush_period=5,
+    )
+
+    out.seek(0)
+    stats = sinter.read_stats_from_csv_files(out)
+    assert len(stats) == 1
+    assert stats[0].shots == 1000
+    assert stats[0].json_metadata['d'] == 3
@@ -0,0 +1,161 @@
+import collections
+import itertools
+import time
+from typing import Iterable, List
+
+import networkx
+import numpy as np
+import pymatching
+import sinter
+import stim
+
+from yoked.gap._gap_worker_handler import GapWorkHandler
+
+
+def yoke_detector_indices(circuit: stim.Circuit) -> List[int]:
+    """Finds the detectors comparing yoke checks, using their coordinates.
+
+    The memory circuit generators put every local detector at or near a
+    patch (no coordinate below -0.5), and put the yoke detectors off to the
+    side: at y=-2 in `yoked_magic_memory_circuit` and at x=-1-k in
+    `squareberg_magic_memory_circuit`.
+    """
+    result = []
+    for k, coords in circuit.get_detector_coordinates().items():
+        if len(coords) >= 2 and min(coords[0], coords[1]) <= -1:
+            result.append(k)
+    return sorted(result)
+
+
+def boundaryless_yoke_groups(*, matcher: pymatching.Matching, yoke_detectors: List[int]) -> List[List[int]]:
+    """Groups yoke detectors by which boundaryless matching graph component they are in.
+
+    Flipping an odd number of detectors within a component that has no
+    boundary produces a syndrome with no solution, so parity classes have to
+    flip an even number of yokes within each of these groups.
+    """
+    yoke_set = set(yoke_detectors)
+    num_detectors = matcher.num_detectors
+    graph = matcher.to_networkx()
+    result = []
+    for component in networkx.connected_components(graph):
+        if any(n >= num_detectors or graph.nodes[n].get('is_boundary') for n in component):
+            continue
+        group = sorted(yoke_set & component)
+        if group:
+            result.append(group)
+    return result
+
+
+def parity_class_flips(
+        *,
+        num_detectors: int,
+        yoke_detectors: List[int],
+        max_parity_classes: int,
+        boundaryless_groups: Iterable[Iterable[int]] = (),
+) -> List[np.ndarray]:
+    """Lists bit packed detector masks that move a shot into each parity class.
+
+    The first mask is always the empty mask (the class the shot is actually
+    in). The remaining masks flip combinations of yoke detectors, fewest
+    yokes first, stopping once there are `max_parity_classes` masks. This
+    keeps the 2**len(yoke_detectors) classes from blowing up for circuits
+    with many yokes. Combinations flipping an odd number of detectors from
+    one of the `boundaryless_groups` are unreachable, and are skipped.
+    """
+    if max_parity_classes < 2:
+        raise ValueError(f'{max_parity_classes=} < 2')
+    boundaryless_groups = [set(group) for group in boundaryless_groups]
+    num_det_bytes = (num_detectors + 7) // 8
+    result = []
+    for size in range(len(yoke_detectors) + 1):
+        for combo in itertools.combinations(yoke_detectors, size):
+            if len(result) == max_parity_classes:
+                return result
+            if any(len(group.intersection(combo)) % 2 for group in boundaryless_groups):
+                continue
+            flip = np.zeros(shape=num_det_bytes, dtype=np.uint8)
+            for d in combo:
+                flip[d // 8] ^= 1 << (d % 8)
+            result.append(flip)
+    return result
+
+
+def multi_gap_histogram(*, gaps: np.ndarray, errors: np.ndarray) -> collections.Counter:
+    """Counts shots by their vector of rounded gaps and logical error flag.
+
+    Args:
+        gaps: An int64 array of shape (shots, num_gaps). Entry [s, c] is the
+            rounded gap between parity class c+1 and the shot's own class.
+        errors: A bool array indicating which shots were logical errors.
+
+    Returns:
+        A counter with keys like 'E5_12' (error with gaps 5 and 12) and
+        'C-3_7', mapping to the number of shots in that bucket. When there is
+        one gap per shot the keys are the same as `gap_histogram`'s keys.
+    """
+    result = collections.Counter()
+    if len(gaps) == 0:
+        return result
+
+    rows = np.ascontiguousarray(np.concatenate([errors.reshape(-1, 1).astype(np.int64), gaps], axis=1))
+    distinct, counts = np.unique(rows.view(np.dtype((np.void, rows.shape[1] * 8))).ravel(), return_counts=True)
+    distinct = distinct.view(np.int64).reshape(-1, rows.shape[1])
+    for row, count in zip(distinct.tolist(), counts.tolist()):
+        result['CE'[row[0]] + '_'.join(str(g) for g in row[1:])] = count
+    return result
+
+
+class MultiGapWorkHandler(GapWorkHandler):
+    """Collects gaps against every parity class of the yoke checks.
+
+    Instead of only flipping the last detector, this finds all yoke detectors
+    by coordinate and decodes each shot once per parity class (see
+    `parity_class_flips`), recording a multi-dimensional gap histogram.
+    """
+
+    def __init__(
+            self,
+            *,
+            max_parity_classes: int = 16,
+            batch_seconds: float = 1,
+            max_batch_bytes: int = 2**28,
+    ):
+        super().__init__(batch_seconds=batch_seconds, max_batch_bytes=max_batch_bytes)
+        self.max_parity_classes = max_parity_classes
+
+    def _load_task(self, task: sinter.Task) -> None:
+        if self.loaded_key == task.strong_id():
+            return
+        yoke_detectors = yoke_detector_indices(task.circuit)
+        if not yoke_detectors:
+            raise ValueError(f'No yoke detectors found in the circuit of {task!r}.')
+        super()._load_task(task)
+        self.flips = parity_class_flips(
+            num_detectors=task.circuit.num_detectors,
+            yoke_detectors=yoke_detectors,
+            max_parity_classes=self.max_parity_classes,
+            boundaryless_groups=boundaryless_yoke_groups(matcher=self.matcher, yoke_detectors=yoke_detectors),
+        )
+        if len(self.flips) < 2:
+            raise ValueError(f'No reachable parity classes for the yoke detectors of {task!r}.')
+
+    def _sample_loaded_task(self, *, num_shots: int) -> sinter.AnonTaskStats:
+        assert self.loaded_key is not None
+
+        t0 = time.monotonic()
+        dets, actual_obs = self._sample_loaded_task_dets(num_shots=num_shots)
+        predictions, weights = self._decode_under_flips(dets)
+        with self.timers.phase('histogram'):
+            errors = np.any(predictions[0] != actual_obs, axis=1)
+            gaps = (weights[1:] - weights[0]) * self.decibels_per_w
+            gaps = np.round(gaps).astype(dtype=np.int64).T
+            custom_counts = multi_gap_histogram(gaps=gaps, errors=errors)
+        t1 = time.monotonic()
+
+        return sinter.AnonTaskStats(
+            shots=num_shots,
+            errors=np.count_nonzero(errors),
+            seconds=t1 - t0,
+            custom_counts=custom_counts,
+        )
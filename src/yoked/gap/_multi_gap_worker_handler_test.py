@@ -0,0 +1,112 @@
+import collections
+
+import numpy as np
+import pymatching
+import sinter
+
+import gen
+from yoked._squareberg_circuits import squareberg_magic_memory_circuit
+from yoked._yoked_memory_circuits import yoked_magic_memory_circuit
+from yoked.gap._gap_worker_handler import gap_histogram
+from yoked.gap._multi_gap_worker_handler import yoke_detector_indices, \
+    parity_class_flips, multi_gap_histogram, MultiGapWorkHandler, \
+    boundaryless_yoke_groups
+
+
+def test_yoke_detector_indices():
+    c = yoked_magic_memory_circuit(
+        patch_diameter=3,
+        rounds=3,
+        noise=gen.NoiseModel.si1000(1e-3),
+        style='cz',
+        yokes=2,
+        num_patches=2,
+    )
+    assert yoke_detector_indices(c) == [c.num_detectors - 2, c.num_detectors - 1]
+
+    c = squareberg_magic_memory_circuit(
+        patch_diameter=3,
+        rounds=2,
+        noise=gen.NoiseModel.si1000(1e-3),
+        style='cz',
+        num_patches=16,
+    )
+    yokes = yoke_detector_indices(c)
+    assert yokes == list(range(c.num_detectors - 16, c.num_detectors))
+
+    matcher = pymatching.Matching.from_detector_error_model(c.detector_error_model(decompose_errors=True))
+    groups = boundaryless_yoke_groups(matcher=matcher, yoke_detectors=yokes)
+    assert sorted(groups) == [yokes[:8], yokes[8:]]
+
+
+def test_parity_class_flips():
+    flips = parity_class_flips(num_detectors=12, yoke_detectors=[9, 11], max_parity_classes=16)
+    assert [list(f) for f in flips] == [
+        [0, 0],
+        [0, 2],
+        [0, 8],
+        [0, 10],
+    ]
+
+    flips = parity_class_flips(num_detectors=12, yoke_detectors=[0, 1, 2, 3, 4], max_parity_classes=7)
+    assert [list(f) for f in flips] == [
+        [0, 0],
+        [1, 0],
+        [2, 0],
+        [4, 0],
+        [8, 0],
+        [16, 0],
+        [3, 0],
+    ]
+
+    flips = parity_class_flips(
+        num_detectors=12,
+        yoke_detectors=[0, 1, 2, 3, 4],
+        max_parity_classes=5,
+        boundaryless_groups=[[0, 1, 2], [3, 4]],
+    )
+    assert [list(f) for f in flips] == [
+        [0, 0],
+        [3, 0],
+        [5, 0],
+        [6, 0],
+        [24, 0],
+    ]
+
+
+def test_multi_gap_histogram():
+    gaps = np.array([[5, 12], [5, 12], [-3, 7], [5, 12]], dtype=np.int64)
+    errors = np.array([0, 1, 0, 0], dtype=np.bool_)
+    assert multi_gap_histogram(gaps=gaps, errors=errors) == collections.Counter({
+        'C5_12': 2,
+        'E5_12': 1,
+        'C-3_7': 1,
+    })
+
+    rng = np.random.default_rng(5)
+    gaps = rng.integers(-300, 300, size=1000, dtype=np.int64)
+    errors = rng.random(1000) < 0.1
+    assert multi_gap_histogram(gaps=gaps.reshape(-1, 1), errors=errors) == gap_histogram(gaps=gaps, errors=errors)
+
+
+def test_multi_gap_work_handler():
+    circuit = yoked_magic_memory_circuit(
+        patch_diameter=3,
+        rounds=6,
+        noise=gen.NoiseModel.si1000(1e-3),
+        style='cz',
+        yokes=2,
+        num_patches=2,
+    )
+    task = sinter.Task(
+        circuit=circuit,
+        detector_error_model=circuit.detector_error_model(decompose_errors=True, approximate_disjoint_errors=True),
+        decoder='pymatching',
+    )
+    handler = MultiGapWorkHandler(max_parity_classes=3)
+    stats = handler.do_some_work(task, 100)
+    assert 0 < stats.shots <= 100
+    assert sum(stats.custom_counts.values()) == stats.shots
+    for key in stats.custom_counts:
+        assert key[0] in 'CE'
+        assert len(key[1:].split('_')) == 2
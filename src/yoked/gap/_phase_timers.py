@@ -0,0 +1,41 @@
+import collections
+import contextlib
+import time
+from typing import Dict, Iterator
+
+
+class PhaseTimers:
+    """Accumulates the time spent in named phases of work, along with named counters.
+
+    Used by work handlers to report where their time goes. Metrics are
+    reported as deltas: `take` returns everything accumulated since the
+    previous call.
+    """
+
+    def __init__(self):
+        self.seconds: collections.Counter = collections.Counter()
+        self.counts: collections.Counter = collections.Counter()
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - t0
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.counts[name] += amount
+
+    def take(self) -> Dict[str, float]:
+        """Returns and clears the accumulated metrics.
+
+        Returns:
+            A flat dictionary mapping '{phase}_seconds' to the time spent in
+            each phase, and each counter's name to its count.
+        """
+        result = {f'{name}_seconds': seconds for name, seconds in self.seconds.items()}
+        result.update(self.counts)
+        self.seconds.clear()
+        self.counts.clear()
+        return result
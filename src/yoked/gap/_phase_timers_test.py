@@ -0,0 +1,21 @@
+import time
+
+from yoked.gap._phase_timers import PhaseTimers
+
+
+def test_phase_timers():
+    timers = PhaseTimers()
+    assert timers.take() == {}
+    with timers.phase('a'):
+        time.sleep(0.01)
+    with timers.phase('a'):
+        pass
+    timers.count('shots', 5)
+    timers.count('shots', 2)
+    timers.count('calls')
+    metrics = timers.take()
+    assert metrics.keys() == {'a_seconds', 'shots', 'calls'}
+    assert metrics['a_seconds'] >= 0.01
+    assert metrics['shots'] == 7
+    assert metrics['calls'] == 1
+    assert timers.take() == {}
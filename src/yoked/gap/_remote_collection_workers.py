@@ -0,0 +1,182 @@
+import multiprocessing.connection
+import os
+import queue
+import socket
+import threading
+from typing import Any, Dict, Optional, Tuple, Union
+
+from yoked.gap._collection_worker_state import CollectionWorkerState
+
+Address = Union[str, Tuple[str, int]]
+
+
+def parse_address(text: str) -> Address:
+    """Parses 'host:port' into a TCP address, or anything else into a unix socket path."""
+    host, sep, port = text.rpartition(':')
+    if sep and port.isdigit():
+        return host, int(port)
+    return text
+
+
+class ConnectionOutputQueue:
+    """Lets a connection stand in for the `put` side of a queue."""
+
+    def __init__(self, connection: multiprocessing.connection.Connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+        self.broken = False
+
+    def put(self, item: Any) -> None:
+        if self.broken:
+            return
+        try:
+            with self.lock:
+                self.connection.send(item)
+        except (OSError, EOFError, ValueError):
+            # The other side went away. The reader notices that and reports it.
+            self.broken = True
+
+
+class ConnectionInputQueue:
+    """Lets a connection stand in for the `get_nowait` side of a queue."""
+
+    def __init__(self, connection: multiprocessing.connection.Connection):
+        self.connection = connection
+
+    def get_nowait(self) -> Any:
+        try:
+            if not self.connection.poll():
+                raise queue.Empty()
+            return self.connection.recv()
+        except (OSError, EOFError):
+            # The coordinator went away. Nothing left to do.
+            return 'stop', None
+
+
+def run_remote_collection_worker(*, address: Address, authkey: bytes, core_affinity: Optional[int] = None) -> None:
+    """Connects to a `CollectionManager` listening for remote workers, and works for it.
+
+    The manager sends the work handler and flush period to use, so the only
+    thing the worker needs to know is where the manager is. Circuits are sent
+    by the manager, so no shared filesystem is needed.
+    """
+    try:
+        if core_affinity is not None and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, {core_affinity})
+    except:
+        # If setting the core affinity fails, we keep going regardless.
+        pass
+
+    with multiprocessing.connection.Client(address, authkey=authkey) as connection:
+        connection.send(('hello', -1, {'host': socket.gethostname(), 'pid': os.getpid()}))
+        message_type, (flush_period, work_handler) = connection.recv()
+        assert message_type == 'configure'
+        worker = CollectionWorkerState(
+            flush_period=flush_period,
+            # The manager knows which worker a connection belongs to.
+            worker_id=-1,
+            work_handler=work_handler,
+            inp=ConnectionInputQueue(connection),
+            out=ConnectionOutputQueue(connection),
+        )
+        worker.run_message_loop()
+
+
+class RemoteWorkerListener:
+    """Accepts connections from remote workers on behalf of a `CollectionManager`.
+
+    Everything the remote workers send is forwarded into the manager's output
+    queue (with the worker id filled in), so the manager handles local and
+    remote workers the same way. New connections and lost connections are
+    announced with 'remote_worker_connected' and 'remote_worker_disconnected'
+    messages.
+    """
+
+    def __init__(self, *, address: Address, authkey: bytes, handshake_timeout: float = 30):
+        # Authentication happens during each connection's handshake, instead
+        # of inside `accept`, so that a stalled client can't block the others.
+        self.listener = multiprocessing.connection.Listener(address)
+        self.address = self.listener.address
+        self.authkey = authkey
+        self.handshake_timeout = handshake_timeout
+        self.pending: Dict[int, Tuple[multiprocessing.connection.Connection, Any]] = {}
+        self.lock = threading.Lock()
+        self.next_key = 0
+        self.closed = False
+
+    def start(self, *, output_queue: Any, flush_period: float, work_handler: Any) -> None:
+        threading.Thread(
+            target=self._accept_loop,
+            args=(output_queue, flush_period, work_handler),
+            daemon=True,
+        ).start()
+
+    def _accept_loop(self, output_queue: Any, flush_period: float, work_handler: Any) -> None:
+        while not self.closed:
+            try:
+                connection = self.listener.accept()
+            except OSError:
+                continue
+            threading.Thread(
+                target=self._handshake,
+                args=(connection, output_queue, flush_period, work_handler),
+                daemon=True,
+            ).start()
+
+    def _handshake(
+            self,
+            connection: multiprocessing.connection.Connection,
+            output_queue: Any,
+            flush_period: float,
+            work_handler: Any,
+    ) -> None:
+        """Authenticates a new connection and configures it, then announces it to the manager."""
+        try:
+            multiprocessing.connection.deliver_challenge(connection, self.authkey)
+            multiprocessing.connection.answer_challenge(connection, self.authkey)
+            if not connection.poll(self.handshake_timeout):
+                raise TimeoutError('No hello from remote worker.')
+            message_type, _, info = connection.recv()
+            assert message_type == 'hello'
+            connection.send(('configure', (flush_period, work_handler)))
+        except (OSError, EOFError, AssertionError, multiprocessing.AuthenticationError):
+            connection.close()
+            return
+        with self.lock:
+            if self.closed:
+                connection.close()
+                return
+            key = self.next_key
+            self.next_key += 1
+            self.pending[key] = connection, info
+        output_queue.put(('remote_worker_connected', -1, key))
+
+    def take_connection(self, key: int) -> Tuple[multiprocessing.connection.Connection, Any]:
+        with self.lock:
+            return self.pending.pop(key)
+
+    def start_forwarding(self, *, connection: multiprocessing.connection.Connection, worker_id: int, output_queue: Any) -> None:
+        def forward():
+            try:
+                while True:
+                    message_type, _, message_body = connection.recv()
+                    output_queue.put((message_type, worker_id, message_body))
+            except (OSError, EOFError):
+                pass
+            if not self.closed:
+                output_queue.put(('remote_worker_disconnected', worker_id, None))
+
+        threading.Thread(target=forward, daemon=True).start()
+
+    def close(self) -> None:
+        self.closed = True
+        try:
+            # Closing a socket doesn't wake up a thread blocked accepting on it.
+            self.listener._listener._socket.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+        self.listener.close()
+        with self.lock:
+            for connection, _ in self.pending.values():
+                connection.close()
+            self.pending.clear()
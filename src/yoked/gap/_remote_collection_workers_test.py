@@ -0,0 +1,134 @@
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import time
+
+import pytest
+import sinter
+import stim
+
+from yoked.gap._collection_manager import CollectionManager
+from yoked.gap._collection_work_handler import CollectionWorkHandler
+from yoked.gap._remote_collection_workers import RemoteWorkerListener, parse_address, run_remote_collection_worker
+
+
+def test_parse_address():
+    assert parse_address('localhost:1234') == ('localhost', 1234)
+    assert parse_address('10.0.0.2:80') == ('10.0.0.2', 80)
+    assert parse_address('/tmp/socket') == '/tmp/socket'
+
+
+def test_stalled_client_does_not_block_other_connections():
+    listener = RemoteWorkerListener(address=('localhost', 0), authkey=b'secret', handshake_timeout=0.5)
+    out = queue.Queue()
+    listener.start(output_queue=out, flush_period=1, work_handler=None)
+    try:
+        # Connects (and authenticates), but never says hello.
+        stalled = multiprocessing.connection.Client(listener.address, authkey=b'secret')
+        with multiprocessing.connection.Client(listener.address, authkey=b'secret') as client:
+            client.send(('hello', -1, {'host': 'test'}))
+            assert client.recv() == ('configure', (1, None))
+            assert out.get(timeout=5) == ('remote_worker_connected', -1, 0)
+            connection, info = listener.take_connection(0)
+            assert info == {'host': 'test'}
+            connection.close()
+
+        # The stalled client is dropped once its handshake times out.
+        assert stalled.poll(5)
+        with pytest.raises(EOFError):
+            stalled.recv()
+        stalled.close()
+        assert out.empty()
+    finally:
+        listener.close()
+
+
+class _CountingWorkHandler(CollectionWorkHandler):
+    def do_some_work(self, request: sinter.Task, max_shots: int) -> sinter.AnonTaskStats:
+        return sinter.AnonTaskStats(shots=min(max_shots, 100), errors=1)
+
+
+class _HangOnceWorkHandler(CollectionWorkHandler):
+    def __init__(self, marker_path: str):
+        self.marker_path = marker_path
+
+    def do_some_work(self, request: sinter.Task, max_shots: int) -> sinter.AnonTaskStats:
+        if not os.path.exists(self.marker_path):
+            with open(self.marker_path, 'w'):
+                pass
+            time.sleep(60)
+        return sinter.AnonTaskStats(shots=min(max_shots, 100), errors=1)
+
+
+def _run_with_remote_workers(manager: CollectionManager, num_remote_workers: int):
+    manager.start_workers()
+    ctx = multiprocessing.get_context('spawn')
+    processes = [
+        ctx.Process(
+            target=run_remote_collection_worker,
+            kwargs={'address': manager.remote_listener.address, 'authkey': b'secret'},
+        )
+        for _ in range(num_remote_workers)
+    ]
+    try:
+        for p in processes:
+            p.start()
+        manager.start_distributing_work()
+        manager.run_until_done()
+    finally:
+        for p in processes:
+            p.join(timeout=5)
+            if p.exitcode is None:
+                p.kill()
+                p.join()
+
+
+def test_remote_workers_only():
+    t0 = sinter.Task(
+        circuit=stim.Circuit('H 0'),
+        detector_error_model=stim.DetectorErrorModel(),
+        decoder='pymatching',
+        json_metadata={'a': 0},
+    )
+    log = []
+    manager = CollectionManager(
+        num_workers=0,
+        work_handler=_CountingWorkHandler(),
+        worker_flush_period=0.1,
+        tasks=[t0],
+        progress_callback=log.append,
+        existing_data={},
+        collection_options=sinter.CollectionOptions(max_shots=3000),
+        listen_address=('localhost', 0),
+        authkey=b'secret',
+    )
+    _run_with_remote_workers(manager, 2)
+    assert sum(e.shots for e in log if e is not None) == 3000
+    assert manager.worker_restarts == 0
+
+
+def test_remote_worker_lease_expires(tmp_path):
+    t0 = sinter.Task(
+        circuit=stim.Circuit('H 0'),
+        detector_error_model=stim.DetectorErrorModel(),
+        decoder='pymatching',
+        json_metadata={'a': 0},
+    )
+    log = []
+    manager = CollectionManager(
+        num_workers=0,
+        work_handler=_HangOnceWorkHandler(str(tmp_path / 'marker')),
+        worker_flush_period=0.1,
+        tasks=[t0],
+        progress_callback=log.append,
+        existing_data={},
+        collection_options=sinter.CollectionOptions(max_shots=3000),
+        listen_address=('localhost', 0),
+        authkey=b'secret',
+        remote_lease_seconds=1,
+        shutdown_timeout=1,
+    )
+    _run_with_remote_workers(manager, 2)
+    assert sum(e.shots for e in log if e is not None) == 3000
+    assert sum(w.disconnected for w in manager.worker_states) == 2
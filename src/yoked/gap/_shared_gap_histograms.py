@@ -0,0 +1,174 @@
+import collections
+import multiprocessing
+import multiprocessing.shared_memory
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+import sinter
+
+
+class SharedGapHistograms:
+    """Gap histograms that workers accumulate into shared memory.
+
+    Sending each flush through a queue means pickling a Counter with hundreds
+    of gap keys in the worker and unpickling it in the manager. Instead, each
+    (worker, task slot) pair owns a fixed-layout row of int64 values in a
+    shared memory block:
+
+        [shots, errors, discards, nanoseconds, C gap bins..., E gap bins...]
+
+    where the gap bins cover gaps from -max_abs_gap to +max_abs_gap. Workers
+    add their results into their row, and the manager reads the difference
+    between the row and what it saw last time. Custom count keys that don't
+    fit the layout (e.g. gaps outside the range, or multi-yoke keys) are
+    returned by `add` so that they can be sent the old way.
+
+    Each worker's rows are guarded by a lock, so the manager never sees a
+    partially written flush.
+    """
+
+    HEADER_LENGTH = 4
+
+    def __init__(
+            self,
+            *,
+            num_workers: int,
+            num_task_slots: int,
+            max_abs_gap: int,
+            locks: Sequence[Any],
+            shared_memory: multiprocessing.shared_memory.SharedMemory,
+    ):
+        self.num_workers = num_workers
+        self.num_task_slots = num_task_slots
+        self.max_abs_gap = max_abs_gap
+        self.locks = list(locks)
+        self.retired_locks: List[Any] = []
+        self.shared_memory = shared_memory
+        self.num_bins = 2 * max_abs_gap + 1
+        self.row_length = self.HEADER_LENGTH + 2 * self.num_bins
+        self.rows = np.ndarray(
+            shape=(num_workers, num_task_slots, self.row_length),
+            dtype=np.int64,
+            buffer=shared_memory.buf,
+        )
+        self._seen: Optional[np.ndarray] = None
+
+    @staticmethod
+    def create(*, num_workers: int, num_task_slots: int, max_abs_gap: int = 255) -> 'SharedGapHistograms':
+        """Allocates a zeroed shared memory block (and locks) for the histograms.
+
+        The locks are made for 'spawn' processes, which is what
+        `CollectionManager` uses. The caller is responsible for eventually
+        calling `unlink`.
+        """
+        if max_abs_gap < 0:
+            raise ValueError(f'{max_abs_gap=} < 0')
+        row_length = SharedGapHistograms.HEADER_LENGTH + 2 * (2 * max_abs_gap + 1)
+        size = max(1, num_workers * num_task_slots * row_length * 8)
+        shared_memory = multiprocessing.shared_memory.SharedMemory(create=True, size=size)
+        result = SharedGapHistograms(
+            num_workers=num_workers,
+            num_task_slots=num_task_slots,
+            max_abs_gap=max_abs_gap,
+            locks=[multiprocessing.get_context('spawn').Lock() for _ in range(num_workers)],
+            shared_memory=shared_memory,
+        )
+        result.rows[:] = 0
+        return result
+
+    def __getstate__(self):
+        # Only picklable while spawning a process (because of the locks).
+        return self.shared_memory.name, self.num_workers, self.num_task_slots, self.max_abs_gap, self.locks
+
+    def __setstate__(self, state):
+        name, num_workers, num_task_slots, max_abs_gap, locks = state
+        self.__init__(
+            num_workers=num_workers,
+            num_task_slots=num_task_slots,
+            max_abs_gap=max_abs_gap,
+            locks=locks,
+            shared_memory=multiprocessing.shared_memory.SharedMemory(name=name),
+        )
+
+    def _bin_index(self, key: str) -> Optional[int]:
+        if len(key) < 2 or key[0] not in 'CE':
+            return None
+        try:
+            gap = int(key[1:])
+        except ValueError:
+            return None
+        if not -self.max_abs_gap <= gap <= self.max_abs_gap:
+            return None
+        return self.HEADER_LENGTH + (key[0] == 'E') * self.num_bins + gap + self.max_abs_gap
+
+    def add(self, *, worker_id: int, slot: int, stats: sinter.AnonTaskStats) -> collections.Counter:
+        """Adds a worker's results into its row for a task.
+
+        Returns:
+            The custom counts that didn't fit into the row's layout.
+        """
+        overflow = collections.Counter()
+        indices = []
+        values = []
+        for key, value in stats.custom_counts.items():
+            index = self._bin_index(key)
+            if index is None:
+                overflow[key] += value
+            else:
+                indices.append(index)
+                values.append(value)
+
+        with self.locks[worker_id]:
+            row = self.rows[worker_id, slot]
+            row[0] += stats.shots
+            row[1] += stats.errors
+            row[2] += stats.discards
+            row[3] += int(round(stats.seconds * 1e9))
+            np.add.at(row, np.array(indices, dtype=np.int64), np.array(values, dtype=np.int64))
+        return overflow
+
+    def take_delta(self, *, worker_id: int, slot: int) -> sinter.AnonTaskStats:
+        """Returns what has been added to a row since the last time it was taken."""
+        if self._seen is None:
+            self._seen = np.zeros_like(self.rows)
+        with self.locks[worker_id]:
+            delta = self.rows[worker_id, slot] - self._seen[worker_id, slot]
+            self._seen[worker_id, slot] += delta
+
+        custom_counts = collections.Counter()
+        for index in np.flatnonzero(delta[self.HEADER_LENGTH:]).tolist():
+            is_error, bin_index = divmod(index, self.num_bins)
+            gap = bin_index - self.max_abs_gap
+            custom_counts[f'{"CE"[is_error]}{gap}'] = int(delta[self.HEADER_LENGTH + index])
+        return sinter.AnonTaskStats(
+            shots=int(delta[0]),
+            errors=int(delta[1]),
+            discards=int(delta[2]),
+            seconds=int(delta[3]) / 1e9,
+            custom_counts=custom_counts,
+        )
+
+    def reset_worker(self, *, worker_id: int) -> None:
+        """Clears a dead worker's rows, so that a replacement worker can use them.
+
+        Anything the dead worker added but never announced is discarded (its
+        shots are reassigned by the manager), and the worker's lock is replaced
+        in case it died while holding it. Call this after the old process is
+        gone and before the replacement is spawned, so it gets the new lock.
+        """
+        # Dropping the old lock would unlink its semaphore, but other workers
+        # that were spawned recently may not have opened it yet.
+        self.retired_locks.append(self.locks[worker_id])
+        self.locks[worker_id] = multiprocessing.get_context('spawn').Lock()
+        self.rows[worker_id] = 0
+        if self._seen is not None:
+            self._seen[worker_id] = 0
+
+    def close(self) -> None:
+        self.rows = None
+        self.shared_memory.close()
+
+    def unlink(self) -> None:
+        self.close()
+        self.shared_memory.unlink()
+
@@ -0,0 +1,90 @@
+import collections
+import multiprocessing
+
+import sinter
+
+from yoked.gap._shared_gap_histograms import SharedGapHistograms
+
+
+def test_add_and_take_delta():
+    h = SharedGapHistograms.create(num_workers=2, num_task_slots=3, max_abs_gap=10)
+    try:
+        overflow = h.add(worker_id=1, slot=2, stats=sinter.AnonTaskStats(
+            shots=100,
+            errors=3,
+            discards=1,
+            seconds=0.5,
+            custom_counts=collections.Counter({'C5': 90, 'E-2': 3, 'C-10': 6, 'C11': 1, 'C3_4': 1}),
+        ))
+        assert overflow == collections.Counter({'C11': 1, 'C3_4': 1})
+        assert h.take_delta(worker_id=1, slot=2) == sinter.AnonTaskStats(
+            shots=100,
+            errors=3,
+            discards=1,
+            seconds=0.5,
+            custom_counts=collections.Counter({'C5': 90, 'E-2': 3, 'C-10': 6}),
+        )
+        assert h.take_delta(worker_id=1, slot=2) == sinter.AnonTaskStats()
+        assert h.take_delta(worker_id=0, slot=2) == sinter.AnonTaskStats()
+
+        h.add(worker_id=1, slot=2, stats=sinter.AnonTaskStats(shots=5, custom_counts=collections.Counter({'C5': 5})))
+        delta = h.take_delta(worker_id=1, slot=2)
+        assert delta == sinter.AnonTaskStats(shots=5, custom_counts=collections.Counter({'C5': 5}))
+        assert all(type(v) is int for v in delta.custom_counts.values())
+    finally:
+        h.unlink()
+
+
+def test_reset_worker():
+    h = SharedGapHistograms.create(num_workers=2, num_task_slots=2, max_abs_gap=3)
+    try:
+        h.add(worker_id=0, slot=1, stats=sinter.AnonTaskStats(shots=3, custom_counts=collections.Counter({'C1': 3})))
+        h.add(worker_id=1, slot=1, stats=sinter.AnonTaskStats(shots=4, custom_counts=collections.Counter({'E2': 4})))
+        assert h.take_delta(worker_id=0, slot=1).shots == 3
+        # Added but never announced, before the worker died holding its lock.
+        h.add(worker_id=0, slot=1, stats=sinter.AnonTaskStats(shots=5))
+        old_lock = h.locks[0]
+        old_lock.acquire()
+
+        h.reset_worker(worker_id=0)
+        assert h.locks[0] is not old_lock
+        # Kept alive, since recently spawned workers may still need to open it.
+        assert h.retired_locks == [old_lock]
+        assert h.take_delta(worker_id=0, slot=1) == sinter.AnonTaskStats()
+        h.add(worker_id=0, slot=1, stats=sinter.AnonTaskStats(shots=2, custom_counts=collections.Counter({'C1': 2})))
+        assert h.take_delta(worker_id=0, slot=1) == sinter.AnonTaskStats(
+            shots=2,
+            custom_counts=collections.Counter({'C1': 2}),
+        )
+        assert h.take_delta(worker_id=1, slot=1) == sinter.AnonTaskStats(
+            shots=4,
+            custom_counts=collections.Counter({'E2': 4}),
+        )
+    finally:
+        h.unlink()
+
+
+def _add_in_other_process(h: SharedGapHistograms):
+    h.add(worker_id=0, slot=1, stats=sinter.AnonTaskStats(
+        shots=7,
+        errors=2,
+        custom_counts=collections.Counter({'C1': 5, 'E0': 2}),
+    ))
+    h.close()
+
+
+def test_shared_between_processes():
+    ctx = multiprocessing.get_context('spawn')
+    h = SharedGapHistograms.create(num_workers=1, num_task_slots=2, max_abs_gap=3)
+    try:
+        p = ctx.Process(target=_add_in_other_process, args=(h,))
+        p.start()
+        p.join()
+        assert p.exitcode == 0
+        assert h.take_delta(worker_id=0, slot=1) == sinter.AnonTaskStats(
+            shots=7,
+            errors=2,
+            custom_counts=collections.Counter({'C1': 5, 'E0': 2}),
+        )
+    finally:
+        h.unlink()